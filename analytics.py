@@ -0,0 +1,98 @@
+# analytics.py
+#
+# Результаты викторин в progress.db и заранее посчитанная статистика по ним.
+#
+# finish_quiz одной транзакцией пишет ответы на каждый вопрос (quiz_answers),
+# очки и награду пользователя, прогресс по уроку и обновляет агрегаты
+# question_stats и module_stats. Рейтинг, самые трудные вопросы и проходимость
+# модулей поэтому читаются по индексам из небольших таблиц, а не считаются
+# заново по всем ответам. Схема таблиц — в progress_db_setup.py.
+import os
+
+PASS_PERCENT = 80
+POINTS_PER_ANSWER = 5
+BADGE_POINTS = 50
+BADGE = 'Супер-ученик'
+# Вопросы, на которые ответили реже, в рейтинг трудных не попадают: одна ошибка — еще не статистика
+HARDEST_MIN_ATTEMPTS = int(os.getenv("HARDEST_MIN_ATTEMPTS", "20"))
+
+
+def _question_lesson(qid, module_id, lesson_id):
+    # id вопроса — module_id/lesson_id/ключ (content_catalog.question_key); в викторину попадают и вопросы
+    # на повторение из других уроков, поэтому их статистика относится к их собственному уроку
+    parts = qid.rsplit('/', 2)
+    return (parts[0], parts[1]) if len(parts) == 3 else (module_id, lesson_id)
+
+
+def record_quiz_result(c, user_id, module_id, lesson_id, results):
+    """Сохраняет итог викторины; ``results`` — [(id вопроса, выбранный вариант, верно ли), ...].
+
+    Выполняется одной транзакцией в пуле progress.db. Возвращает
+    (набранные очки, всего очков, получена ли новая награда).
+    """
+    total = len(results)
+    score = sum(1 for _, _, correct in results if correct)
+    passed = total and score * 100 >= PASS_PERCENT * total
+    points_earned = score * POINTS_PER_ANSWER
+
+    c.executemany('INSERT INTO quiz_answers (user_id, question_id, answer, correct) VALUES (?,?,?,?)',
+                  [(user_id, qid, answer, int(correct)) for qid, answer, correct in results])
+    c.executemany('''
+        INSERT INTO question_stats (question_id, module_id, lesson_id, attempts, wrong, error_rate)
+        VALUES (?1, ?2, ?3, 1, ?4, ?4)
+        ON CONFLICT(question_id) DO UPDATE SET
+          attempts = attempts + 1,
+          wrong = wrong + ?4,
+          error_rate = CAST(wrong + ?4 AS REAL) / (attempts + 1)
+    ''', [(qid, *_question_lesson(qid, module_id, lesson_id), int(not correct)) for qid, _, correct in results])
+    c.execute('''
+        INSERT INTO module_stats (module_id, quizzes, passed, score, questions) VALUES (?1, 1, ?2, ?3, ?4)
+        ON CONFLICT(module_id) DO UPDATE SET
+          quizzes = quizzes + 1, passed = passed + ?2, score = score + ?3, questions = questions + ?4
+    ''', (module_id, int(bool(passed)), score, total))
+
+    # Прогресс по уроку: однажды пройденный урок остается пройденным
+    c.execute('''
+        INSERT INTO progress (user_id, module_id, lesson_id, completed) VALUES (?,?,?,?)
+        ON CONFLICT(user_id, module_id, lesson_id) DO UPDATE SET completed = MAX(completed, excluded.completed)
+    ''', (user_id, module_id, lesson_id, int(bool(passed))))
+
+    c.execute('UPDATE users SET points = points + ? WHERE user_id=?', (points_earned, user_id))
+    row = c.execute('SELECT points FROM users WHERE user_id=?', (user_id,)).fetchone()
+    points = row[0] if row else points_earned
+    # Награда выдается один раз: повторную вставку отсекает первичный ключ (user_id, badge)
+    new_badge = points >= BADGE_POINTS and c.execute(
+        'INSERT INTO rewards (user_id, badge) VALUES (?,?) ON CONFLICT DO NOTHING', (user_id, BADGE)).rowcount == 1
+    return points_earned, points, new_badge
+
+
+# Запросы для администраторов: читают только агрегаты и индексы
+
+def leaderboard(c, limit=10):
+    """Первые ``limit`` пользователей по очкам: [(user_id, имя, очки), ...]."""
+    return c.execute('SELECT user_id, name, points FROM users ORDER BY points DESC LIMIT ?', (limit,)).fetchall()
+
+
+def user_rank(c, user_id):
+    """Место пользователя в рейтинге и его очки, или None."""
+    row = c.execute('SELECT points FROM users WHERE user_id=?', (user_id,)).fetchone()
+    if row is None:
+        return None
+    higher = c.execute('SELECT COUNT(*) FROM users WHERE points > ?', (row[0],)).fetchone()[0]
+    return higher + 1, row[0]
+
+
+def hardest_questions(c, limit=10, min_attempts=HARDEST_MIN_ATTEMPTS):
+    """Вопросы с наибольшей долей ошибок: [(id вопроса, попыток, ошибок, доля ошибок), ...]."""
+    return c.execute('SELECT question_id, attempts, wrong, error_rate FROM question_stats '
+                     'WHERE attempts >= ? ORDER BY error_rate DESC LIMIT ?', (min_attempts, limit)).fetchall()
+
+
+def module_pass_rates(c):
+    """Проходимость модулей: [(модуль, викторин, сдано, доля сданных, доля верных ответов), ...]."""
+    return c.execute('''
+        SELECT module_id, quizzes, passed,
+               CAST(passed AS REAL) / quizzes,
+               CAST(score AS REAL) / MAX(questions, 1)
+        FROM module_stats WHERE quizzes > 0 ORDER BY module_id
+    ''').fetchall()
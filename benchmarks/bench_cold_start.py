@@ -0,0 +1,203 @@
+# benchmarks/bench_cold_start.py
+#
+# Холодный старт бота: сколько стоит импорт модулей и через сколько после
+# запуска процесса пользователь получает первый ответ.
+#
+# 1. Профиль импорта: python -X importtime -c "import bot", отчет — общее время
+#    и самые тяжелые модули, которые импортирует bot.py.
+# 2. Время до первого обработанного обновления: бот запускается отдельным
+#    процессом на фейковом Bot API (benchmarks/fake_bot_api.py), сразу после
+#    запуска в очередь кладется /start; замеряется, когда бот обратился к API
+#    (getMe — импорт и сборка приложения закончены) и когда пришел ответ.
+#    Режим polling — python bot.py, режим webhook — python webhook.py, куда
+#    обновление отправляется POST-запросом, как от Telegram.
+#
+# Рабочая папка с базами общая для всех запусков: первый запуск — первый
+# деплой (создание баз, кэш content.json), остальные — перезапуск.
+#
+#   python benchmarks/bench_cold_start.py --runs 5
+#   python benchmarks/bench_cold_start.py --mode webhook --workers 2 --json cold_start.json
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_bot_api import start_fake_bot_api  # noqa: E402
+
+TOKEN = "123:bench"
+CHAT_ID = 5_000_000
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def bot_env(api_port, extra=None):
+    env = dict(os.environ)
+    env.update({"TELEGRAM_BOT_TOKEN": TOKEN, "TELEGRAM_BASE_URL": f"http://127.0.0.1:{api_port}/bot",
+                "METRICS_PORT": str(free_port()), "LOG_LEVEL": env.get("LOG_LEVEL", "WARNING")})
+    env.setdefault("OPENAI_API_KEY", "sk-bench")
+    env.setdefault("EMBEDDER", "hashing")
+    env.update(extra or {})
+    return env
+
+
+def import_profile(workdir, env, top):
+    """Время импорта bot.py и его самые тяжелые прямые импорты, мс."""
+    # Первый прогон прогревает файловый кэш ОС и __pycache__, замеряется второй
+    for _ in range(2):
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import bot"], cwd=workdir,
+                              env={**env, "PYTHONPATH": ROOT}, capture_output=True, text=True)
+    if proc.returncode:
+        sys.exit(f"import bot завершился с ошибкой:\n{proc.stderr[-2000:]}")
+    # Модуль печатается после всех своих импортов: прямые импорты bot — строки с отступом
+    # в один уровень между предыдущим модулем верхнего уровня (site и т.п.) и самим bot
+    total, children = 0.0, []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|", 2)
+        depth = (len(name) - len(name.lstrip())) // 2
+        name = name.strip()
+        if depth == 1:
+            children.append((name, int(cumulative) / 1000))
+        elif depth == 0:
+            if name == "bot":
+                total = int(cumulative) / 1000
+                break
+            children = []
+    children.sort(key=lambda item: -item[1])
+    return total, children[:top]
+
+
+def start_update(run):
+    chat_id = CHAT_ID + run
+    return {"update_id": run + 1, "message": {
+        "message_id": 1, "date": int(time.time()), "text": "/start",
+        "chat": {"id": chat_id, "type": "private", "first_name": "Bench"},
+        "from": {"id": chat_id, "is_bot": False, "first_name": "Bench"},
+        "entities": [{"type": "bot_command", "offset": 0, "length": 6}]}}
+
+
+async def first_update(args, workdir, run):
+    api_port = free_port()
+    runner, app = await start_fake_bot_api(port=api_port)
+    update = start_update(run)
+    chat_id = update["message"]["chat"]["id"]
+    extra = {}
+    if args.mode == "webhook":
+        webhook_port = free_port()
+        extra = {"WEBHOOK_URL": f"http://127.0.0.1:{webhook_port}/telegram", "WEBHOOK_PORT": str(webhook_port),
+                 "WEBHOOK_WORKERS": str(args.workers)}
+        command = [sys.executable, os.path.join(ROOT, "webhook.py")]
+    else:
+        command = [sys.executable, os.path.join(ROOT, "bot.py")]
+    log = open(os.path.join(workdir, f"bot-{args.mode}-{run}.log"), "wb")
+    t0 = time.perf_counter()
+    proc = subprocess.Popen(command, cwd=workdir, env=bot_env(api_port, extra), stdout=log, stderr=subprocess.STDOUT)
+    result = {}
+
+    async def watch():
+        while proc.poll() is None:
+            if "ready" not in result and app["stats"]["methods"].get("getMe"):
+                result["ready"] = time.perf_counter() - t0
+            if any(m["chat_id"] == chat_id for m in app["sent"]):
+                result["first_update"] = time.perf_counter() - t0
+                return
+            await asyncio.sleep(0.002)
+
+    try:
+        async with aiohttp.ClientSession() as session:
+            if args.mode == "webhook":
+                # Фронтальный сервер принимает обновление, как только слушает порт; обработчики еще запускаются
+                async def deliver():
+                    while proc.poll() is None:
+                        try:
+                            async with session.post(extra["WEBHOOK_URL"], json=update) as resp:
+                                if resp.status == 200:
+                                    result["accepted"] = time.perf_counter() - t0
+                                    return
+                        except aiohttp.ClientConnectionError:
+                            pass
+                        await asyncio.sleep(0.005)
+            else:
+                async def deliver():
+                    async with session.post(f"http://127.0.0.1:{api_port}/_updates", json=update):
+                        pass
+            try:
+                await asyncio.wait_for(asyncio.gather(watch(), deliver()), args.timeout)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        proc.send_signal(signal.SIGINT)
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, proc.wait, 30)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        log.close()
+        await runner.cleanup()
+    if "first_update" not in result:
+        with open(log.name, "rb") as f:
+            tail = f.read()[-3000:].decode("utf-8", "replace")
+        sys.exit(f"Бот не ответил за {args.timeout} с (запуск {run + 1}), журнал {log.name}:\n{tail}")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Профиль импорта и время до первого обработанного обновления")
+    parser.add_argument("--mode", choices=("polling", "webhook"), default="polling")
+    parser.add_argument("--workers", type=int, default=2, help="WEBHOOK_WORKERS в режиме webhook")
+    parser.add_argument("--runs", type=int, default=5, help="запусков бота; первый — на пустых базах")
+    parser.add_argument("--top", type=int, default=12, help="сколько тяжелых импортов показать")
+    parser.add_argument("--timeout", type=float, default=60.0, help="сколько ждать ответа бота, с")
+    parser.add_argument("--json", help="сохранить отчет в JSON-файл")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_cold_start_")
+    os.makedirs(os.path.join(workdir, "database"))
+    shutil.copy(os.path.join(ROOT, "content.json"), workdir)
+    try:
+        total, heaviest = import_profile(workdir, bot_env(free_port()), args.top)
+        print(f"import bot: {total:.0f} мс, тяжелее всего:")
+        for name, ms in heaviest:
+            print(f"  {name:<28} {ms:7.1f} мс")
+
+        runs = [asyncio.run(first_update(args, workdir, run)) for run in range(args.runs)]
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"\nрежим {args.mode}: от запуска процесса, мс")
+    for i, r in enumerate(runs):
+        phases = [f"{key} {r[key] * 1000:.0f}" for key in ("accepted", "ready", "first_update") if key in r]
+        print(f"  {'первый деплой' if i == 0 else f'перезапуск {i}':<14} " + ", ".join(phases))
+    restarts = [r["first_update"] for r in runs[1:]] or [runs[0]["first_update"]]
+    median = statistics.median(restarts)
+    print(f"  первый ответ после перезапуска: медиана {median * 1000:.0f} мс")
+
+    if args.json:
+        report = {"mode": args.mode, "import_ms": round(total, 1),
+                  "heaviest_imports_ms": {name: round(ms, 1) for name, ms in heaviest},
+                  "runs": [{key: round(value * 1000, 1) for key, value in r.items()} for r in runs],
+                  "first_update_median_ms": round(median * 1000, 1)}
+        path = args.json if os.path.isabs(args.json) else os.path.join(ROOT, args.json)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+# benchmarks/bench_llm_gateway.py
+#
+# Проверка LLMGateway против локального фейкового OpenAI-сервера:
+# N одновременных "пользователей" задают вопрос, параллельно работает
+# "викторина" — короткие корутины, задержку которых мы измеряем.
+#
+#   python benchmarks/bench_llm_gateway.py --users 150 --concurrency 8 --latency 0.5
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import openai  # noqa: E402
+
+from benchmarks.fake_openai_server import start_fake_openai_server  # noqa: E402
+from llm_gateway import LLMGateway, LLMQueueFull  # noqa: E402
+
+
+async def quiz_traffic(stop, lags):
+    # Имитация обработки callback'ов викторины: каждые 10 мс короткий обработчик
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        await asyncio.sleep(0.01)
+        lags.append(time.perf_counter() - t0 - 0.01)
+
+
+async def run(args):
+    runner, app = await start_fake_openai_server(port=args.port, latency=args.latency)
+    openai.api_base = f"http://127.0.0.1:{args.port}/v1"
+    openai.api_key = "test"
+    gateway = LLMGateway(max_concurrency=args.concurrency, max_queue=args.max_queue, timeout=args.timeout)
+
+    queued = 0
+    rejected = 0
+
+    async def on_queued(position):
+        nonlocal queued
+        queued += 1
+
+    async def ask(i):
+        nonlocal rejected
+        t0 = time.perf_counter()
+        try:
+            await gateway.chat([{"role": "user", "content": f"вопрос {i}"}], on_queued=on_queued)
+        except LLMQueueFull:
+            rejected += 1
+            return None
+        return time.perf_counter() - t0
+
+    stop = asyncio.Event()
+    lags = []
+    quiz_task = asyncio.create_task(quiz_traffic(stop, lags))
+    t0 = time.perf_counter()
+    results = await asyncio.gather(*(ask(i) for i in range(args.users)))
+    elapsed = time.perf_counter() - t0
+    stop.set()
+    await quiz_task
+    await runner.cleanup()
+
+    latencies = sorted(r for r in results if r is not None)
+    print(f"пользователей: {args.users}, лимит: {args.concurrency}, очередь: {args.max_queue}")
+    print(f"всего: {elapsed:.2f} с; в очереди ждали: {queued}; отклонено: {rejected}")
+    print(f"макс. одновременных запросов на сервере: {app['stats']['max_in_flight']}")
+    if latencies:
+        print(f"ответ p50: {statistics.median(latencies):.3f} с, "
+              f"p99: {latencies[int(len(latencies) * 0.99) - 1]:.3f} с")
+    if lags:
+        lags.sort()
+        print(f"задержка цикла событий (викторина) p99: {lags[int(len(lags) * 0.99) - 1] * 1000:.1f} мс")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=150)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--max-queue", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--port", type=int, default=8089)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+# benchmarks/bench_rate_limit.py
+#
+# Отправка сообщений викторины через настоящий клиент Bot API (telegram.ext.ExtBot)
+# на фейковый Bot API с имитацией ограничений Telegram (ответы 429).
+#
+# N учеников одновременно отвечают на вопросы; на каждый ответ бот отправляет
+# либо вердикт и следующий вопрос отдельными запросами (как раньше), либо одну
+# правку сообщения. Каждый вариант прогоняется без ограничителя частоты и с
+# rate_limiter.TelegramRateLimiter. Отчет: запросов, ответов 429 на сервере,
+# ошибок у бота, время ответа ученику (p50/p99) и ожидание в ограничителе
+# (то же ожидание бот отдает в метрике telegram_send_wait_seconds).
+#
+#   python benchmarks/bench_rate_limit.py --users 100 --answers 10 --chat-limit 3 --global-limit 30
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from telegram.error import RetryAfter  # noqa: E402
+from telegram.ext import ExtBot  # noqa: E402
+from telegram.request import HTTPXRequest  # noqa: E402
+
+from fake_bot_api import start_fake_bot_api  # noqa: E402
+from rate_limiter import TelegramRateLimiter  # noqa: E402
+
+TOKEN = "123:bench"
+
+
+async def run(args, coalesce, limited, port):
+    runner, app = await start_fake_bot_api(port=port, latency=args.latency, chat_limit=args.chat_limit,
+                                           global_limit=args.global_limit, retry_after=args.retry_after)
+    limiter = TelegramRateLimiter() if limited else None
+    bot = ExtBot(TOKEN, base_url=f"http://127.0.0.1:{port}/bot",
+                 request=HTTPXRequest(connection_pool_size=256, pool_timeout=60),
+                 rate_limiter=limiter)
+    latencies = []
+    errors = {"retry_after": 0, "other": 0}
+    rnd = random.Random(args.seed)
+
+    async def student(chat_id):
+        # Ученики открывают викторину вразнобой в пределах первой паузы
+        await asyncio.sleep(rnd.uniform(0, args.think_max))
+        try:
+            message = await bot.send_message(chat_id, "Готовы ответить на вопросы?")
+        except RetryAfter:
+            errors["retry_after"] += args.answers
+            return
+        for i in range(args.answers):
+            await asyncio.sleep(rnd.uniform(args.think_min, args.think_max))
+            t0 = time.perf_counter()
+            try:
+                if coalesce:
+                    await bot.edit_message_text(f"Верно!\n\nВопрос {i + 1}", chat_id, message.message_id)
+                else:
+                    await bot.edit_message_text("Верно!", chat_id, message.message_id)
+                    message = await bot.send_message(chat_id, f"Вопрос {i + 1}")
+            except RetryAfter:
+                errors["retry_after"] += 1
+                continue
+            except Exception:
+                errors["other"] += 1
+                continue
+            latencies.append(time.perf_counter() - t0)
+
+    async with bot:
+        t0 = time.perf_counter()
+        await asyncio.gather(*(student(1_000_000 + i) for i in range(args.users)))
+        elapsed = time.perf_counter() - t0
+    await runner.cleanup()
+
+    latencies.sort()
+    n = len(latencies)
+    title = ("одна правка" if coalesce else "вердикт + новый вопрос") + (", с ограничителем" if limited else ", без ограничителя")
+    print(f"\n{title}: {elapsed:.1f} с, запросов к API {app['stats']['requests']}, ответов 429 {app['stats']['flood']}")
+    print(f"  ответов доставлено {n} из {args.users * args.answers}, ошибок RetryAfter {errors['retry_after']}, "
+          f"прочих {errors['other']}")
+    if n:
+        print(f"  время ответа ученику: p50 {latencies[n // 2] * 1000:.0f} мс, "
+              f"p99 {latencies[min(n - 1, int(n * 0.99))] * 1000:.0f} мс")
+    if limiter is not None:
+        stats = limiter.stats
+        print(f"  ожидание в ограничителе: среднее {stats['wait_seconds'] / max(stats['requests'], 1) * 1000:.0f} мс, "
+              f"макс. {stats['wait_max'] * 1000:.0f} мс, повторов после 429: {stats['retries']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ограничитель частоты Bot API на фейковом сервере с 429")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--answers", type=int, default=10, help="ответов на ученика")
+    parser.add_argument("--think-min", type=float, default=2.0, help="мин. пауза перед ответом, с")
+    parser.add_argument("--think-max", type=float, default=8.0, help="макс. пауза перед ответом, с")
+    parser.add_argument("--latency", type=float, default=0.02, help="задержка фейкового Bot API, с")
+    parser.add_argument("--chat-limit", type=int, default=3, help="сообщений в секунду на чат до 429")
+    parser.add_argument("--global-limit", type=int, default=30, help="сообщений в секунду на бота до 429")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--port", type=int, default=8091)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    for coalesce in (False, True):
+        for limited in (False, True):
+            asyncio.run(run(args, coalesce, limited, args.port))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+# benchmarks/bench_schema.py
+#
+# Планы и время запросов бота к SQLite на базах прежней схемы (без ключей и
+# индексов, user_version = 0) и после миграции на месте (migrations.py).
+#
+# Во временной папке создаются users.db с --dialogues строками диалогов и
+# progress.db с --users пользователями, прогрессом и наградами (с дублями,
+# как их оставлял прежний код). Для каждого запроса печатаются EXPLAIN QUERY
+# PLAN и среднее время до и после миграции, а также время самой миграции.
+#
+#   python benchmarks/bench_schema.py --dialogues 2000000 --users 20000
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import analytics  # noqa: E402
+import progress_db_setup  # noqa: E402
+import stat_admin  # noqa: E402
+from migrations import migrate  # noqa: E402
+from storage import Database  # noqa: E402
+
+MODULES = [(f"module{m}", f"lesson{l}") for m in range(1, 6) for l in range(1, 6)]
+
+# (база, название, SQL, параметры(user_id, модуль, урок))
+QUERIES = [
+    ("users", "история для памяти диалога",
+     'SELECT role, message, timestamp FROM dialogues WHERE user_id=? AND timestamp > ? '
+     'ORDER BY timestamp DESC, id DESC LIMIT 12', lambda u, m, l: (u, "")),
+    ("users", "число реплик пользователя",
+     'SELECT COUNT(*) FROM dialogues WHERE user_id=?', lambda u, m, l: (u,)),
+    ("progress", "прогресс по уроку",
+     'SELECT completed FROM progress WHERE user_id=? AND module_id=? AND lesson_id=?', lambda u, m, l: (u, m, l)),
+    ("progress", "есть ли награда",
+     'SELECT 1 FROM rewards WHERE user_id=? AND badge=?', lambda u, m, l: (u, analytics.BADGE)),
+    ("progress", "рейтинг (/top)",
+     'SELECT user_id, name, points FROM users ORDER BY points DESC LIMIT 10', lambda u, m, l: ()),
+    ("progress", "место пользователя (/rank)",
+     'SELECT COUNT(*) FROM users WHERE points > (SELECT points FROM users WHERE user_id=?)', lambda u, m, l: (u,)),
+]
+
+
+def create_legacy(users_path, progress_path, dialogues, users):
+    """Базы в том виде, в каком их создавал бот до миграций: без индексов и ключей."""
+    conn = sqlite3.connect(users_path)
+    conn.execute('''CREATE TABLE dialogues (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, role TEXT,
+                    message TEXT, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)''')
+    # Реплики перемешаны по пользователям, время растет вместе с id — как в настоящем журнале
+    conn.execute('''
+        INSERT INTO dialogues (user_id, role, message, timestamp)
+        WITH RECURSIVE s(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM s WHERE i < ? - 1)
+        SELECT abs(random()) % ?, CASE i % 2 WHEN 0 THEN 'user' ELSE 'assistant' END,
+               printf('Реплика %d: какой уровень сахара в крови считается нормальным после еды?', i),
+               datetime(1700000000 + i * 5, 'unixepoch')
+        FROM s
+    ''', (dialogues, users))
+    conn.commit()
+    conn.close()
+
+    conn = sqlite3.connect(progress_path)
+    conn.execute('''CREATE TABLE users (user_id INTEGER PRIMARY KEY, name TEXT, diabetes_type TEXT,
+                    knowledge_level INTEGER, points INTEGER DEFAULT 0)''')
+    conn.execute('CREATE TABLE progress (user_id INTEGER, module_id TEXT, lesson_id TEXT, completed INTEGER DEFAULT 0)')
+    conn.execute('CREATE TABLE rewards (user_id INTEGER, badge TEXT)')
+    rnd = random.Random(1)
+    conn.executemany('INSERT INTO users VALUES (?,?,?,?,?)',
+                     ((u, f"user{u}", "СД1", 3, rnd.randrange(0, 500)) for u in range(users)))
+    # Повторные прохождения уроков и выдачи наград — дубли, которые миграция должна свернуть
+    conn.executemany('INSERT INTO progress VALUES (?,?,?,?)',
+                     ((u, *rnd.choice(MODULES), rnd.randrange(2)) for u in range(users) for _ in range(8)))
+    conn.executemany('INSERT INTO rewards VALUES (?,?)',
+                     ((u, analytics.BADGE) for u in range(users) for _ in range(rnd.randrange(3))))
+    conn.commit()
+    conn.close()
+
+
+def run_queries(paths, users, repeat):
+    results = {}
+    conns = {name: sqlite3.connect(path) for name, path in paths.items()}
+    rnd = random.Random(2)
+    for db, title, sql, params in QUERIES:
+        c = conns[db]
+        sample = [params(rnd.randrange(users), *rnd.choice(MODULES)) for _ in range(repeat)]
+        plan = [row[3] for row in c.execute('EXPLAIN QUERY PLAN ' + sql, sample[0])]
+        t0 = time.perf_counter()
+        for args in sample:
+            c.execute(sql, args).fetchall()
+        results[title] = (plan, (time.perf_counter() - t0) / repeat * 1000)
+    for c in conns.values():
+        c.close()
+    return results
+
+
+def count(path, sql):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute(sql).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Запросы к SQLite до и после миграции схемы")
+    parser.add_argument("--dialogues", type=int, default=2_000_000, help="строк в dialogues")
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=50, help="повторов каждого запроса")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = {"users": os.path.join(tmp, "users.db"), "progress": os.path.join(tmp, "progress.db")}
+        t0 = time.perf_counter()
+        create_legacy(paths["users"], paths["progress"], args.dialogues, args.users)
+        print(f"базы прежней схемы созданы за {time.perf_counter() - t0:.1f} с: "
+              f"{args.dialogues} реплик, {args.users} пользователей")
+        before = run_queries(paths, args.users, args.repeat)
+        rows_before = {table: count(paths["progress"], f'SELECT COUNT(*) FROM {table}') for table in ("progress", "rewards")}
+
+        for name, migrations in (("users", stat_admin.MIGRATIONS), ("progress", progress_db_setup.MIGRATIONS)):
+            db = Database(paths[name])
+            t0 = time.perf_counter()
+            old, new = migrate(db, migrations)
+            print(f"миграция {name}.db с версии {old} до {new}: {time.perf_counter() - t0:.2f} с")
+            db.close()
+        for table, n in rows_before.items():
+            print(f"  {table}: {n} строк -> {count(paths['progress'], f'SELECT COUNT(*) FROM {table}')} после удаления дублей")
+
+        after = run_queries(paths, args.users, args.repeat)
+        for title, (plan, ms) in before.items():
+            new_plan, new_ms = after[title]
+            print(f"\n{title}: {ms:.3f} мс -> {new_ms:.3f} мс ({ms / max(new_ms, 1e-9):.0f}x)")
+            print("  до:    " + "; ".join(plan))
+            print("  после: " + "; ".join(new_plan))
+
+        # Запись итога викторины после миграции: UPSERT прогресса и награды в одной транзакции
+        db = Database(paths["progress"])
+        rnd = random.Random(3)
+        t0 = time.perf_counter()
+        for _ in range(args.repeat):
+            module_id, lesson_id = rnd.choice(MODULES)
+            results = [(f"{module_id}:{lesson_id}:{q}", 0, rnd.random() < 0.8) for q in range(5)]
+            db.transaction_sync(analytics.record_quiz_result, rnd.randrange(args.users), module_id, lesson_id, results)
+        print(f"\nзапись итога викторины (record_quiz_result): "
+              f"{(time.perf_counter() - t0) / args.repeat * 1000:.3f} мс на транзакцию")
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+# benchmarks/bench_storage.py
+#
+# Сравнение задержки обработчиков при работе с SQLite "до" (новое соединение
+# sqlite3 на каждый вызов прямо в цикле событий) и "после" (storage.Database:
+# пул соединений, WAL, выполнение на потоках пула).
+#
+# Каждый из N пользователей выполняет сценарий, повторяющий обращения к БД в
+# bot.py: регистрация, два сообщения в диалоге (по две записи в dialogues)
+# и завершение викторины. Задержка обработчика считается от запланированного
+# момента его запуска до завершения, поэтому учитывает и время, когда цикл
+# событий был заблокирован чужими обработчиками.
+#
+#   python benchmarks/bench_storage.py --users 200 --rounds 5
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import Database  # noqa: E402
+
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS users (user_id INTEGER PRIMARY KEY, name TEXT, diabetes_type TEXT,
+       knowledge_level INTEGER, points INTEGER DEFAULT 0)''',
+    '''CREATE TABLE IF NOT EXISTS rewards (user_id INTEGER, badge TEXT)''',
+    '''CREATE TABLE IF NOT EXISTS dialogues (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER,
+       role TEXT, message TEXT, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)''',
+]
+
+
+def create_schema(path):
+    conn = sqlite3.connect(path)
+    for sql in SCHEMA:
+        conn.execute(sql)
+    conn.commit()
+    conn.close()
+
+
+def award(c, user_id, points):
+    c.execute('UPDATE users SET points = points + ? WHERE user_id=?', (points, user_id))
+    p = c.execute('SELECT points FROM users WHERE user_id=?', (user_id,)).fetchone()[0]
+    if p >= 50 and not c.execute('SELECT badge FROM rewards WHERE user_id=? AND badge=?', (user_id, 'b')).fetchone():
+        c.execute('INSERT INTO rewards (user_id, badge) VALUES (?,?)', (user_id, 'b'))
+
+
+class Legacy:
+    """Прежний подход: sqlite3.connect + commit + close на каждый вызов, в цикле событий."""
+
+    def __init__(self, path):
+        self.path = path
+
+    async def register(self, user_id):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute('INSERT OR IGNORE INTO users (user_id, name, diabetes_type, knowledge_level, points) '
+                     'VALUES (?,?,?,?,?)', (user_id, 'u', 'СД1', 3, 0))
+        conn.commit()
+        conn.close()
+
+    async def log(self, user_id, role, message):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute('INSERT INTO dialogues (user_id, role, message) VALUES (?,?,?)', (user_id, role, message))
+        conn.commit()
+        conn.close()
+
+    async def finish(self, user_id):
+        conn = sqlite3.connect(self.path, timeout=30)
+        award(conn, user_id, 25)
+        conn.commit()
+        conn.close()
+
+
+class Pooled:
+    def __init__(self, path):
+        self.db = Database(path)
+
+    async def register(self, user_id):
+        await self.db.execute('INSERT OR IGNORE INTO users (user_id, name, diabetes_type, knowledge_level, points) '
+                              'VALUES (?,?,?,?,?)', (user_id, 'u', 'СД1', 3, 0))
+
+    async def log(self, user_id, role, message):
+        await self.db.execute('INSERT INTO dialogues (user_id, role, message) VALUES (?,?,?)', (user_id, role, message))
+
+    async def finish(self, user_id):
+        await self.db.transaction(award, user_id, 25)
+
+
+async def simulate(backend, users, rounds, think):
+    latencies = {"register": [], "handle_message": [], "finish_quiz": []}
+    loop = asyncio.get_running_loop()
+
+    async def timed(name, coro_fn, *args):
+        # Обработчик "должен" запуститься после паузы пользователя; если цикл
+        # событий занят, фактический запуск опаздывает — это тоже задержка
+        delay = random.uniform(0, think)
+        planned = loop.time() + delay
+        await asyncio.sleep(delay)
+        await coro_fn(*args)
+        latencies[name].append(loop.time() - planned)
+
+    async def dialogue(user_id):
+        await backend.log(user_id, "user", "Какой нормальный сахар?")
+        await backend.log(user_id, "assistant", "3.9–5.5 ммоль/л натощак.")
+
+    async def user(user_id):
+        await timed("register", backend.register, user_id)
+        for _ in range(rounds):
+            await timed("handle_message", dialogue, user_id)
+            await timed("finish_quiz", backend.finish, user_id)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(user(i) for i in range(users)))
+    return time.perf_counter() - t0, latencies
+
+
+def pct(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] * 1000
+
+
+def report(title, elapsed, latencies):
+    print(f"\n{title}: {elapsed:.2f} с")
+    for name, values in latencies.items():
+        print(f"  {name:15s} n={len(values):5d}  p50={pct(values, 0.5):8.2f} мс  "
+              f"p99={pct(values, 0.99):8.2f} мс  среднее={statistics.mean(values) * 1000:8.2f} мс")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--think", type=float, default=0.2, help="макс. пауза между действиями пользователя, с")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_path = os.path.join(tmp, "legacy.db")
+        pooled_path = os.path.join(tmp, "pooled.db")
+        create_schema(legacy_path)
+        create_schema(pooled_path)
+
+        random.seed(1)
+        elapsed, latencies = asyncio.run(simulate(Legacy(legacy_path), args.users, args.rounds, args.think))
+        report("До (соединение на вызов в цикле событий)", elapsed, latencies)
+
+        random.seed(1)
+        pooled = Pooled(pooled_path)
+        elapsed, latencies = asyncio.run(simulate(pooled, args.users, args.rounds, args.think))
+        report("После (storage.Database, WAL, пул потоков)", elapsed, latencies)
+        stats = pooled.db.stats
+        print(f"  ожидание блокировки записи: всего {stats['lock_wait_seconds'] * 1000:.1f} мс, "
+              f"макс. {stats['lock_wait_max'] * 1000:.2f} мс")
+        pooled.db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+# benchmarks/bench_update_dispatch.py
+#
+# Задерживает ли чат, упершийся в лимит Bot API, остальные чаты. Обновления
+# проходят через настоящее Application из bot.build_application (ConversationHandler,
+# persistence, TelegramRateLimiter), как в процессе-обработчике webhook.py, а
+# ответы уходят на фейковый Bot API (benchmarks/fake_bot_api.py) с лимитом
+# сообщений в секунду на чат и ответами 429.
+#
+# «Шумный» чат присылает подряд регистрацию (/start, имя, тип диабета, уровень)
+# и несколько /help: его ответы ждут в ограничителе и после 429. Сразу за ним
+# --chats других чатов присылают по одному /help. Сравниваются последовательная
+# обработка (CONCURRENT_UPDATES=0, как в PTB по умолчанию) и обработка чатов
+# одновременно (chat_dispatch.ChatOrderedApplication). Отчет: время ответа
+# остальным чатам, время до последнего ответа шумному чату и совпадает ли
+# порядок его ответов с последовательной обработкой.
+# При одновременной обработке остальные чаты ждут только общий лимит бота (TG_GLOBAL_RATE).
+#
+#   python benchmarks/bench_update_dispatch.py --chats 50 --noisy-helps 8
+import argparse
+import asyncio
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_bot_api import start_fake_bot_api  # noqa: E402
+
+TOKEN = "123:bench"
+NOISY_CHAT = 222
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
+
+
+def text_update(update_id, chat_id, text):
+    message = {"message_id": update_id, "date": int(time.time()), "text": text,
+               "chat": {"id": chat_id, "type": "private", "first_name": "Bench"},
+               "from": {"id": chat_id, "is_bot": False, "first_name": "Bench"}}
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": update_id, "message": message}
+
+
+async def run(args, bot, app, concurrent, chat_base):
+    from telegram import Update
+
+    bot.CONCURRENT_UPDATES = args.concurrent_updates if concurrent else 0
+    application = bot.build_application(with_updater=False)
+    noisy = NOISY_CHAT + chat_base
+    others = [chat_base + 1000 + i for i in range(args.chats)]
+    noisy_texts = ["/start", "Бенч", "7", "1", "3"] + ["/help"] * args.noisy_helps
+    # Ответов на каждое обновление шумного чата по одному; уровень знаний отвечает меню
+    expected = {noisy: len(noisy_texts), **{chat: 1 for chat in others}}
+    sent_before = len(app["sent"])
+    flood_before = app["stats"]["flood"]
+
+    async with application:
+        await application.start()
+        update_id = chat_base * 100
+        put_at = {}
+        for chat_id, text in [(noisy, text) for text in noisy_texts] + [(chat, "/help") for chat in others]:
+            update_id += 1
+            put_at.setdefault(chat_id, time.time())
+            await application.update_queue.put(Update.de_json(text_update(update_id, chat_id, text), application.bot))
+        t0 = time.perf_counter()
+        while time.perf_counter() - t0 < args.timeout:
+            counts = {}
+            for m in app["sent"][sent_before:]:
+                counts[m["chat_id"]] = counts.get(m["chat_id"], 0) + 1
+            if all(counts.get(chat, 0) >= n for chat, n in expected.items()):
+                break
+            await asyncio.sleep(0.01)
+        await application.stop()
+
+    replies = {}
+    for m in app["sent"][sent_before:]:
+        replies.setdefault(m["chat_id"], []).append(m)
+    latencies = [replies[chat][0]["time"] - put_at[chat] for chat in others if chat in replies]
+    noisy_replies = replies.get(noisy, [])
+    return {
+        "others_answered": len(latencies),
+        "others_p50": percentile(latencies, 0.5),
+        "others_p95": percentile(latencies, 0.95),
+        "others_max": max(latencies, default=0.0),
+        "noisy_answered": len(noisy_replies),
+        "noisy_last": noisy_replies[-1]["time"] - put_at[noisy] if noisy_replies else 0.0,
+        "noisy_texts": [m["text"] for m in noisy_replies],
+        "flood": app["stats"]["flood"] - flood_before,
+    }
+
+
+async def main_async(args, port):
+    runner, app = await start_fake_bot_api(port=port, latency=args.latency, chat_limit=args.chat_limit,
+                                           retry_after=args.retry_after)
+    import bot
+    import stat_admin
+
+    stat_admin.dialogue_logger.start()
+    try:
+        # Разные диапазоны chat_id, чтобы второй прогон не продолжал диалоги первого из state.db
+        return {mode: await run(args, bot, app, mode == "concurrent", chat_base)
+                for chat_base, mode in ((0, "sequential"), (1_000_000, "concurrent"))}
+    finally:
+        await stat_admin.dialogue_logger.stop()
+        await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Задержка остальных чатов, пока один чат ждет лимита Bot API")
+    parser.add_argument("--chats", type=int, default=50, help="остальных чатов, по одному /help")
+    parser.add_argument("--noisy-helps", type=int, default=8, help="сколько /help шумный чат шлет после регистрации")
+    parser.add_argument("--concurrent-updates", type=int, default=256, help="CONCURRENT_UPDATES во втором прогоне")
+    parser.add_argument("--latency", type=float, default=0.02, help="задержка фейкового Bot API, с")
+    parser.add_argument("--chat-limit", type=int, default=1, help="сообщений в секунду на чат до 429")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=60.0, help="сколько ждать всех ответов в прогоне, с")
+    args = parser.parse_args()
+
+    port = free_port()
+    # Офлайн-режим: без OpenAI и моделей, базы — во временной папке
+    os.environ.update({"TELEGRAM_BOT_TOKEN": TOKEN, "TELEGRAM_BASE_URL": f"http://127.0.0.1:{port}/bot",
+                       "LOG_LEVEL": os.environ.get("LOG_LEVEL", "ERROR")})
+    os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+    os.environ.setdefault("EMBEDDER", "hashing")
+    os.environ.setdefault("RAG_ENABLED", "0")
+    os.environ.setdefault("CONTENT_RELOAD_INTERVAL", "0")
+    os.environ.pop("METRICS_PORT", None)
+    workdir = tempfile.mkdtemp(prefix="bench_update_dispatch_")
+    shutil.copy(os.path.join(ROOT, "content.json"), workdir)
+    os.chdir(workdir)
+    try:
+        report = asyncio.run(main_async(args, port))
+        import storage
+
+        storage.close_all()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    for mode, title in (("sequential", "по очереди (CONCURRENT_UPDATES=0)"),
+                        ("concurrent", f"чаты одновременно (CONCURRENT_UPDATES={args.concurrent_updates})")):
+        r = report[mode]
+        print(f"\n{title}: ответов 429 от Bot API {r['flood']}")
+        print(f"  остальные чаты: ответили {r['others_answered']} из {args.chats}, "
+              f"p50 {r['others_p50'] * 1000:.0f} мс, p95 {r['others_p95'] * 1000:.0f} мс, "
+              f"макс. {r['others_max'] * 1000:.0f} мс")
+        print(f"  шумный чат: ответов {r['noisy_answered']}, последний через {r['noisy_last'] * 1000:.0f} мс")
+    same = report["sequential"]["noisy_texts"] == report["concurrent"]["noisy_texts"]
+    print(f"\nпорядок ответов шумного чата совпадает с последовательной обработкой: {'да' if same else 'НЕТ'}")
+    if not same:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
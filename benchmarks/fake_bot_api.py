@@ -0,0 +1,148 @@
+# benchmarks/fake_bot_api.py
+#
+# Локальный сервер, имитирующий Telegram Bot API настолько, насколько это
+# нужно боту: getMe, sendMessage, editMessageText, answerCallbackQuery,
+# sendChatAction, setWebhook/deleteWebhook, getUpdates. Отправленные ботом
+# сообщения сохраняются в памяти и доступны по GET /_sent для проверки;
+# обновления для long polling кладутся POST-запросом на /_updates (один Update
+# или список) и отдаются боту через getUpdates.
+#
+# --chat-limit и --global-limit включают имитацию ограничений Telegram: сверх
+# указанного числа сообщений в секунду на чат или на бота сервер отвечает
+# 429 Too Many Requests с retry_after, как настоящий Bot API.
+#
+#   python benchmarks/fake_bot_api.py --port 8081 --latency 0.05
+#   python benchmarks/fake_bot_api.py --chat-limit 1 --global-limit 30
+#   TELEGRAM_BASE_URL=http://127.0.0.1:8081/bot TELEGRAM_BOT_TOKEN=123:test python bot.py
+import argparse
+import asyncio
+import itertools
+import time
+from collections import defaultdict, deque
+
+from aiohttp import web
+
+BOT_USER = {"id": 1000000001, "is_bot": True, "first_name": "Альт", "username": "fake_diabet_school_bot",
+            "can_join_groups": False, "can_read_all_group_messages": False, "supports_inline_queries": False}
+
+
+def make_app(latency=0.0, keep_sent=10000, chat_limit=0, global_limit=0, retry_after=1):
+    stats = {"requests": 0, "methods": {}, "flood": 0}
+    sent = []
+    message_ids = itertools.count(1)
+    # Время отправленных сообщений за последнюю секунду: по чатам и всего
+    chat_window = defaultdict(deque)
+    global_window = deque()
+    updates = []
+    updates_added = asyncio.Event()
+
+    def flooded(chat_id):
+        now = time.monotonic()
+        window = chat_window[chat_id]
+        for q in (window, global_window):
+            while q and q[0] <= now - 1:
+                q.popleft()
+        if (chat_limit and len(window) >= chat_limit) or (global_limit and len(global_window) >= global_limit):
+            return True
+        window.append(now)
+        global_window.append(now)
+        return False
+
+    def message(params, message_id=None):
+        chat_id = int(params["chat_id"])
+        return {"message_id": message_id or next(message_ids), "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "group"},
+                "from": BOT_USER, "text": params.get("text", "")}
+
+    def record(method, params):
+        sent.append({"method": method, "chat_id": int(params["chat_id"]), "text": params.get("text", ""),
+                     "time": time.time()})
+        del sent[:-keep_sent]
+
+    async def call(request):
+        method = request.match_info["method"]
+        stats["requests"] += 1
+        stats["methods"][method] = stats["methods"].get(method, 0) + 1
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+        if latency:
+            await asyncio.sleep(latency)
+        if method in ("sendMessage", "editMessageText") and "chat_id" in params and flooded(int(params["chat_id"])):
+            stats["flood"] += 1
+            return web.json_response({"ok": False, "error_code": 429,
+                                      "description": f"Too Many Requests: retry after {retry_after}",
+                                      "parameters": {"retry_after": retry_after}}, status=429)
+
+        if method == "getMe":
+            result = BOT_USER
+        elif method == "getUpdates":
+            # offset подтверждает все предыдущие обновления; без новых ждем до timeout секунд, как long polling
+            offset = int(params.get("offset") or 0)
+            updates[:] = [u for u in updates if u["update_id"] >= offset]
+            if not updates and float(params.get("timeout") or 0) > 0:
+                updates_added.clear()
+                try:
+                    await asyncio.wait_for(updates_added.wait(), float(params["timeout"]))
+                except asyncio.TimeoutError:
+                    pass
+            result = updates[:int(params.get("limit") or 100)]
+        elif method == "sendMessage":
+            record(method, params)
+            result = message(params)
+        elif method == "editMessageText":
+            if "inline_message_id" in params:
+                result = True
+            else:
+                record(method, params)
+                result = message(params, int(params["message_id"]))
+        else:
+            # answerCallbackQuery, sendChatAction, setWebhook, deleteWebhook и прочие — просто успех
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def get_sent(request):
+        chat_id = request.query.get("chat_id")
+        items = [m for m in sent if chat_id is None or m["chat_id"] == int(chat_id)]
+        return web.json_response({"stats": stats, "sent": items})
+
+    async def add_updates(request):
+        data = await request.json()
+        updates.extend(data if isinstance(data, list) else [data])
+        updates_added.set()
+        return web.json_response({"ok": True, "pending": len(updates)})
+
+    app = web.Application()
+    app["stats"] = stats
+    app["sent"] = sent
+    app.router.add_post("/bot{token}/{method}", call)
+    app.router.add_get("/_sent", get_sent)
+    app.router.add_post("/_updates", add_updates)
+    return app
+
+
+async def start_fake_bot_api(host="127.0.0.1", port=8081, latency=0.0, **limits):
+    """Запускает сервер в текущем цикле событий, возвращает (runner, app)."""
+    app = make_app(latency, **limits)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner, app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Фейковый Telegram Bot API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа на каждый вызов, с")
+    parser.add_argument("--chat-limit", type=int, default=0, help="сообщений в секунду на чат до ответа 429")
+    parser.add_argument("--global-limit", type=int, default=0, help="сообщений в секунду на бота до ответа 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after в ответе 429, с")
+    args = parser.parse_args()
+    web.run_app(make_app(args.latency, chat_limit=args.chat_limit, global_limit=args.global_limit,
+                         retry_after=args.retry_after), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
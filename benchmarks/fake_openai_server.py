@@ -0,0 +1,100 @@
+# benchmarks/fake_openai_server.py
+#
+# Локальный сервер, имитирующий OpenAI Chat Completions API.
+# Используется для проверки llm_gateway и нагрузочных тестов без обращения к OpenAI:
+#
+#   python benchmarks/fake_openai_server.py --port 8089 --latency 2.0
+#   OPENAI_API_BASE=http://127.0.0.1:8089/v1 OPENAI_API_KEY=test python bot.py
+import argparse
+import asyncio
+import json
+import time
+
+from aiohttp import web
+
+DEFAULT_REPLY = "Нормальный уровень глюкозы натощак — от 3.9 до 5.5 ммоль/л."
+
+
+def make_app(latency=1.0, reply=DEFAULT_REPLY, first_chunk_latency=0.2):
+    stats = {"requests": 0, "in_flight": 0, "max_in_flight": 0}
+
+    async def stream_completion(request, body):
+        # Ответ по словам в формате server-sent events, как при stream=True у OpenAI
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        words = reply.split(" ")
+        await asyncio.sleep(first_chunk_latency)
+        for i, word in enumerate(words):
+            chunk = {
+                "id": f"chatcmpl-fake-{stats['requests']}",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get("model", "gpt-4"),
+                "choices": [{"index": 0, "delta": {"content": word if i == 0 else " " + word},
+                             "finish_reason": None}],
+            }
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            await asyncio.sleep(max(0.0, latency - first_chunk_latency) / len(words))
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def chat_completions(request):
+        body = await request.json()
+        stats["requests"] += 1
+        stats["in_flight"] += 1
+        stats["max_in_flight"] = max(stats["max_in_flight"], stats["in_flight"])
+        try:
+            if body.get("stream"):
+                return await stream_completion(request, body)
+            await asyncio.sleep(latency)
+        finally:
+            stats["in_flight"] -= 1
+        prompt_tokens = sum(len(m.get("content", "")) // 4 for m in body.get("messages", []))
+        return web.json_response({
+            "id": f"chatcmpl-fake-{stats['requests']}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-4"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": reply},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": len(reply) // 4,
+                "total_tokens": prompt_tokens + len(reply) // 4,
+            },
+        })
+
+    app = web.Application()
+    app["stats"] = stats
+    app.router.add_post("/v1/chat/completions", chat_completions)
+    return app
+
+
+async def start_fake_openai_server(host="127.0.0.1", port=8089, latency=1.0, reply=DEFAULT_REPLY,
+                                   first_chunk_latency=0.2):
+    """Запускает сервер в текущем цикле событий, возвращает (runner, app)."""
+    app = make_app(latency, reply, first_chunk_latency)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner, app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Фейковый OpenAI-совместимый сервер")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=1.0, help="задержка ответа, с")
+    parser.add_argument("--first-chunk-latency", type=float, default=0.2,
+                        help="задержка первого фрагмента при stream=True, с")
+    args = parser.parse_args()
+    web.run_app(make_app(args.latency, first_chunk_latency=args.first_chunk_latency),
+                host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
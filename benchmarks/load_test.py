@@ -0,0 +1,305 @@
+# benchmarks/load_test.py
+#
+# Нагрузочный тест бота без Telegram и OpenAI: N одновременных пользователей
+# проходят настоящие обработчики bot.py (start → ask_name → ask_diabetes_type →
+# ask_knowledge_level → select_module → select_lesson → quiz_start → quiz_answer
+# … → finish_quiz) и задают вопросы ассистенту (handle_message).
+#
+# Вместо Telegram — поддельные Update/CallbackQuery/Bot с настраиваемой
+# задержкой Bot API, вместо OpenAI — локальный фейковый сервер
+# (benchmarks/fake_openai_server.py). Базы данных создаются во временной папке.
+#
+#   python benchmarks/load_test.py --users 1000 --llm-latency 2 --questions 2
+#   python benchmarks/load_test.py --users 200 --json bench_output.json
+#
+# Отчет: пропускная способность, p50/p95/p99 по каждому обработчику,
+# задержка цикла событий, ожидание блокировок SQLite.
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+# Поддельные объекты Telegram: только то, чем пользуются обработчики bot.py
+
+class FakeBotAPI:
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+
+    async def call(self):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+
+class FakeMessage:
+    def __init__(self, api, chat_id, text=None):
+        self._api = api
+        self.chat = types.SimpleNamespace(id=chat_id)
+        self.chat_id = chat_id
+        self.text = text
+
+    async def reply_text(self, text, reply_markup=None, **kwargs):
+        await self._api.call()
+        return FakeMessage(self._api, self.chat_id, text)
+
+    async def edit_text(self, text, reply_markup=None, **kwargs):
+        await self._api.call()
+        self.text = text
+        return self
+
+
+class FakeCallbackQuery:
+    def __init__(self, api, chat_id, data):
+        self._api = api
+        self.data = data
+        self.message = FakeMessage(api, chat_id)
+
+    async def answer(self, *args, **kwargs):
+        await self._api.call()
+
+    async def edit_message_text(self, text, reply_markup=None, **kwargs):
+        await self._api.call()
+
+
+class FakeUpdate:
+    def __init__(self, api, chat_id, text=None, data=None):
+        self.effective_chat = types.SimpleNamespace(id=chat_id)
+        self.effective_user = types.SimpleNamespace(id=chat_id)
+        self.message = FakeMessage(api, chat_id, text) if text is not None else None
+        self.callback_query = FakeCallbackQuery(api, chat_id, data) if data is not None else None
+        self.effective_message = self.message or self.callback_query.message
+
+
+class FakeBot:
+    def __init__(self, api):
+        self._api = api
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await self._api.call()
+        return FakeMessage(self._api, chat_id, text)
+
+    async def send_chat_action(self, chat_id, action, **kwargs):
+        await self._api.call()
+
+
+# Измерения
+
+class LoopLagMonitor:
+    """Насколько позже запланированного просыпается задача, спящая ``interval`` секунд."""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.lags = []
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            t0 = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, loop.time() - t0 - self.interval))
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+async def run(args, bot):
+    import stat_admin
+    from progress_db_setup import progress_db
+
+    api = FakeBotAPI(args.telegram_latency)
+    fake_bot = FakeBot(api)
+    latencies = {}
+    errors = []
+
+    async def timed(name, handler, ctx, **update_kwargs):
+        update = FakeUpdate(api, ctx.chat_id, **update_kwargs)
+        t0 = time.perf_counter()
+        try:
+            result = await handler(update, ctx)
+        except Exception as e:
+            errors.append(f"{name}: {e!r}")
+            raise
+        latencies.setdefault(name, []).append(time.perf_counter() - t0)
+        return result
+
+    async def think():
+        if args.think:
+            await asyncio.sleep(random.uniform(0, args.think))
+
+    async def user(chat_id):
+        ctx = types.SimpleNamespace(user_data={}, chat_data={}, bot=fake_bot, chat_id=chat_id, args=[])
+        await think()
+        await timed("start", bot.start, ctx, text="/start")
+        await timed("ask_name", bot.ask_name, ctx, text=f"Пользователь {chat_id}")
+        await timed("ask_diabetes_type", bot.ask_diabetes_type, ctx, text=random.choice("12"))
+        await timed("ask_knowledge_level", bot.ask_knowledge_level, ctx, text=str(random.randint(1, 5)))
+        for _ in range(args.questions):
+            await think()
+            await timed("handle_message", bot.handle_message, ctx,
+                        text=random.choice(QUESTIONS) if args.repeat_questions else f"Вопрос {chat_id}-{random.random()}")
+        for _ in range(args.quizzes):
+            module = random.choice(bot.CONTENT.catalog.modules)
+            lesson = random.choice(module.lessons)
+            await think()
+            await timed("select_module", bot.select_module, ctx, data=f"module_{module.id}")
+            await timed("select_lesson", bot.select_lesson, ctx, data=f"lesson_{lesson.id}")
+            state = await timed("quiz_start", bot.quiz_start, ctx, data="quiz_start")
+            while state == bot.ASK_QUIZ:
+                await think()
+                last = ctx.user_data['quiz_index'] + 1 >= len(ctx.user_data['quiz_questions'])
+                state = await timed("finish_quiz" if last else "quiz_answer", bot.quiz_answer, ctx,
+                                    data=f"answer_{random.randint(0, 2)}")
+
+    stat_admin.dialogue_logger.start()
+    if bot.response_cache is not None:
+        await bot.response_cache.start()
+    monitor = LoopLagMonitor()
+    monitor.start()
+    t0 = time.perf_counter()
+    results = await asyncio.gather(*(user(1_000_000 + i) for i in range(args.users)), return_exceptions=True)
+    elapsed = time.perf_counter() - t0
+    await monitor.stop()
+    if bot.response_cache is not None:
+        await bot.response_cache.stop()
+    await stat_admin.dialogue_logger.stop()
+
+    handled = sum(len(v) for v in latencies.values())
+    db_stats = {name: dict(db.stats) for name, db in (("progress.db", progress_db), ("users.db", stat_admin.users_db))}
+    return {
+        "users": args.users,
+        "failed_users": sum(1 for r in results if isinstance(r, Exception)),
+        "errors": errors[:10],
+        "elapsed_seconds": elapsed,
+        "handled_updates": handled,
+        "throughput_updates_per_second": handled / elapsed if elapsed else 0.0,
+        "bot_api_calls": api.calls,
+        "handlers": {
+            name: {"count": len(values),
+                   "p50_ms": percentile(values, 0.50) * 1000,
+                   "p95_ms": percentile(values, 0.95) * 1000,
+                   "p99_ms": percentile(values, 0.99) * 1000}
+            for name, values in latencies.items()
+        },
+        "event_loop_lag_ms": {"p50": percentile(monitor.lags, 0.50) * 1000,
+                              "p99": percentile(monitor.lags, 0.99) * 1000,
+                              "max": max(monitor.lags, default=0.0) * 1000},
+        "sqlite": {name: {"queries": s["queries"],
+                          "lock_wait_total_ms": s["lock_wait_seconds"] * 1000,
+                          "lock_wait_max_ms": s["lock_wait_max"] * 1000}
+                   for name, s in db_stats.items()},
+    }
+
+
+QUESTIONS = [
+    "Какой нормальный уровень сахара натощак?",
+    "Что делать при гипогликемии?",
+    "Сколько хлебных единиц в яблоке?",
+    "Можно ли пить алкоголь при диабете?",
+    "Как часто измерять глюкозу?",
+]
+
+
+def print_report(report):
+    print(f"пользователей: {report['users']} (с ошибками: {report['failed_users']})")
+    print(f"обработано обновлений: {report['handled_updates']} за {report['elapsed_seconds']:.2f} с — "
+          f"{report['throughput_updates_per_second']:.1f} обн/с, вызовов Bot API: {report['bot_api_calls']}")
+    print(f"\n{'обработчик':22s} {'n':>7s} {'p50, мс':>10s} {'p95, мс':>10s} {'p99, мс':>10s}")
+    for name, h in report["handlers"].items():
+        print(f"{name:22s} {h['count']:7d} {h['p50_ms']:10.2f} {h['p95_ms']:10.2f} {h['p99_ms']:10.2f}")
+    lag = report["event_loop_lag_ms"]
+    print(f"\nзадержка цикла событий: p50 {lag['p50']:.2f} мс, p99 {lag['p99']:.2f} мс, макс. {lag['max']:.2f} мс")
+    for name, s in report["sqlite"].items():
+        print(f"{name}: запросов {s['queries']}, ожидание блокировки записи: "
+              f"всего {s['lock_wait_total_ms']:.1f} мс, макс. {s['lock_wait_max_ms']:.2f} мс")
+    for err in report["errors"]:
+        print(f"ошибка: {err}")
+
+
+async def main_async(args):
+    from benchmarks.fake_openai_server import start_fake_openai_server
+
+    runner, _ = await start_fake_openai_server(port=args.llm_port, latency=args.llm_latency,
+                                               first_chunk_latency=min(args.llm_latency, 0.3))
+    import bot
+    import openai
+
+    openai.api_base = f"http://127.0.0.1:{args.llm_port}/v1"
+    openai.api_key = "load-test"
+    try:
+        return await run(args, bot)
+    finally:
+        await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест обработчиков бота")
+    parser.add_argument("--users", type=int, default=200, help="одновременных пользователей")
+    parser.add_argument("--questions", type=int, default=1, help="вопросов ассистенту на пользователя")
+    parser.add_argument("--quizzes", type=int, default=1, help="викторин на пользователя")
+    parser.add_argument("--think", type=float, default=0.5, help="макс. пауза пользователя между действиями, с")
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="задержка ответа фейкового OpenAI, с")
+    parser.add_argument("--llm-port", type=int, default=8089)
+    parser.add_argument("--telegram-latency", type=float, default=0.02, help="задержка вызова Bot API, с")
+    parser.add_argument("--repeat-questions", action="store_true",
+                        help="задавать вопросы из небольшого набора (проверка кэша ответов)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="сохранить отчет в JSON-файл")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    # Офлайн-режим: без загрузки моделей, базы и кэши — во временной папке
+    os.environ.setdefault("EMBEDDER", "hashing")
+    os.environ.setdefault("RAG_ENABLED", "0")
+    os.environ.setdefault("CONTENT_RELOAD_INTERVAL", "0")
+    workdir = tempfile.mkdtemp(prefix="bot-load-test-")
+    shutil.copy(os.path.join(ROOT, "content.json"), workdir)
+    os.chdir(workdir)
+    import logging
+    logging.disable(logging.WARNING)
+    try:
+        import progress_db_setup
+        import stat_admin
+        import storage
+
+        stat_admin.initialize_db()
+        progress_db_setup.setup_progress_db()
+        report = asyncio.run(main_async(args))
+        storage.close_all()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print_report(report)
+    if args.json:
+        with open(os.path.join(ROOT, args.json) if not os.path.isabs(args.json) else args.json, "w",
+                  encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+# benchmarks/replay_updates.py
+#
+# Отправляет записанные обновления Telegram (JSON Lines, по одному Update в
+# строке) на webhook бота — так режим webhook проверяется локально без Telegram.
+#
+#   python benchmarks/replay_updates.py benchmarks/sample_updates.jsonl \
+#       --url http://127.0.0.1:8443/telegram --secret ... --users 500
+#
+# --users N размножает записанные диалоги на N чатов (id чатов и
+# пользователей сдвигаются), обновления одного чата отправляются строго по
+# порядку, разные чаты — параллельно. Отчет: принятые/отклоненные запросы,
+# время ответа webhook и пропускная способность.
+import argparse
+import asyncio
+import copy
+import json
+import os
+import sys
+import time
+
+import aiohttp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from webhook import SECRET_HEADER, update_chat_id  # noqa: E402
+
+CHAT_ID_STEP = 10_000_000
+
+
+def load_updates(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _shift_ids(value, shift, ids):
+    # Сдвигаем id чатов и пользователей, чтобы копии диалогов не пересекались
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if key == "id" and item in ids:
+                value[key] = item + shift
+            else:
+                _shift_ids(item, shift, ids)
+    elif isinstance(value, list):
+        for item in value:
+            _shift_ids(item, shift, ids)
+
+
+def build_chats(updates, users):
+    """Разбивает обновления по чатам и размножает их: [[update, ...], ...] — по списку на чат."""
+    chats = {}
+    for update in updates:
+        chats.setdefault(update_chat_id(update), []).append(update)
+    result = []
+    update_id = max((u.get("update_id", 0) for u in updates), default=0)
+    for copy_index in range((users + len(chats) - 1) // len(chats)):
+        for chat_id, chat_updates in chats.items():
+            if len(result) == users:
+                break
+            cloned = copy.deepcopy(chat_updates)
+            if copy_index:
+                _shift_ids(cloned, copy_index * CHAT_ID_STEP, {chat_id})
+                for u in cloned:
+                    update_id += 1
+                    u["update_id"] = update_id
+            result.append(cloned)
+    return result
+
+
+async def replay(args):
+    updates = load_updates(args.file)
+    chats = build_chats(updates, args.users or len({update_chat_id(u) for u in updates}))
+    headers = {"Content-Type": "application/json"}
+    if args.secret:
+        headers[SECRET_HEADER] = args.secret
+    latencies = []
+    statuses = {}
+
+    async def send_chat(session, chat_updates):
+        for update in chat_updates:
+            body = json.dumps(update, ensure_ascii=False)
+            for attempt in range(args.retries + 1):
+                t0 = time.perf_counter()
+                async with session.post(args.url, data=body.encode("utf-8"), headers=headers) as response:
+                    await response.read()
+                latencies.append(time.perf_counter() - t0)
+                statuses[response.status] = statuses.get(response.status, 0) + 1
+                # Как и Telegram, повторяем обновление, если webhook ответил ошибкой
+                if response.status < 500:
+                    break
+                await asyncio.sleep(0.5 * (attempt + 1))
+            if args.delay:
+                await asyncio.sleep(args.delay)
+
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    t0 = time.perf_counter()
+    async with aiohttp.ClientSession(connector=connector) as session:
+        await asyncio.gather(*(send_chat(session, chat) for chat in chats))
+    elapsed = time.perf_counter() - t0
+
+    latencies.sort()
+    total = len(latencies)
+    print(f"чатов: {len(chats)}, запросов: {total} за {elapsed:.2f} с — {total / elapsed:.1f} запр/с")
+    print("ответы webhook: " + ", ".join(f"{status}: {n}" for status, n in sorted(statuses.items())))
+    if total:
+        print(f"время ответа: p50 {latencies[total // 2] * 1000:.1f} мс, "
+              f"p99 {latencies[min(total - 1, int(total * 0.99))] * 1000:.1f} мс")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Отправка записанных обновлений на webhook бота")
+    parser.add_argument("file", help="файл JSON Lines с обновлениями Telegram")
+    parser.add_argument("--url", default="http://127.0.0.1:8443/telegram")
+    parser.add_argument("--secret", default=os.getenv("WEBHOOK_SECRET"))
+    parser.add_argument("--users", type=int, default=0, help="число чатов (по умолчанию — как в файле)")
+    parser.add_argument("--delay", type=float, default=0.0, help="пауза между обновлениями одного чата, с")
+    parser.add_argument("--concurrency", type=int, default=100, help="одновременных HTTP-соединений")
+    parser.add_argument("--retries", type=int, default=3, help="повторов при ответе 5xx")
+    asyncio.run(replay(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
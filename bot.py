@@ -1,10 +1,13 @@
 # bot.py
 
+import asyncio
+import functools
+import importlib
 import logging
 import os
-import json
+import time
 from dotenv import load_dotenv
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Update
 from telegram.ext import (
     ApplicationBuilder,
     CommandHandler,
@@ -14,24 +17,65 @@ from telegram.ext import (
     filters,
     ConversationHandler
 )
-import sqlite3
+
+# Загрузка переменных окружения из .env файла — до импорта модулей бота, которые читают настройки при импорте
+load_dotenv()
+
+import analytics
+import metrics
 import stat_admin
+import storage
+from monitoring import Monitoring, setup_logging
 from stat_admin import log_dialogue, initialize_db as init_stat
-from progress_db_setup import setup_progress_db
-import openai
+from progress_db_setup import setup_progress_db, progress_db
+from llm_gateway import LLMGateway, LLMQueueFull, LLMTimeout, LLM_RAG_MODEL, load_openai
+from content_catalog import ContentWatcher, QUIZ_START_KEYBOARD
+from persistence import SQLitePersistence, QUIZ_KEYS
+from rate_limiter import TelegramRateLimiter, TG_RATE_LIMIT, TG_GLOBAL_RATE, TG_GLOBAL_BURST
+from chat_dispatch import ChatOrderedApplication, CONCURRENT_UPDATES
+from response_cache import ResponseCache, RESPONSE_CACHE_ENABLED
+from embeddings import get_embedder
+from retrieval import RetrievalIndex, RAG_ENABLED, format_context
+from streaming import StreamingReply, LLM_STREAMING, EMPTY_REPLY_TEXT, first_chunk_seconds, reply_seconds
+from spaced_repetition import QuizScheduler, SR_ENABLED, save_states
+from conversation_memory import (ConversationMemory, MEMORY_ENABLED, MEMORY_SUMMARY_ENABLED,
+                                 MEMORY_SUMMARY_TOKENS, summary_messages)
 
-# Загрузка переменных окружения из .env файла
-load_dotenv()
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
-openai.api_key = os.getenv("OPENAI_API_KEY")
-
-# Настройка логирования
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+# Адрес Bot API (например, локального фейкового сервера); по умолчанию — api.telegram.org
+TELEGRAM_BASE_URL = os.getenv("TELEGRAM_BASE_URL")
+# Режим webhook запускается через webhook.py; python bot.py с заданным WEBHOOK_URL не стартует (см. main)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+# Бот начинает принимать обновления сразу, а эндпоинт метрик, openai, модель эмбеддингов, кэш ответов
+# и индекс RAG догружаются в фоне (см. warm_up). LAZY_STARTUP=0 — загрузить все до приема первого обновления
+LAZY_STARTUP = os.getenv("LAZY_STARTUP", "1") == "1"
+
+# Настройка логирования (LOG_LEVEL, см. monitoring.setup_logging)
+setup_logging()
 logger = logging.getLogger(__name__)
 
+handler_seconds = metrics.histogram(
+    "bot_handler_seconds", "Время обработки обновления, с", labelnames=("handler",))
+handler_errors_total = metrics.counter(
+    "bot_handler_errors_total", "Исключения в обработчиках", labelnames=("handler",))
+warmup_seconds = metrics.gauge("bot_warmup_seconds", "Длительность загрузки подсистем при запуске, с")
+
+# Замер времени обработчика в гистограмме bot_handler_seconds{handler="<имя функции>"}
+def instrumented(handler):
+    name = handler.__name__
+
+    @functools.wraps(handler)
+    async def wrapper(update, context, *args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return await handler(update, context, *args, **kwargs)
+        except Exception:
+            handler_errors_total.inc(handler=name)
+            raise
+        finally:
+            handler_seconds.observe(time.perf_counter() - t0, handler=name)
+    return wrapper
+
 # Системный промпт для OpenAI
 SYSTEM_PROMPT = """
 Ты — дружелюбный и внимательный нейро-помощник по имени Альт, специализирующийся на вопросах сахарного диабета.
@@ -39,49 +83,93 @@ SYSTEM_PROMPT = """
 Не начинай ответы с приветствий. Результаты анализов на содержание глюкозы в крови предоставляй только в ммолях/л.
 """
 
+# Шлюз к OpenAI: ограничивает число одновременных запросов и ставит остальные в очередь
+llm_gateway = LLMGateway()
+metrics.gauge("llm_queue_depth", "Запросов к OpenAI в очереди", fn=lambda: llm_gateway.queue_depth)
+metrics.gauge("llm_in_flight", "Запросов к OpenAI в работе", fn=lambda: llm_gateway.in_flight)
+
+# Эндпоинт /metrics, замер задержки цикла событий и профилирование (см. monitoring.py)
+monitoring = Monitoring()
+
+# Модель эмбеддингов, общая для кэша ответов и поиска по материалам курса
+embedder = get_embedder()
+
+# Кэш ответов на повторяющиеся вопросы: точное совпадение текста и поиск ближайшего вопроса по эмбеддингам
+response_cache = ResponseCache(embedder=embedder) if RESPONSE_CACHE_ENABLED else None
+
+# Индекс фрагментов курса для ответов с опорой на материалы (строится командой python retrieval.py build)
+retriever = RetrievalIndex(embedder) if RAG_ENABLED and embedder is not None else None
+
+# Сводка старых реплик диалога (дешевле держать ее, чем всю переписку, в каждом запросе)
+async def summarize_dialogue(summary, turns):
+    return await llm_gateway.chat(summary_messages(summary, turns), max_tokens=MEMORY_SUMMARY_TOKENS, temperature=0.3)
+
+# Память диалога с ассистентом: последние реплики в пределах бюджета токенов и сводка более ранних
+memory = ConversationMemory(
+    stat_admin.users_db, summarize=summarize_dialogue if MEMORY_SUMMARY_ENABLED else None,
+    flush_pending=stat_admin.dialogue_logger.flush
+) if MEMORY_ENABLED else None
+if memory is not None:
+    metrics.gauge("memory_users", "Пользователей с историей диалога в памяти", fn=lambda: len(memory))
+
 # Определение состояний ConversationHandler
 ASK_NAME, ASK_DIABETES_TYPE, ASK_KNOWLEDGE_LEVEL, MAIN_MENU, SELECT_MODULE, SELECT_LESSON, SHOW_LESSON, ASK_QUIZ = range(8)
 
 def load_content():
     logger.info("Загрузка контента из content.json")
+    watcher = ContentWatcher('content.json')
     try:
-        with open('content.json', 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        watcher.load()
         logger.info("Контент успешно загружен")
-        return data
     except Exception as e:
         logger.error(f"Ошибка при загрузке content.json: {e}")
-        return {"modules": []}
+        for err in watcher.last_errors[:20]:
+            logger.error(f"  {err}")
+    return watcher
 
-# Загрузка контента
+# Загрузка контента. CONTENT.catalog — текущий индекс модулей, уроков и вопросов;
+# при изменении content.json он подменяется целиком (см. ContentWatcher)
 CONTENT = load_content()
 
-def get_db_connection():
-    db_path = os.path.join(os.getcwd(), 'database', 'progress.db')
-    logger.info(f"Установка соединения с базой данных: {db_path}")
-    return sqlite3.connect(db_path)
+# Подбор вопросов викторины по интервальному повторению; без него викторина — все вопросы урока по порядку
+scheduler = QuizScheduler(progress_db, resolve_question=lambda qid: CONTENT.catalog.question(qid)) if SR_ENABLED else None
+if scheduler is not None:
+    metrics.gauge("quiz_decks", "Пользователей с колодой вопросов в памяти", fn=lambda: len(scheduler))
+
+# Администраторы бота (id пользователей Telegram через запятую): им доступны /top, /hardest и /modules
+ADMIN_IDS = {int(x) for x in os.getenv("ADMIN_IDS", "").replace(" ", "").split(",") if x}
+
+# Викторина окончена или брошена: без этого handle_message считал бы, что пользователь все еще отвечает
+# на вопросы, а брошенная викторина через SQLitePersistence пережила бы и перезапуск бота
+def clear_quiz(context):
+    for key in QUIZ_KEYS:
+        context.user_data.pop(key, None)
 
 # Обработчик команды /start
+@instrumented
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_chat.id
-    logger.info(f"Пользователь {user_id} начал взаимодействие с ботом")
+    clear_quiz(context)
+    logger.debug("Пользователь %s начал взаимодействие с ботом", user_id)
     await update.message.reply_text("Добро пожаловать! Как вас зовут?")
     return ASK_NAME
 
 # Обработчик ввода имени
+@instrumented
 async def ask_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_chat.id
     name = update.message.text.strip()
-    logger.info(f"Пользователь {user_id} представился: {name}")
+    logger.debug("Пользователь %s представился", user_id)
     context.user_data['name'] = name
     await update.message.reply_text(f"Приятно познакомиться, {name}! Какой у вас тип диабета? (введите `1` для СД1 или `2` для СД2)")
     return ASK_DIABETES_TYPE
 
 # Обработчик выбора типа диабета
+@instrumented
 async def ask_diabetes_type(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_chat.id
     resp = update.message.text.strip()
-    logger.info(f"Пользователь {user_id} выбрал тип диабета: {resp}")
+    logger.debug("Пользователь %s выбрал тип диабета: %s", user_id, resp)
     if resp in ['1', '2']:
         context.user_data['diabetes_type'] = 'СД1' if resp == '1' else 'СД2'
         await update.message.reply_text("Оцените ваш уровень знаний о диабете по шкале 1 до 5.")
@@ -92,24 +180,20 @@ async def ask_diabetes_type(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ASK_DIABETES_TYPE
 
 # Обработчик оценки уровня знаний
+@instrumented
 async def ask_knowledge_level(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_chat.id
     resp = update.message.text.strip()
-    logger.info(f"Пользователь {user_id} оценил уровень знаний: {resp}")
+    logger.debug("Пользователь %s оценил уровень знаний: %s", user_id, resp)
     if resp.isdigit() and 1 <= int(resp) <= 5:
         context.user_data['knowledge_level'] = int(resp)
         # Сохранить пользователя в БД
         try:
-            conn = get_db_connection()
-            c = conn.cursor()
-            c.execute('INSERT OR IGNORE INTO users (user_id, name, diabetes_type, knowledge_level, points) VALUES (?,?,?,?,?)',
-                      (user_id, context.user_data['name'], context.user_data['diabetes_type'], context.user_data['knowledge_level'], 0))
-            conn.commit()
-            logger.info(f"Пользователь {user_id} добавлен/обновлен в базе данных")
+            await progress_db.execute('INSERT OR IGNORE INTO users (user_id, name, diabetes_type, knowledge_level, points) VALUES (?,?,?,?,?)',
+                                      (user_id, context.user_data['name'], context.user_data['diabetes_type'], context.user_data['knowledge_level'], 0))
+            logger.debug("Пользователь %s добавлен/обновлен в базе данных", user_id)
         except Exception as e:
             logger.error(f"Ошибка при добавлении пользователя {user_id} в базу данных: {e}")
-        finally:
-            conn.close()
 
         await main_menu(update, context)
         return MAIN_MENU
@@ -119,13 +203,11 @@ async def ask_knowledge_level(update: Update, context: ContextTypes.DEFAULT_TYPE
         return ASK_KNOWLEDGE_LEVEL
 
 # Обработчик главного меню
+@instrumented
 async def main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_chat.id
-    logger.info(f"Пользователь {user_id} перешел в главное меню")
-    keyboard = []
-    for m in CONTENT['modules']:
-        keyboard.append([InlineKeyboardButton(m['title'], callback_data=f"module_{m['id']}")])
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    logger.debug("Пользователь %s перешел в главное меню", user_id)
+    reply_markup = CONTENT.catalog.main_menu_keyboard
     if update.message:
         await update.message.reply_text("Выберите модуль:", reply_markup=reply_markup)
     elif update.callback_query:
@@ -133,61 +215,59 @@ async def main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return SELECT_MODULE
 
 # Обработчик выбора модуля
+@instrumented
 async def select_module(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
     data = query.data
     user_id = query.message.chat.id
-    logger.info(f"Пользователь {user_id} выбрал модуль: {data}")
+    logger.debug("Пользователь %s выбрал модуль: %s", user_id, data)
     if data.startswith("module_"):
         module_id = data.split("_", 1)[1]  # Извлекаем всё после первого '_'
         context.user_data['current_module'] = module_id
-        module = next((m for m in CONTENT['modules'] if m['id'] == module_id), None)
+        module = CONTENT.catalog.module(module_id)
         if not module:
             logger.error(f"Модуль с id {module_id} не найден")
             await query.edit_message_text("Модуль не найден. Возвращаемся в меню.")
             await main_menu(update, context)
             return SELECT_MODULE  # Возвращаем состояние SELECT_MODULE
-        keyboard = []
-        for lesson in module['lessons']:
-            keyboard.append([InlineKeyboardButton(lesson['title'], callback_data=f"lesson_{lesson['id']}")])
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(f"Модуль: {module['title']}\nВыберите урок:", reply_markup=reply_markup)
+        await query.edit_message_text(module.text, reply_markup=module.keyboard)
         return SELECT_LESSON
 
 # Обработчик выбора урока
+@instrumented
 async def select_lesson(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
     data = query.data
     user_id = query.message.chat.id
-    logger.info(f"Пользователь {user_id} выбрал урок: {data}")
+    logger.debug("Пользователь %s выбрал урок: %s", user_id, data)
     if data.startswith("lesson_"):
         lesson_id = data.split("_", 1)[1]  # Извлекаем всё после первого '_'
         context.user_data['current_lesson'] = lesson_id
 
         module_id = context.user_data['current_module']
-        module = next((m for m in CONTENT['modules'] if m['id'] == module_id), None)
+        module = CONTENT.catalog.module(module_id)
         if not module:
             logger.error(f"Модуль с id {module_id} не найден при выборе урока")
             await query.edit_message_text("Модуль не найден. Возвращаемся в меню.")
             await main_menu(update, context)
             return SELECT_MODULE  # Возвращаем состояние SELECT_MODULE
-        lesson = next((l for l in module['lessons'] if l['id'] == lesson_id), None)
+        lesson = module.lessons_by_id.get(lesson_id)
         if not lesson:
             logger.error(f"Урок с id {lesson_id} не найден в модуле {module_id}")
             await query.edit_message_text("Урок не найден. Возвращаемся в меню.")
             await main_menu(update, context)
             return SELECT_MODULE  # Возвращаем состояние SELECT_MODULE
 
-        await query.edit_message_text(f"Урок: {lesson['title']}\n{lesson['content']}\n\n(Нажмите Далее чтобы перейти к вопросам)")
-        keyboard = [[InlineKeyboardButton("Далее", callback_data="quiz_start")]]
-        await query.message.reply_text("Готовы ответить на вопросы?", reply_markup=InlineKeyboardMarkup(keyboard))
+        await query.edit_message_text(lesson.text)
+        await query.message.reply_text("Готовы ответить на вопросы?", reply_markup=QUIZ_START_KEYBOARD)
         return SHOW_LESSON
 
 # Обработчик запуска викторины
+@instrumented
 async def quiz_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -195,24 +275,29 @@ async def quiz_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = query.message.chat.id
     module_id = context.user_data.get('current_module')
     lesson_id = context.user_data.get('current_lesson')
-    module = next((m for m in CONTENT['modules'] if m['id'] == module_id), None)
+    module = CONTENT.catalog.module(module_id)
     if not module:
         logger.error(f"Модуль с id {module_id} не найден при запуске викторины")
         await query.edit_message_text("Модуль не найден. Возвращаемся в меню.")
         await main_menu(update, context)
         return SELECT_MODULE
-    lesson = next((l for l in module['lessons'] if l['id'] == lesson_id), None)
+    lesson = module.lessons_by_id.get(lesson_id)
     if not lesson:
         logger.error(f"Урок с id {lesson_id} не найден в модуле {module_id} при запуске викторины")
         await query.edit_message_text("Урок не найден. Возвращаемся в меню.")
         await main_menu(update, context)
         return SELECT_MODULE
 
-    logger.info(f"Пользователь {user_id} начал викторину по уроку {lesson_id}")
-    if 'questions' in lesson and lesson['questions']:
-        context.user_data['quiz_questions'] = lesson['questions']
+    logger.debug("Пользователь %s начал викторину по уроку %s", user_id, lesson_id)
+    if lesson.questions:
+        if scheduler is not None:
+            questions = tuple(await scheduler.select(user_id, lesson, context.user_data.get('knowledge_level', 3)))
+        else:
+            questions = lesson.questions
+        context.user_data['quiz_questions'] = questions
         context.user_data['quiz_index'] = 0
         context.user_data['quiz_score'] = 0
+        context.user_data['quiz_answers'] = []
         await ask_quiz_question(update, context)
         return ASK_QUIZ
     else:
@@ -221,66 +306,75 @@ async def quiz_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await main_menu(update, context)
         return SELECT_MODULE
 
-# Функция для задания вопроса викторины
-async def ask_quiz_question(update: Update, context: ContextTypes.DEFAULT_TYPE):
+# Функция для задания вопроса викторины; verdict — итог ответа на предыдущий вопрос
+async def ask_quiz_question(update: Update, context: ContextTypes.DEFAULT_TYPE, verdict=None):
     q_index = context.user_data['quiz_index']
     questions = context.user_data['quiz_questions']
     if q_index < len(questions):
         q = questions[q_index]
-        # Формируем текст с нумерацией вариантов
-        options_text = "\n".join([f"{i+1}. {opt}" for i, opt in enumerate(q['options'])])
-        # Создаем кнопки с номерами вариантов
-        keyboard = []
-        for i in range(len(q['options'])):
-            keyboard.append([InlineKeyboardButton(str(i+1), callback_data=f"answer_{i}")])
-        logger.info(f"Задается вопрос {q_index + 1}: {q['question']}")
-        # Используем update.effective_message для корректной отправки
-        await update.effective_message.reply_text(
-            f"Вопрос: {q['question']}\n\n{options_text}",
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
+        logger.debug("Задается вопрос %s: %s", q_index + 1, q.qid)
+        # Текст с нумерацией вариантов и кнопки подготовлены заранее в каталоге
+        text = f"{verdict}\n\n{q.prompt}" if verdict else q.prompt
+        if update.callback_query:
+            # Вердикт и следующий вопрос — одна правка сообщения с кнопками вместо правки и нового сообщения
+            await update.callback_query.edit_message_text(text, reply_markup=q.keyboard)
+        else:
+            await update.effective_message.reply_text(text, reply_markup=q.keyboard)
     else:
-        await finish_quiz(update, context)
+        await finish_quiz(update, context, verdict)
+
+# Итог викторины и новые сроки повторения ее вопросов пишутся одной транзакцией progress.db
+def record_quiz(c, user_id, module_id, lesson_id, results, states):
+    save_states(c, states)
+    return analytics.record_quiz_result(c, user_id, module_id, lesson_id, results)
 
 # Функция для завершения викторины
-async def finish_quiz(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@instrumented
+async def finish_quiz(update: Update, context: ContextTypes.DEFAULT_TYPE, verdict=None):
     user_id = update.effective_chat.id
     score = context.user_data['quiz_score']
-    total = len(context.user_data['quiz_questions'])
+    questions = context.user_data['quiz_questions']
+    total = len(questions)
     percent = (score / total) * 100
-    logger.info(f"Пользователь {user_id} завершил викторину: {score}/{total} ({percent:.0f}%)")
+    logger.debug("Пользователь %s завершил викторину: %s/%s", user_id, score, total)
+    points_earned = int(score * analytics.POINTS_PER_ANSWER)
+    lines = [verdict] if verdict else []
+    results = [(q.qid, answer, answer == q.correct_option)
+               for q, answer in zip(questions, context.user_data.get('quiz_answers', ()))]
     try:
-        conn = get_db_connection()
-        c = conn.cursor()
-        points_earned = int(score * 5)
-        c.execute('UPDATE users SET points = points + ? WHERE user_id=?', (points_earned, user_id))
-        conn.commit()
-        logger.info(f"Пользователь {user_id} получил {points_earned} очков")
-        c.execute('SELECT points FROM users WHERE user_id=?', (user_id,))
-        p = c.fetchone()[0]
-        if p >= 50:
-            c.execute('SELECT badge FROM rewards WHERE user_id=? AND badge=?', (user_id, 'Супер-ученик'))
-            if not c.fetchone():
-                c.execute('INSERT INTO rewards (user_id, badge) VALUES (?,?)', (user_id, 'Супер-ученик'))
-                await update.effective_message.reply_text("Вы получили награду 'Супер-ученик'!")
-                logger.info(f"Пользователь {user_id} получил награду 'Супер-ученик'")
-        conn.commit()
+        states = []
+        if scheduler is not None:
+            states = await scheduler.record(user_id, results, context.user_data.get('knowledge_level', 3))
+        # Ответы, очки, награда, прогресс, агрегаты для рейтингов и сроки повторения — одной транзакцией
+        points_earned, _, new_badge = await progress_db.transaction(
+            record_quiz, user_id, context.user_data.get('current_module'),
+            context.user_data.get('current_lesson'), results, states)
+        if scheduler is not None:
+            # Колода в памяти меняется только после записи в базу, иначе при ошибке они бы разошлись
+            scheduler.apply(user_id, states)
+        logger.debug("Пользователь %s получил %s очков", user_id, points_earned)
+        if new_badge:
+            lines.append(f"Вы получили награду '{analytics.BADGE}'!")
+            logger.info(f"Пользователь {user_id} получил награду '{analytics.BADGE}'")
     except Exception as e:
         logger.error(f"Ошибка при обновлении очков пользователя {user_id}: {e}")
-    finally:
-        conn.close()
 
-    if percent >= 80:
+    if percent >= analytics.PASS_PERCENT:
         response_text = f"Отличный результат! {score}/{total} ({percent:.0f}%). +{points_earned} очков."
     else:
         response_text = f"Результат {score}/{total} ({percent:.0f}%) — стоит повторить. +{points_earned} очков."
-    logger.info(f"Пользователь {user_id} получил следующий ответ викторины: {response_text}")
-    await update.effective_message.reply_text(response_text)
-    await update.effective_message.reply_text("Возвращаемся в меню.")
-    await main_menu(update, context)
+    clear_quiz(context)
+    # Вердикт, награда, итог и главное меню — одним сообщением: после викторины чат получает один запрос, а не пять
+    lines += [response_text, "Выберите модуль:"]
+    text = "\n\n".join(lines)
+    if update.callback_query:
+        await update.callback_query.edit_message_text(text, reply_markup=CONTENT.catalog.main_menu_keyboard)
+    else:
+        await update.effective_message.reply_text(text, reply_markup=CONTENT.catalog.main_menu_keyboard)
     return SELECT_MODULE  # Возвращаем состояние SELECT_MODULE
 
 # Обработчик ответа на вопрос викторины
+@instrumented
 async def quiz_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -289,38 +383,97 @@ async def quiz_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = query.message.chat.id
     if data.startswith("answer_"):
         ans_index = int(data.split("_")[1])
-        q_index = context.user_data['quiz_index']
-        questions = context.user_data['quiz_questions']
+        q_index = context.user_data.get('quiz_index', 0)
+        questions = context.user_data.get('quiz_questions', ())
         if q_index >= len(questions):
             logger.warning(f"Пользователь {user_id} ответил на вопрос вне диапазона: {q_index}")
             await query.edit_message_text("Ошибка викторины. Возвращаемся в меню.")
             await main_menu(update, context)
             return SELECT_MODULE  # Возвращаем состояние SELECT_MODULE
         q = questions[q_index]
+        context.user_data.setdefault('quiz_answers', []).append(ans_index)
 
-        if ans_index == q['correct_option']:
+        if ans_index == q.correct_option:
             context.user_data['quiz_score'] += 1
-            logger.info(f"Пользователь {user_id} дал правильный ответ на вопрос {q_index + 1}")
-            await query.edit_message_text("Верно!")
+            logger.debug("Пользователь %s дал правильный ответ на вопрос %s", user_id, q_index + 1)
+            verdict = "Верно!"
         else:
-            correct_ans = q['options'][q['correct_option']]
-            logger.info(f"Пользователь {user_id} дал неверный ответ на вопрос {q_index + 1}: выбрал {ans_index}, правильный {q['correct_option']}")
-            await query.edit_message_text(f"Неверно. Правильный ответ: {correct_ans}")
+            correct_ans = q.correct_answer
+            logger.debug("Пользователь %s дал неверный ответ на вопрос %s: выбрал %s, правильный %s",
+                         user_id, q_index + 1, ans_index, q.correct_option)
+            verdict = f"Неверно. Правильный ответ: {correct_ans}"
 
+        # Вердикт показывается в том же сообщении, что и следующий вопрос или итог викторины
         context.user_data['quiz_index'] += 1
         if context.user_data['quiz_index'] < len(questions):
-            await ask_quiz_question(update, context)
+            await ask_quiz_question(update, context, verdict)
         else:
-            await finish_quiz(update, context)
+            await finish_quiz(update, context, verdict)
             return SELECT_MODULE  # Возвращаем состояние SELECT_MODULE
     return ASK_QUIZ
 
 # Обработчик неизвестных команд
+@instrumented
 async def unknown_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_chat.id
     logger.warning(f"Пользователь {user_id} ввел неизвестную команду: {update.message.text}")
     await update.message.reply_text("Команда не распознана. Введите /help для списка команд.")
 
+# Место пользователя в рейтинге
+@instrumented
+async def rank(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_chat.id
+    result = await progress_db.read(analytics.user_rank, user_id)
+    if result is None:
+        await update.message.reply_text("Вы еще не в рейтинге. Пройдите регистрацию: /start")
+        return
+    place, points = result
+    await update.message.reply_text(f"Ваше место в рейтинге: {place}, очков: {points}.")
+
+# Команды администраторов: рейтинг, самые трудные вопросы и проходимость модулей
+def admin_only(handler):
+    @functools.wraps(handler)
+    async def wrapper(update, context):
+        if update.effective_user is None or update.effective_user.id not in ADMIN_IDS:
+            return await unknown_command(update, context)
+        return await handler(update, context)
+    return wrapper
+
+def _command_limit(context, default=10, maximum=30):
+    try:
+        return max(1, min(int(context.args[0]), maximum)) if context.args else default
+    except ValueError:
+        return default
+
+@instrumented
+@admin_only
+async def admin_top(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    rows = await progress_db.read(analytics.leaderboard, _command_limit(context))
+    lines = [f"{i}. {name or user_id} — {points}" for i, (user_id, name, points) in enumerate(rows, 1)]
+    await update.message.reply_text("Рейтинг по очкам:\n" + "\n".join(lines) if lines else "Рейтинг пока пуст.")
+
+@instrumented
+@admin_only
+async def admin_hardest(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    rows = await progress_db.read(analytics.hardest_questions, _command_limit(context))
+    lines = []
+    for qid, attempts, wrong, error_rate in rows:
+        q = CONTENT.catalog.question(qid)
+        lines.append(f"{error_rate:.0%} ошибок ({wrong}/{attempts}) — {q.text[:150] if q else qid}")
+    await update.message.reply_text("Самые трудные вопросы:\n" + "\n".join(lines) if lines
+                                    else f"Пока нет вопросов хотя бы с {analytics.HARDEST_MIN_ATTEMPTS} ответами.")
+
+@instrumented
+@admin_only
+async def admin_modules(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    rows = await progress_db.read(analytics.module_pass_rates)
+    lines = []
+    for module_id, quizzes, passed, pass_rate, correct_rate in rows:
+        module = CONTENT.catalog.module(module_id)
+        lines.append(f"{module.title if module else module_id}: сдано {passed}/{quizzes} ({pass_rate:.0%}), "
+                     f"верных ответов {correct_rate:.0%}")
+    await update.message.reply_text("Проходимость модулей:\n" + "\n".join(lines) if lines else "Викторин пока не было.")
+
 # Обработчик ошибок
 async def error_handler_method(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
     logger.error(msg="Exception while handling an update:", exc_info=context.error)
@@ -328,51 +481,225 @@ async def error_handler_method(update: object, context: ContextTypes.DEFAULT_TYP
         await update.effective_message.reply_text("Извините, произошла ошибка.")
 
 # Обработчик команды /stop
+@instrumented
 async def stop(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_chat.id
-    logger.info(f"Пользователь {user_id} завершил сеанс")
+    logger.debug("Пользователь %s завершил сеанс", user_id)
+    clear_quiz(context)
     await update.message.reply_text("Сеанс завершен. Введите /start для нового сеанса.")
     return ConversationHandler.END
 
 # Обработчик сообщений для взаимодействия с OpenAI
+@instrumented
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    started = time.perf_counter()
     chat_id = update.effective_chat.id
     user_message = update.message.text.strip()
-    logger.info(f"Пользователь {chat_id} отправил сообщение: {user_message}")
+    logger.debug("Пользователь %s отправил сообщение (%s симв.)", chat_id, len(user_message))
 
     # Проверяем, не находится ли пользователь в процессе викторины
     if context.user_data.get('quiz_index') is None:
+        # История читается до записи нового вопроса, чтобы он не попал в нее дважды
+        summary, history = "", []
+        if memory is not None:
+            try:
+                summary, history = await memory.context(chat_id)
+            except Exception as e:
+                logger.warning(f"Ошибка загрузки истории диалога пользователя {chat_id}: {e}")
+
         # Логирование диалога
         log_dialogue(chat_id, "user", user_message)
 
-        try:
-            response = openai.ChatCompletion.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": SYSTEM_PROMPT},
-                    {"role": "user", "content": user_message}
-                ],
-                max_tokens=500,
-                temperature=0.7
+        cached_reply = None
+        # Ответ из кэша годится только для вопроса без контекста: уточнение вроде "а при СД2?" зависит от истории
+        if response_cache is not None and not history:
+            try:
+                cached_reply = await response_cache.aget(user_message)
+            except Exception as e:
+                logger.warning(f"Ошибка кэша ответов: {e}")
+        if cached_reply is not None:
+            logger.debug("Ответ пользователю %s взят из кэша", chat_id)
+            await update.effective_message.reply_text(cached_reply)
+            log_dialogue(chat_id, "assistant", cached_reply)
+            if memory is not None:
+                memory.add(chat_id, "user", user_message)
+                memory.add(chat_id, "assistant", cached_reply)
+            return
+
+        async def notify_queued(position):
+            await update.effective_message.reply_text(
+                f"Сейчас много вопросов. Ваш вопрос в очереди (позиция {position}), ответ придет автоматически."
             )
-            assistant_reply = response.choices[0].message['content'].strip()
-            logger.info(f"OpenAI ответил пользователю {chat_id}: {assistant_reply}")
-            await update.effective_message.reply_text(assistant_reply)
+
+        messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+        if summary:
+            messages.append({"role": "system", "content": f"Краткое содержание прошлой переписки с пользователем:\n{summary}"})
+        messages.extend(history)
+        model = None
+        if retriever is not None and retriever.index is not None:
+            try:
+                passages = await retriever.asearch(user_message)
+            except Exception as e:
+                logger.warning(f"Ошибка поиска по материалам курса: {e}")
+                passages = []
+            if passages:
+                messages.append({"role": "system", "content": format_context(passages)})
+                model = LLM_RAG_MODEL
+        messages.append({"role": "user", "content": user_message})
+
+        streamer = None
+        try:
+            if LLM_STREAMING:
+                # Ответ появляется в чате по частям, по мере генерации
+                chunks = llm_gateway.stream(messages, max_tokens=500, temperature=0.7,
+                                            on_queued=notify_queued, model=model)
+                streamer = StreamingReply(context.bot, chat_id, started)
+                assistant_reply = await streamer.run(chunks)
+            else:
+                assistant_reply = await llm_gateway.chat(
+                    messages,
+                    max_tokens=500,
+                    temperature=0.7,
+                    on_queued=notify_queued,
+                    model=model
+                )
+                await update.effective_message.reply_text(assistant_reply or EMPTY_REPLY_TEXT)
+                first_chunk_seconds.observe(time.perf_counter() - started)
+                reply_seconds.observe(time.perf_counter() - started)
+            logger.debug("OpenAI ответил пользователю %s (%s симв.)", chat_id, len(assistant_reply))
+            if not assistant_reply:
+                logger.warning(f"OpenAI вернул пустой ответ пользователю {chat_id}")
+                return
             log_dialogue(chat_id, "assistant", assistant_reply)
+            if memory is not None:
+                memory.add(chat_id, "user", user_message)
+                memory.add(chat_id, "assistant", assistant_reply)
+            if response_cache is not None and not history:
+                try:
+                    await response_cache.aput(user_message, assistant_reply)
+                except Exception as e:
+                    logger.warning(f"Ошибка кэша ответов: {e}")
+        except LLMQueueFull as e:
+            logger.warning(f"Очередь OpenAI переполнена, запрос пользователя {chat_id} отклонен: {e}")
+            await update.effective_message.reply_text("Сейчас слишком много вопросов. Пожалуйста, повторите через пару минут.")
+        except LLMTimeout as e:
+            logger.error(f"Таймаут OpenAI для пользователя {chat_id}: {e}")
+            # Если часть ответа уже в чате, она помечена как прерванная — отдельное сообщение не нужно
+            if streamer is None or not streamer.interrupted:
+                await update.effective_message.reply_text("Ответ занимает слишком много времени. Пожалуйста, повторите вопрос позже.")
         except Exception as e:
             logger.error(f"Ошибка при вызове OpenAI для пользователя {chat_id}: {e}")
-            await update.effective_message.reply_text("Извините, произошла ошибка при обработке вашего запроса.")
+            if streamer is None or not streamer.interrupted:
+                await update.effective_message.reply_text("Извините, произошла ошибка при обработке вашего запроса.")
+
+# Загрузка тяжелых подсистем. Импорт модулей идет в пуле потоков и не останавливает цикл событий;
+# пока загрузка не закончилась, ответы ассистента идут без кэша и без RAG
+async def warm_up():
+    loop = asyncio.get_running_loop()
+    t0 = time.perf_counter()
+    try:
+        if monitoring.port:
+            await loop.run_in_executor(None, importlib.import_module, "aiohttp.web")
+        await monitoring.start()
+    except Exception as e:
+        logger.error(f"Ошибка при запуске эндпоинта метрик: {e}")
+    try:
+        await loop.run_in_executor(None, load_openai)
+    except Exception as e:
+        logger.error(f"Ошибка при импорте openai: {e}")
+    if embedder is not None and (response_cache is not None or retriever is not None):
+        # Иначе модель эмбеддингов (sentence-transformers для EMBEDDER=huggingface) загрузится
+        # на первом вопросе пользователя после каждого перезапуска и в каждом процессе webhook
+        try:
+            await loop.run_in_executor(None, lambda: embedder.dim)
+        except Exception as e:
+            logger.error(f"Ошибка при загрузке модели эмбеддингов: {e}")
+    if response_cache is not None:
+        await response_cache.start()
+    if retriever is not None:
+        try:
+            if not await loop.run_in_executor(None, retriever.load):
+                logger.warning("Индекс материалов курса не найден, ответы без RAG. Постройте его: python retrieval.py build")
+        except Exception as e:
+            logger.error(f"Ошибка при загрузке индекса материалов курса: {e}")
+    warmup_seconds.set(time.perf_counter() - t0)
+    logger.info(f"Подсистемы загружены за {warmup_seconds.value():.2f} с")
+
+warmup_task = None
+
+# Запуск фоновой записи диалогов, слежения за content.json и загрузки подсистем (эндпоинт метрик, кэш ответов, индекс RAG)
+async def on_startup(application):
+    global warmup_task
+    stat_admin.dialogue_logger.start()
+    CONTENT.start()
+    if LAZY_STARTUP:
+        warmup_task = asyncio.get_running_loop().create_task(warm_up())
+    else:
+        await warm_up()
 
-# Основная функция для запуска бота
-def main():
+# Сохраняем кэш ответов, дописываем буфер диалогов, закрываем пулы соединений с базами данных и эндпоинт метрик при остановке бота
+async def on_shutdown(application):
+    if warmup_task is not None:
+        # Кэш ответов нельзя сохранять, пока он еще загружается с диска
+        try:
+            await warmup_task
+        except Exception as e:
+            logger.error(f"Ошибка при загрузке подсистем: {e}")
+    await CONTENT.stop()
+    if memory is not None:
+        await memory.stop()
+    if response_cache is not None:
+        await response_cache.stop()
+    await stat_admin.dialogue_logger.stop()
+    storage.close_all()
+    await monitoring.stop()
+
+# Сборка приложения со всеми обработчиками. with_updater=False и shard=(номер, всего) — для процессов
+# режима webhook, которые получают обновления своей доли чатов от фронтального HTTP-сервера (см. webhook.py)
+def build_application(with_updater=True, shard=None):
     logger.info("Инициализация базы данных")
     stat_admin.initialize_db()
     setup_progress_db()
-    application = ApplicationBuilder().token(TELEGRAM_BOT_TOKEN).build()
+    # Состояния диалогов и user_data переживают перезапуск; вопросы викторины восстанавливаются по id из каталога
+    persistence = SQLitePersistence(resolve_question=lambda qid: CONTENT.catalog.question(qid), shard=shard)
+    if shard is not None and response_cache is not None:
+        # У каждого процесса свой файл кэша ответов, чтобы процессы не перезаписывали сохранения друг друга
+        response_cache.path = f"{response_cache.path}.{shard[0]}"
+    if shard is not None and monitoring.port:
+        # Порт METRICS_PORT занят фронтальным процессом, обработчики отдают метрики на следующих
+        monitoring.port += shard[0] + 1
+    builder = (
+        ApplicationBuilder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .persistence(persistence)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        # Чаты обрабатываются одновременно, обновления одного чата — по очереди: чат, который ждет
+        # лимита Bot API, не задерживает остальных (см. chat_dispatch.py)
+        .application_class(ChatOrderedApplication)
+        .concurrent_updates(CONCURRENT_UPDATES)
+    )
+    if TELEGRAM_BASE_URL:
+        builder = builder.base_url(TELEGRAM_BASE_URL)
+    if TG_RATE_LIMIT:
+        # Общий лимит бота делится между процессами режима webhook, лимиты чатов — нет: чат всегда в одном процессе
+        workers = shard[1] if shard is not None else 1
+        rate_limiter = TelegramRateLimiter(global_rate=TG_GLOBAL_RATE / workers,
+                                           global_burst=max(1, TG_GLOBAL_BURST // workers))
+        metrics.gauge("telegram_send_waiting", "Запросов к Bot API, ждущих в ограничителе частоты",
+                      fn=lambda: rate_limiter.waiting)
+        builder = builder.rate_limiter(rate_limiter)
+    if not with_updater:
+        builder = builder.updater(None)
+    application = builder.build()
+    metrics.gauge("updates_busy_chats", "Чатов, обновления которых сейчас обрабатываются",
+                  fn=lambda: application.busy_chats)
     logger.info("База данных инициализирована")
 
     # Определение ConversationHandler без параметра per_message=True
     conv_handler = ConversationHandler(
+        name="main",
+        persistent=True,
         entry_points=[CommandHandler("start", start)],
         states={
             ASK_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, ask_name)],
@@ -390,11 +717,24 @@ def main():
     # Добавление обработчиков в приложение
     application.add_handler(conv_handler)
     application.add_handler(CommandHandler("help", main_menu))
-    # Если пользователь отправил что-то вне диалога уроков — используем handle_message для OpenAI
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    application.add_handler(CommandHandler("rank", rank))
+    application.add_handler(CommandHandler("top", admin_top))
+    application.add_handler(CommandHandler("hardest", admin_hardest))
+    application.add_handler(CommandHandler("modules", admin_modules))
+    # Если пользователь отправил что-то вне диалога уроков — используем handle_message для OpenAI.
+    # block=False: ожидание ответа OpenAI не задерживает обработку остальных обновлений (викторины и т.д.)
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message, block=False))
     application.add_handler(MessageHandler(filters.COMMAND, unknown_command))
     application.add_error_handler(error_handler_method)
+    return application
 
+# Основная функция для запуска бота в режиме long polling. Режим webhook запускается только через python webhook.py:
+# процессы-обработчики заново выполняют главный модуль, и bot.py загрузился бы в каждом из них дважды
+def main():
+    if WEBHOOK_URL:
+        logger.error("Задан WEBHOOK_URL: режим webhook запускается командой python webhook.py")
+        raise SystemExit(1)
+    application = build_application()
     logger.info("Бот запущен и работает...")
     application.run_polling()
 
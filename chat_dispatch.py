@@ -0,0 +1,53 @@
+# chat_dispatch.py
+import logging
+import os
+from collections import deque
+
+from telegram import Update
+from telegram.ext import Application
+
+logger = logging.getLogger(__name__)
+
+# Сколько чатов обрабатывается одновременно; 0 — все обновления строго по очереди, как в PTB по умолчанию
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "256"))
+
+
+class ChatOrderedApplication(Application):
+    """Application, которое обрабатывает разные чаты одновременно, а обновления одного чата — по очереди.
+
+    С ``concurrent_updates`` PTB запускает каждое обновление отдельной задачей
+    без учета чата, а ConversationHandler и викторины рассчитывают на порядок
+    сообщений внутри диалога. Здесь обновление чата, который уже занят,
+    только ставится в очередь этого чата, и ее разбирает задача, занявшая чат.
+    Чат, ждущий лимита Bot API или паузы после 429, задерживает только свои
+    обновления и занимает одно место из ``concurrent_updates``.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._chat_queues = {}  # chat_id -> обновления, ждущие своей очереди
+
+    @property
+    def busy_chats(self):
+        return len(self._chat_queues)
+
+    async def process_update(self, update):
+        chat = update.effective_chat if isinstance(update, Update) else None
+        if chat is None or not self.concurrent_updates:
+            await super().process_update(update)
+            return
+        pending = self._chat_queues.get(chat.id)
+        if pending is not None:
+            pending.append(update)
+            return
+        pending = self._chat_queues[chat.id] = deque([update])
+        try:
+            while pending:
+                try:
+                    await super().process_update(pending[0])
+                except Exception as e:
+                    # Ошибки обработчиков уходят в error handler; сюда попадают только ошибки самого PTB
+                    logger.error(f"Ошибка при обработке обновления чата {chat.id}: {e}")
+                pending.popleft()
+        finally:
+            del self._chat_queues[chat.id]
@@ -0,0 +1,344 @@
+# content_catalog.py
+import asyncio
+import hashlib
+import json
+import logging
+import marshal
+import os
+import time
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+CONTENT_RELOAD_INTERVAL = float(os.getenv("CONTENT_RELOAD_INTERVAL", "5"))
+# Разобранный и проверенный content.json в формате marshal; пустая строка — без кэша
+CONTENT_CACHE_PATH = os.getenv("CONTENT_CACHE_PATH", os.path.join(os.getcwd(), 'database', 'content.cache'))
+CONTENT_CACHE_FORMAT = 2
+
+reloads_total = metrics.counter("content_reloads_total", "Перезагрузки content.json", labelnames=("result",))
+reload_seconds = metrics.gauge("content_reload_seconds", "Длительность последней перезагрузки content.json, с")
+validation_errors = metrics.gauge("content_validation_errors", "Ошибок при последней проверке content.json")
+
+# Клавиатура перехода от урока к вопросам одинакова для всех уроков
+QUIZ_START_KEYBOARD = InlineKeyboardMarkup([[InlineKeyboardButton("Далее", callback_data="quiz_start")]])
+
+_answer_keyboards = {}
+
+
+def answer_keyboard(n_options):
+    """Клавиатура с номерами вариантов 1..n; одна общая на каждое число вариантов."""
+    keyboard = _answer_keyboards.get(n_options)
+    if keyboard is None:
+        keyboard = _answer_keyboards[n_options] = InlineKeyboardMarkup(
+            [[InlineKeyboardButton(str(i + 1), callback_data=f"answer_{i}")] for i in range(n_options)]
+        )
+    return keyboard
+
+
+def question_key(q):
+    """Ключ вопроса внутри урока: поле ``id`` или, если его нет, хэш текста вопроса и вариантов.
+
+    Ключ не зависит от положения вопроса в уроке, поэтому вставка и перестановка
+    вопросов в content.json не сдвигают ссылки на остальные вопросы в базах.
+    Правка текста без поля ``id`` дает новый вопрос с чистой статистикой.
+    """
+    explicit = q.get('id')
+    if explicit is not None:
+        return str(explicit)
+    # В уроке бывают вопросы с одинаковой формулировкой и разными вариантами ответа
+    text = "\n".join([q['question'].strip(), *(str(o).strip() for o in q.get('options') or ())])
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:12]
+
+
+class Question:
+    """Вопрос викторины с заранее подготовленным текстом и клавиатурой.
+
+    ``qid`` — устойчивая ссылка на вопрос вида ``module_id/lesson_id/ключ``
+    (см. ``question_key``); по ней вопрос ищут прогресс, статистика и
+    сохраненные викторины.
+    """
+
+    __slots__ = ("qid", "text", "options", "correct_option", "prompt", "keyboard")
+
+    def __init__(self, qid, text, options, correct_option):
+        self.qid = qid
+        self.text = text
+        self.options = tuple(options)
+        self.correct_option = correct_option
+        options_text = "\n".join(f"{i + 1}. {opt}" for i, opt in enumerate(self.options))
+        self.prompt = f"Вопрос: {text}\n\n{options_text}"
+        self.keyboard = answer_keyboard(len(self.options))
+
+    @property
+    def correct_answer(self):
+        return self.options[self.correct_option]
+
+    # Вопросы неизменяемы, поэтому копии не нужны: Application глубоко копирует
+    # user_data перед сохранением, а в user_data лежат ссылки на вопросы викторины
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+class Lesson:
+    __slots__ = ("module_id", "id", "title", "content", "questions", "text")
+
+    def __init__(self, module_id, data):
+        self.module_id = module_id
+        self.id = data['id']
+        self.title = data['title']
+        self.content = data.get('content', '')
+        self.questions = tuple(
+            Question(f"{module_id}/{self.id}/{question_key(q)}", q['question'], q['options'], q['correct_option'])
+            for q in data.get('questions') or ()
+        )
+        self.text = f"Урок: {self.title}\n{self.content}\n\n(Нажмите Далее чтобы перейти к вопросам)"
+
+
+class Module:
+    __slots__ = ("id", "title", "description", "lessons", "lessons_by_id", "text", "keyboard")
+
+    def __init__(self, data):
+        self.id = data['id']
+        self.title = data['title']
+        self.description = data.get('description', '')
+        self.lessons = tuple(Lesson(self.id, lesson) for lesson in data.get('lessons', ()))
+        self.lessons_by_id = {lesson.id: lesson for lesson in self.lessons}
+        self.text = f"Модуль: {self.title}\nВыберите урок:"
+        self.keyboard = InlineKeyboardMarkup(
+            [[InlineKeyboardButton(lesson.title, callback_data=f"lesson_{lesson.id}")] for lesson in self.lessons]
+        )
+
+
+class ContentCatalog:
+    """Неизменяемый индекс content.json, строится один раз при загрузке.
+
+    Поиск модуля, урока и вопроса по идентификатору — словари (O(1)),
+    тексты и клавиатуры подготовлены заранее, поэтому обработчики
+    callback'ов ничего не перебирают и не собирают.
+    """
+
+    def __init__(self, data):
+        self.modules = tuple(Module(m) for m in data.get('modules', ()))
+        self.modules_by_id = {m.id: m for m in self.modules}
+        self.questions_by_id = {
+            q.qid: q for m in self.modules for lesson in m.lessons for q in lesson.questions
+        }
+        self.main_menu_keyboard = InlineKeyboardMarkup(
+            [[InlineKeyboardButton(m.title, callback_data=f"module_{m.id}")] for m in self.modules]
+        )
+
+    def module(self, module_id):
+        return self.modules_by_id.get(module_id)
+
+    def lesson(self, module_id, lesson_id):
+        module = self.modules_by_id.get(module_id)
+        return module.lessons_by_id.get(lesson_id) if module else None
+
+    def question(self, qid):
+        return self.questions_by_id.get(qid)
+
+
+class ContentValidationError(ValueError):
+    def __init__(self, errors):
+        super().__init__(f"content.json содержит ошибок: {len(errors)}; первая: {errors[0]}")
+        self.errors = errors
+
+
+def validate_content(data):
+    """Проверяет структуру content.json, возвращает список ошибок (пустой, если все в порядке)."""
+    errors = []
+    modules = data.get('modules') if isinstance(data, dict) else None
+    if not isinstance(modules, list):
+        return ["нет списка 'modules'"]
+    module_ids = set()
+    for mi, m in enumerate(modules):
+        where = f"modules[{mi}]"
+        if not isinstance(m, dict) or not m.get('id') or not m.get('title'):
+            errors.append(f"{where}: нужны поля 'id' и 'title'")
+            continue
+        if m['id'] in module_ids:
+            errors.append(f"{where}: повторяется id модуля {m['id']!r}")
+        module_ids.add(m['id'])
+        lesson_ids = set()
+        for li, lesson in enumerate(m.get('lessons') or ()):
+            where = f"{m['id']}.lessons[{li}]"
+            if not isinstance(lesson, dict) or not lesson.get('id') or not lesson.get('title'):
+                errors.append(f"{where}: нужны поля 'id' и 'title'")
+                continue
+            if lesson['id'] in lesson_ids:
+                errors.append(f"{where}: повторяется id урока {lesson['id']!r}")
+            lesson_ids.add(lesson['id'])
+            question_keys = set()
+            for qi, q in enumerate(lesson.get('questions') or ()):
+                where = f"{m['id']}/{lesson['id']}.questions[{qi}]"
+                if not isinstance(q, dict) or not isinstance(q.get('question'), str) or not q['question'].strip():
+                    errors.append(f"{where}: нет текста вопроса")
+                    continue
+                if 'id' in q and (not isinstance(q['id'], (str, int)) or isinstance(q['id'], bool)
+                                  or not str(q['id']) or '/' in str(q['id'])):
+                    errors.append(f"{where}: id вопроса {q['id']!r} должен быть непустой строкой без '/'")
+                    continue
+                options = q.get('options')
+                if not isinstance(options, list) or not options or not all(isinstance(o, str) for o in options):
+                    errors.append(f"{where}: 'options' должен быть непустым списком строк")
+                    continue
+                key = question_key(q)
+                if key in question_keys:
+                    errors.append(f"{where}: повторяется id вопроса {key!r} (одинаковые вопросы — задайте им поле 'id')")
+                question_keys.add(key)
+                correct = q.get('correct_option')
+                if not isinstance(correct, int) or isinstance(correct, bool) or not 0 <= correct < len(options):
+                    errors.append(f"{where}: correct_option={correct!r} вне диапазона 0..{len(options) - 1}")
+    return errors
+
+
+def _read_cache(cache_path, digest):
+    try:
+        with open(cache_path, 'rb') as f:
+            fmt, version, cached_digest, data = marshal.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, EOFError, ValueError, TypeError) as e:
+        logger.warning(f"Кэш контента {cache_path} не прочитан: {e}")
+        return None
+    if (fmt, version, cached_digest) != (CONTENT_CACHE_FORMAT, marshal.version, digest):
+        return None
+    return data
+
+
+def _write_cache(cache_path, digest, data):
+    # Несколько процессов режима webhook могут писать кэш одновременно: у каждого свой временный файл
+    tmp = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(cache_path) or '.', exist_ok=True)
+        with open(tmp, 'wb') as f:
+            marshal.dump((CONTENT_CACHE_FORMAT, marshal.version, digest, data), f)
+        os.replace(tmp, cache_path)
+    except OSError as e:
+        logger.warning(f"Не удалось записать кэш контента {cache_path}: {e}")
+
+
+def load_content_data(path, cache_path=CONTENT_CACHE_PATH):
+    """Читает и проверяет content.json; при ошибках — ContentValidationError.
+
+    Проверенные данные сохраняются в ``cache_path`` вместе с sha256 файла:
+    пока содержимое не изменилось, разбор JSON и проверка пропускаются.
+    """
+    with open(path, 'rb') as f:
+        raw = f.read()
+    digest = hashlib.sha256(raw).hexdigest()
+    if cache_path:
+        data = _read_cache(cache_path, digest)
+        if data is not None:
+            return data
+    data = json.loads(raw)
+    errors = validate_content(data)
+    if errors:
+        raise ContentValidationError(errors)
+    if cache_path:
+        _write_cache(cache_path, digest, data)
+    return data
+
+
+def build_catalog(path, cache_path=CONTENT_CACHE_PATH):
+    """Читает, проверяет и индексирует content.json; при ошибках — ContentValidationError."""
+    return ContentCatalog(load_content_data(path, cache_path))
+
+
+class ContentWatcher:
+    """Следит за content.json и подменяет каталог без перезапуска бота.
+
+    Раз в ``interval`` секунд сравнивает mtime и размер файла; при изменении
+    разбирает и проверяет файл в пуле потоков и атомарно заменяет ``catalog``.
+    Если новый файл некорректен, продолжает работать старый каталог.
+    Начатые викторины не затрагиваются: они держат ссылки на объекты
+    вопросов того каталога, из которого были запущены.
+    """
+
+    def __init__(self, path, interval=CONTENT_RELOAD_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.catalog = ContentCatalog({"modules": []})
+        self.last_errors = []
+        self._signature = None
+        self._task = None
+
+    def _stat_signature(self):
+        st = os.stat(self.path)
+        return st.st_mtime_ns, st.st_size
+
+    def _reload(self, signature):
+        # Запоминаем версию файла и при ошибке, чтобы не разбирать его повторно до следующей правки
+        self._signature = signature
+        t0 = time.perf_counter()
+        try:
+            catalog = build_catalog(self.path)
+        except ContentValidationError as e:
+            self.last_errors = e.errors
+            raise
+        except Exception as e:
+            self.last_errors = [str(e)]
+            raise
+        else:
+            self.last_errors = []
+            self.catalog = catalog
+            return catalog
+        finally:
+            reload_seconds.set(time.perf_counter() - t0)
+            validation_errors.set(len(self.last_errors))
+
+    def load(self):
+        """Синхронная загрузка при старте."""
+        self._reload(self._stat_signature())
+        reloads_total.inc(result="ok")
+
+    async def check(self):
+        """Проверяет файл и при изменении перезагружает каталог; True, если каталог заменен."""
+        try:
+            signature = self._stat_signature()
+        except OSError as e:
+            logger.error(f"Не удалось прочитать {self.path}: {e}")
+            return False
+        if signature == self._signature:
+            return False
+        loop = asyncio.get_running_loop()
+        try:
+            catalog = await loop.run_in_executor(None, self._reload, signature)
+        except ContentValidationError as e:
+            reloads_total.inc(result="invalid")
+            logger.error(f"Новый {self.path} не принят, ошибок: {len(e.errors)}")
+            for err in e.errors[:20]:
+                logger.error(f"  {err}")
+            return False
+        except Exception as e:
+            reloads_total.inc(result="error")
+            logger.error(f"Ошибка при перезагрузке {self.path}: {e}")
+            return False
+        reloads_total.inc(result="ok")
+        logger.info(f"{self.path} перезагружен: модулей {len(catalog.modules)}, "
+                    f"вопросов {len(catalog.questions_by_id)}, {reload_seconds.value():.3f} с")
+        return True
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.check()
+
+    def start(self):
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,207 @@
+# conversation_memory.py
+import asyncio
+import calendar
+import logging
+import os
+import time
+from collections import deque
+
+import metrics
+from user_cache import UserCache
+
+logger = logging.getLogger(__name__)
+
+MEMORY_ENABLED = os.getenv("MEMORY_ENABLED", "1") == "1"
+# Сколько последних реплик (вопросов и ответов) держать в памяти на пользователя
+MEMORY_TURNS = int(os.getenv("MEMORY_TURNS", "12"))
+# Сколько токенов истории (без системного промпта и вопроса) добавлять в запрос
+MEMORY_TOKEN_BUDGET = int(os.getenv("MEMORY_TOKEN_BUDGET", "1200"))
+# Реплики старше этого, с, считаются прошлым разговором и уходят в сводку
+MEMORY_IDLE_TTL = float(os.getenv("MEMORY_IDLE_TTL", str(3600)))
+MEMORY_MAX_USERS = int(os.getenv("MEMORY_MAX_USERS", "10000"))
+MEMORY_SUMMARY_ENABLED = os.getenv("MEMORY_SUMMARY_ENABLED", "1") == "1"
+# Сводка пересчитывается, когда вытесненных из окна реплик набирается на столько токенов
+MEMORY_SUMMARY_BATCH = int(os.getenv("MEMORY_SUMMARY_BATCH", "400"))
+MEMORY_SUMMARY_TOKENS = int(os.getenv("MEMORY_SUMMARY_TOKENS", "250"))
+
+history_tokens = metrics.histogram(
+    "llm_prompt_history_tokens", "Токенов истории диалога в запросе к OpenAI (оценка)",
+    buckets=(0, 50, 100, 200, 400, 800, 1200, 1600, 2400, 3200))
+summaries_total = metrics.counter(
+    "memory_summaries_total", "Пересчеты сводки диалога", labelnames=("result",))
+
+SUMMARY_PROMPT = """
+Ты ведешь краткую сводку переписки пользователя с помощником по сахарному диабету.
+Обнови сводку с учетом новых реплик: сохрани факты о пользователе (тип диабета, терапия, показатели,
+жалобы), заданные вопросы и данные рекомендации. Пиши по-русски, кратко, не больше {words} слов, без вступлений.
+"""
+
+
+def estimate_tokens(text):
+    """Грубая оценка числа токенов OpenAI: для русского текста около 3 символов на токен."""
+    return len(text) // 3 + 4
+
+
+def _parse_timestamp(value):
+    # Формат CURRENT_TIMESTAMP (UTC), в котором DialogueLogger пишет время реплики
+    try:
+        return float(calendar.timegm(time.strptime(value, '%Y-%m-%d %H:%M:%S')))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class _Turn:
+    __slots__ = ("role", "text", "tokens", "at")
+
+    def __init__(self, role, text, at):
+        self.role = role
+        self.text = text
+        self.tokens = estimate_tokens(text)
+        self.at = at
+
+    def message(self):
+        return {"role": self.role, "content": self.text}
+
+
+class _Conversation:
+    __slots__ = ("turns", "summary", "overflow", "overflow_tokens", "summarizing")
+
+    def __init__(self, turns, summary):
+        self.turns = turns
+        self.summary = summary
+        self.overflow = []
+        self.overflow_tokens = 0
+        self.summarizing = None
+
+
+class ConversationMemory:
+    """Память диалога с ассистентом для каждого пользователя.
+
+    Последние ``max_turns`` реплик держатся в кольцевом буфере (deque); при
+    первом обращении после перезапуска или вытеснения буфер заполняется
+    одним запросом к ``dialogues`` по индексу (user_id, timestamp). В запрос
+    к OpenAI попадают только свежие реплики, помещающиеся в ``token_budget``,
+    остальные копятся и раз в ``summary_batch`` токенов сворачиваются
+    функцией ``summarize`` в короткую сводку, которая хранится в
+    ``dialogue_summaries``. Размер запроса поэтому не растет с длиной переписки.
+    Реплики пишутся в ``dialogues`` с задержкой (stat_admin.DialogueLogger), поэтому
+    перед загрузкой вызывается ``flush_pending`` — иначе пользователь, вытесненный
+    и вернувшийся раньше сброса буфера, потерял бы последние реплики.
+    """
+
+    def __init__(self, db, summarize=None, max_turns=MEMORY_TURNS, token_budget=MEMORY_TOKEN_BUDGET,
+                 idle_ttl=MEMORY_IDLE_TTL, max_users=MEMORY_MAX_USERS, summary_batch=MEMORY_SUMMARY_BATCH,
+                 flush_pending=None):
+        self.db = db
+        self.flush_pending = flush_pending
+        self.summarize = summarize
+        self.max_turns = max_turns
+        self.token_budget = token_budget
+        self.idle_ttl = idle_ttl
+        self.summary_batch = summary_batch
+        self._conversations = UserCache(self._load, max_users)  # user_id -> _Conversation
+
+    def __len__(self):
+        return len(self._conversations)
+
+    @staticmethod
+    def _load_rows(c, user_id, limit):
+        # Реплики, уже вошедшие в сводку (до upto), повторно не загружаем
+        summary, upto = c.execute('SELECT summary, upto FROM dialogue_summaries WHERE user_id=?',
+                                  (user_id,)).fetchone() or ("", "")
+        rows = c.execute('SELECT role, message, timestamp FROM dialogues WHERE user_id=? AND timestamp > ? '
+                         'ORDER BY timestamp DESC, id DESC LIMIT ?', (user_id, upto or "", limit)).fetchall()
+        return rows, summary
+
+    async def _load(self, user_id):
+        if self.flush_pending is not None:
+            try:
+                await self.flush_pending()
+            except Exception as e:
+                logger.warning(f"Не удалось дописать буфер диалогов перед загрузкой истории {user_id}: {e}")
+        rows, summary = await self.db.read(self._load_rows, user_id, self.max_turns)
+        turns = deque((_Turn(role, text or "", _parse_timestamp(ts)) for role, text, ts in reversed(rows)),
+                      maxlen=self.max_turns)
+        return _Conversation(turns, summary)
+
+    def _push_overflow(self, conv, turn):
+        if self.summarize is None:
+            return
+        conv.overflow.append(turn)
+        conv.overflow_tokens += turn.tokens
+        # Если сводка долго не пересчитывается (например, OpenAI перегружен), не копим без предела
+        while conv.overflow_tokens > 4 * self.summary_batch and len(conv.overflow) > 1:
+            conv.overflow_tokens -= conv.overflow.pop(0).tokens
+
+    async def context(self, user_id):
+        """История для запроса: (сводка или "", [{"role", "content"}, ...] от старых к новым).
+
+        В историю попадают реплики не старше ``idle_ttl`` в пределах ``token_budget``;
+        более старые уходят на пересчет сводки.
+        """
+        conv = await self._conversations.get(user_id)
+        cutoff = time.time() - self.idle_ttl
+        while conv.turns and conv.turns[0].at < cutoff:
+            self._push_overflow(conv, conv.turns.popleft())
+        used = 0
+        start = len(conv.turns)
+        for turn in reversed(conv.turns):
+            if used + turn.tokens > self.token_budget:
+                break
+            used += turn.tokens
+            start -= 1
+        for _ in range(start):
+            self._push_overflow(conv, conv.turns.popleft())
+        history_tokens.observe(used + (estimate_tokens(conv.summary) if conv.summary else 0))
+        self._maybe_summarize(user_id, conv)
+        return conv.summary, [turn.message() for turn in conv.turns]
+
+    def add(self, user_id, role, text):
+        """Добавляет реплику в буфер пользователя, если он уже в памяти (иначе она загрузится из dialogues)."""
+        conv = self._conversations.peek(user_id)
+        if conv is None:
+            return
+        if len(conv.turns) == conv.turns.maxlen:
+            self._push_overflow(conv, conv.turns[0])
+        conv.turns.append(_Turn(role, text, time.time()))
+
+    def _maybe_summarize(self, user_id, conv):
+        if self.summarize is None or conv.summarizing is not None or conv.overflow_tokens < self.summary_batch:
+            return
+        turns, conv.overflow, conv.overflow_tokens = conv.overflow, [], 0
+        conv.summarizing = asyncio.get_running_loop().create_task(self._summarize(user_id, conv, turns))
+
+    async def _summarize(self, user_id, conv, turns):
+        try:
+            summary = await self.summarize(conv.summary, [turn.message() for turn in turns])
+            if summary:
+                conv.summary = summary
+                upto = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(max(turn.at for turn in turns)))
+                await self.db.execute('INSERT INTO dialogue_summaries (user_id, summary, upto, updated) '
+                                      'VALUES (?,?,?,CURRENT_TIMESTAMP) ON CONFLICT(user_id) DO UPDATE SET '
+                                      'summary=excluded.summary, upto=excluded.upto, updated=excluded.updated',
+                                      (user_id, summary, upto))
+            summaries_total.inc(result="ok")
+        except Exception as e:
+            # Реплики возвращаем, сводка пересчитается при следующем сообщении
+            logger.warning(f"Не удалось обновить сводку диалога пользователя {user_id}: {e}")
+            summaries_total.inc(result="error")
+            conv.overflow[:0] = turns
+            conv.overflow_tokens += sum(turn.tokens for turn in turns)
+        finally:
+            conv.summarizing = None
+
+    async def stop(self):
+        """Дожидается начатых пересчетов сводок."""
+        tasks = [conv.summarizing for conv in self._conversations.values() if conv.summarizing is not None]
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def summary_messages(summary, turns, words=MEMORY_SUMMARY_TOKENS // 2):
+    """Запрос к OpenAI на обновление сводки ``summary`` репликами ``turns``."""
+    dialogue = "\n".join(f"{'Пользователь' if t['role'] == 'user' else 'Помощник'}: {t['content']}" for t in turns)
+    return [
+        {"role": "system", "content": SUMMARY_PROMPT.format(words=words)},
+        {"role": "user", "content": f"Текущая сводка:\n{summary or '(пусто)'}\n\nНовые реплики:\n{dialogue}"},
+    ]
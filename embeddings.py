@@ -0,0 +1,91 @@
+# embeddings.py
+import hashlib
+import logging
+import os
+import re
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Модель эмбеддингов: "huggingface" (по умолчанию), "hashing" (детерминированная заглушка) или "none"
+EMBEDDER = os.getenv("EMBEDDER", "huggingface")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+class HashingEmbedder:
+    """Детерминированные эмбеддинги без модели и сети.
+
+    Слова и символьные триграммы хэшируются в вектор фиксированной длины.
+    Тексты с общими словами получаются близкими, чего достаточно для
+    проверок кэша и поиска без загрузки нейросети.
+    """
+
+    def __init__(self, dim=256):
+        self.dim = dim
+
+    def _features(self, text):
+        words = _WORD_RE.findall(text.lower().replace('ё', 'е'))
+        for w in words:
+            yield w
+            padded = f"#{w}#"
+            for i in range(len(padded) - 2):
+                yield padded[i:i + 3]
+
+    def embed(self, texts):
+        import numpy as np
+
+        vectors = np.zeros((len(texts), self.dim), dtype='float32')
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                h = int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'little')
+                vectors[row, h % self.dim] += 1.0 if (h >> 63) & 1 else -1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+
+class HuggingFaceEmbedder:
+    """Эмбеддинги sentence-transformers через langchain-huggingface; модель загружается при первом вызове."""
+
+    def __init__(self, model_name=EMBEDDING_MODEL):
+        self.model_name = model_name
+        self._model = None
+        self._dim = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        # Модель загружают и фоновый прогрев при запуске, и первые запросы в пуле потоков — загружаем один раз
+        with self._lock:
+            if self._model is None:
+                from langchain_huggingface import HuggingFaceEmbeddings
+
+                logger.info(f"Загрузка модели эмбеддингов {self.model_name}")
+                self._model = HuggingFaceEmbeddings(model_name=self.model_name,
+                                                    encode_kwargs={"normalize_embeddings": True})
+        return self._model
+
+    @property
+    def dim(self):
+        if self._dim is None:
+            self._dim = self.embed(["диабет"]).shape[1]
+        return self._dim
+
+    def embed(self, texts):
+        import numpy as np
+
+        vectors = np.asarray(self._load().embed_documents(list(texts)), dtype='float32')
+        self._dim = vectors.shape[1]
+        return vectors
+
+
+def get_embedder(name=EMBEDDER):
+    """Создает модель эмбеддингов по имени; для "none" возвращает None."""
+    if name == "huggingface":
+        return HuggingFaceEmbedder()
+    if name == "hashing":
+        return HashingEmbedder()
+    if name == "none":
+        return None
+    raise ValueError(f"Неизвестная модель эмбеддингов: {name}")
@@ -0,0 +1,185 @@
+# llm_gateway.py
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Параметры шлюза (переопределяются через .env)
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4")
+# Модель для ответов с найденными материалами курса (RAG); можно указать более быструю и дешевую
+LLM_RAG_MODEL = os.getenv("LLM_RAG_MODEL", LLM_MODEL)
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "200"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+
+
+request_seconds = metrics.histogram(
+    "llm_request_seconds", "Длительность запроса к OpenAI без ожидания в очереди, с", labelnames=("model", "mode"))
+queue_wait_seconds = metrics.histogram(
+    "llm_queue_wait_seconds", "Ожидание свободного слота шлюза OpenAI, с")
+requests_total = metrics.counter(
+    "llm_requests_total", "Запросы к OpenAI по результату", labelnames=("model", "result"))
+# В потоковом режиме OpenAI не присылает usage: число фрагментов ответа примерно равно числу токенов
+tokens_total = metrics.counter(
+    "llm_tokens_total", "Токены OpenAI (completion при stream=True — по числу фрагментов)",
+    labelnames=("model", "kind"))
+
+
+def load_openai():
+    """Модуль openai, импортируется при первом обращении.
+
+    Импорт openai (вместе с requests и numpy) занимает сотни миллисекунд,
+    поэтому выполняется при первом запросе или в фоне после запуска бота
+    (см. LAZY_STARTUP в bot.py), а не при импорте модулей. Ключ и адрес API
+    openai сам читает из OPENAI_API_KEY и OPENAI_API_BASE.
+    """
+    import openai
+
+    return openai
+
+
+class LLMQueueFull(Exception):
+    """Очередь к OpenAI переполнена, запрос не принят."""
+
+
+class LLMTimeout(Exception):
+    """OpenAI не ответил за отведенное время."""
+
+
+class LLMGateway:
+    """Асинхронный шлюз к OpenAI с ограничением числа одновременных запросов.
+
+    Не более ``max_concurrency`` запросов выполняются одновременно, остальные
+    ждут в очереди длиной до ``max_queue``. Если очередь заполнена, запрос
+    отклоняется сразу (LLMQueueFull), чтобы не копить бесконечный хвост.
+    """
+
+    def __init__(self, model=LLM_MODEL, max_concurrency=LLM_MAX_CONCURRENCY,
+                 max_queue=LLM_MAX_QUEUE, timeout=LLM_TIMEOUT):
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._waiting = 0
+        self._in_flight = 0
+
+    @property
+    def queue_depth(self):
+        return self._waiting
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    @asynccontextmanager
+    async def _slot(self, on_queued=None):
+        if self._semaphore.locked():
+            if self._waiting >= self.max_queue:
+                requests_total.inc(model=self.model, result="queue_full")
+                raise LLMQueueFull(f"в очереди уже {self._waiting} запросов")
+            self._waiting += 1
+            t0 = time.perf_counter()
+            try:
+                if on_queued is not None:
+                    await on_queued(self._waiting)
+                await self._semaphore.acquire()
+            finally:
+                self._waiting -= 1
+                queue_wait_seconds.observe(time.perf_counter() - t0)
+        else:
+            await self._semaphore.acquire()
+            queue_wait_seconds.observe(0.0)
+        self._in_flight += 1
+        try:
+            yield
+        finally:
+            self._in_flight -= 1
+            self._semaphore.release()
+
+    async def chat(self, messages, max_tokens=500, temperature=0.7, on_queued=None, model=None):
+        """Отправляет запрос к ChatCompletion и возвращает текст ответа.
+
+        ``on_queued`` — корутина, вызываемая с позицией в очереди, если
+        свободных слотов нет и запросу придется подождать. ``model``
+        переопределяет модель шлюза для этого запроса.
+        """
+        model = model or self.model
+        async with self._slot(on_queued):
+            t0 = time.perf_counter()
+            try:
+                response = await asyncio.wait_for(
+                    load_openai().ChatCompletion.acreate(
+                        model=model,
+                        messages=messages,
+                        max_tokens=max_tokens,
+                        temperature=temperature,
+                        request_timeout=self.timeout,
+                    ),
+                    self.timeout,
+                )
+            except asyncio.TimeoutError as e:
+                requests_total.inc(model=model, result="timeout")
+                raise LLMTimeout(f"нет ответа за {self.timeout} с") from e
+            except Exception:
+                requests_total.inc(model=model, result="error")
+                raise
+            finally:
+                request_seconds.observe(time.perf_counter() - t0, model=model, mode="chat")
+        requests_total.inc(model=model, result="ok")
+        usage = response.get('usage')
+        if usage:
+            tokens_total.inc(usage.get('prompt_tokens', 0), model=model, kind="prompt")
+            tokens_total.inc(usage.get('completion_tokens', 0), model=model, kind="completion")
+        return response.choices[0].message['content'].strip()
+
+    async def stream(self, messages, max_tokens=500, temperature=0.7, on_queued=None, model=None):
+        """То же, что ``chat``, но отдает ответ по частям по мере генерации.
+
+        Слот очереди занят, пока поток не дочитан; ``timeout`` ограничивает
+        всю генерацию целиком.
+        """
+        model = model or self.model
+        async with self._slot(on_queued):
+            deadline = time.monotonic() + self.timeout
+            t0 = time.perf_counter()
+            pieces = 0
+            result = "error"
+            try:
+                chunks = await asyncio.wait_for(
+                    load_openai().ChatCompletion.acreate(
+                        model=model,
+                        messages=messages,
+                        max_tokens=max_tokens,
+                        temperature=temperature,
+                        request_timeout=self.timeout,
+                        stream=True,
+                    ),
+                    self.timeout,
+                )
+                chunks = chunks.__aiter__()
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(chunks.__anext__(), deadline - time.monotonic())
+                    except StopAsyncIteration:
+                        break
+                    piece = chunk.choices[0].delta.get('content') if chunk.choices else None
+                    if piece:
+                        pieces += 1
+                        yield piece
+                result = "ok"
+            except asyncio.TimeoutError as e:
+                result = "timeout"
+                raise LLMTimeout(f"нет ответа за {self.timeout} с") from e
+            except (GeneratorExit, asyncio.CancelledError):
+                result = "cancelled"
+                raise
+            finally:
+                requests_total.inc(model=model, result=result)
+                request_seconds.observe(time.perf_counter() - t0, model=model, mode="stream")
+                tokens_total.inc(pieces, model=model, kind="completion")
@@ -0,0 +1,176 @@
+# metrics.py
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Простейший реестр метрик процесса: счетчики, измерители и гистограммы с необязательными метками.
+REGISTRY = {}
+_registry_lock = threading.Lock()
+
+
+class Counter:
+    """Монотонно растущий счетчик; значение можно вычислять функцией ``fn``."""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text, labelnames=(), fn=None):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        self._fn = fn
+
+    def _key(self, labels):
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        if self._fn is not None:
+            return self._fn()
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        if self._fn is not None:
+            return [((), self._fn())]
+        return list(self._values.items())
+
+
+class Gauge(Counter):
+    """Текущее значение; либо выставляется явно, либо вычисляется функцией ``fn``."""
+
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+# Границы корзин гистограмм задержек, с
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    """Распределение значений по корзинам (как histogram в Prometheus)."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # метки -> [счетчики по корзинам + "+Inf", сумма, количество]
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            data = self._values.get(key)
+            if data is None:
+                data = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            data[0][i] += 1
+            data[1] += value
+            data[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, **labels)
+
+    def count(self, **labels):
+        data = self._values.get(self._key(labels))
+        return data[2] if data else 0
+
+    def quantile(self, q, **labels):
+        """Оценка квантиля по корзинам: верхняя граница корзины, в которую он попадает."""
+        data = self._values.get(self._key(labels))
+        if not data or not data[2]:
+            return None
+        rank = q * data[2]
+        seen = 0
+        for bound, n in zip(self.buckets + (float('inf'),), data[0]):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def samples(self):
+        with self._lock:
+            return [(key, (list(counts), total, n)) for key, (counts, total, n) in self._values.items()]
+
+
+def _register(cls, name, help_text, **kwargs):
+    with _registry_lock:
+        metric = REGISTRY.get(name)
+        if metric is None:
+            metric = REGISTRY[name] = cls(name, help_text, **kwargs)
+        return metric
+
+
+def counter(name, help_text, labelnames=(), fn=None):
+    return _register(Counter, name, help_text, labelnames=labelnames, fn=fn)
+
+
+def gauge(name, help_text, labelnames=(), fn=None):
+    return _register(Gauge, name, help_text, labelnames=labelnames, fn=fn)
+
+
+def histogram(name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return _register(Histogram, name, help_text, labelnames=labelnames, buckets=buckets)
+
+
+def snapshot():
+    """Текущие значения всех метрик: {имя: {метки: значение}}."""
+    return {name: dict(metric.samples()) for name, metric in REGISTRY.items()}
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + [f'{n}="{v}"' for n, v in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render():
+    """Все метрики в текстовом формате Prometheus (text/plain; version=0.0.4)."""
+    lines = []
+    for name, metric in sorted(REGISTRY.items()):
+        lines.append(f"# HELP {name} {_escape(metric.help)}")
+        lines.append(f"# TYPE {name} {metric.kind}")
+        if metric.kind != "histogram":
+            for key, value in metric.samples():
+                lines.append(f"{name}{_labels(metric.labelnames, key)} {_number(value)}")
+            continue
+        for key, (counts, total, n) in metric.samples():
+            cumulative = 0
+            for bound, count in zip(metric.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = _labels(metric.labelnames, key, extra=(("le", _number(bound)),))
+                lines.append(f"{name}_bucket{le} {cumulative}")
+            lines.append(f"{name}_sum{_labels(metric.labelnames, key)} {_number(total)}")
+            lines.append(f"{name}_count{_labels(metric.labelnames, key)} {n}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,53 @@
+# migrations.py
+#
+# Версии схемы баз SQLite. Схема каждой базы описывается списком миграций —
+# функций ``fn(conn)``; номер последней примененной хранится в заголовке файла
+# (PRAGMA user_version). При запуске недостающие миграции применяются по
+# порядку в одной транзакции BEGIN IMMEDIATE, так что несколько процессов
+# (режим webhook) могут стартовать одновременно: первый обновит схему, остальные
+# увидят новую версию и ничего не сделают. Базы, созданные до появления версий,
+# имеют user_version = 0 и проходят все миграции, поэтому каждая миграция
+# должна работать и на уже существующих таблицах (IF NOT EXISTS, перенос данных).
+#
+# Новая миграция добавляется в конец списка; уже выпущенные не меняются.
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def schema_version(c):
+    return c.execute('PRAGMA user_version').fetchone()[0]
+
+
+def _apply(c, name, migrations):
+    version = schema_version(c)
+    if version > len(migrations):
+        raise RuntimeError(f"{name}: версия схемы {version} новее, чем знает эта версия бота ({len(migrations)})")
+    for number, migration in enumerate(migrations[version:], version + 1):
+        logger.info(f"{name}: миграция {number}: {(migration.__doc__ or migration.__name__).strip()}")
+        migration(c)
+    if version < len(migrations):
+        c.execute(f'PRAGMA user_version = {len(migrations)}')
+    return version, len(migrations)
+
+
+def migrate(db, migrations):
+    """Доводит схему базы ``db`` (storage.Database) до последней версии; возвращает (было, стало)."""
+    before, after = db.transaction_sync(_apply, db.name, migrations)
+    if before != after:
+        logger.info(f"{db.name}: схема обновлена с версии {before} до {after}")
+    return before, after
+
+
+def rebuild_table(c, table, create_sql, select_sql):
+    """Пересоздает ``table`` по ``create_sql`` (с именем ``<table>_new``), перенося строки запросом ``select_sql``.
+
+    SQLite не умеет добавлять первичный ключ или ограничение UNIQUE к
+    существующей таблице, поэтому таблица копируется. Индексы старой таблицы
+    удаляются вместе с ней — нужные надо создать заново после вызова.
+    """
+    c.execute(f'DROP TABLE IF EXISTS {table}_new')
+    c.execute(create_sql)
+    c.execute(f'INSERT INTO {table}_new {select_sql}')
+    c.execute(f'DROP TABLE {table}')
+    c.execute(f'ALTER TABLE {table}_new RENAME TO {table}')
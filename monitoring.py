@@ -0,0 +1,164 @@
+# monitoring.py
+#
+# Локальный HTTP-эндпоинт метрик и профилирование работающего бота.
+#
+#   curl http://127.0.0.1:9100/metrics                      # метрики в формате Prometheus
+#   curl "http://127.0.0.1:9100/debug/profile?seconds=10"   # cProfile цикла событий за 10 с
+#
+# PROFILE=1 профилирует весь запуск и при остановке пишет database/profile-<pid>-<время>.prof
+# (смотреть: python -m pstats <файл> или snakeviz).
+import asyncio
+import cProfile
+import io
+import logging
+import math
+import os
+import pstats
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Уровень логов всех процессов бота: bot.py, фронтальный процесс и обработчики webhook.py
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+# 0 — не запускать HTTP-эндпоинт метрик
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+PROFILE = os.getenv("PROFILE", "0") == "1"
+PROFILE_DIR = os.path.join(os.getcwd(), 'database')
+LOOP_LAG_INTERVAL = 0.5
+# Самое долгое профилирование по запросу /debug/profile, с
+PROFILE_MAX_SECONDS = 300.0
+
+loop_lag_seconds = metrics.histogram(
+    "event_loop_lag_seconds", "Опоздание пробуждения задачи в цикле событий, с",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5))
+
+
+def setup_logging(level=LOG_LEVEL):
+    """Настраивает логи процесса. События отдельных сообщений пишутся на уровне DEBUG,
+    на INFO остаются запуск, остановка и редкие события."""
+    logging.basicConfig(format=LOG_FORMAT, level=level)
+    if level != "DEBUG":
+        # httpx и openai пишут строку INFO на каждый запрос к Bot API и OpenAI
+        logging.getLogger("httpx").setLevel(logging.WARNING)
+        logging.getLogger("openai").setLevel(logging.WARNING)
+
+
+class LoopLagMonitor:
+    """Раз в ``interval`` секунд замеряет, насколько позже запланированного просыпается задача."""
+
+    def __init__(self, interval=LOOP_LAG_INTERVAL):
+        self.interval = interval
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            t0 = loop.time()
+            await asyncio.sleep(self.interval)
+            loop_lag_seconds.observe(max(0.0, loop.time() - t0 - self.interval))
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+
+def format_stats(profile, sort="cumulative", limit=40):
+    out = io.StringIO()
+    pstats.Stats(profile, stream=out).strip_dirs().sort_stats(sort).print_stats(limit)
+    return out.getvalue()
+
+
+class Monitoring:
+    """Эндпоинт /metrics, замер задержки цикла событий и профилировщик одного процесса."""
+
+    def __init__(self, host=METRICS_LISTEN, port=METRICS_PORT, profile=PROFILE):
+        self.host = host
+        self.port = port
+        self.profile = profile
+        self.lag = LoopLagMonitor()
+        self._runner = None
+        self._profiler = None
+        self._profiling = asyncio.Lock()
+
+    async def _metrics(self, request):
+        from aiohttp import web
+
+        return web.Response(body=metrics.render().encode("utf-8"),
+                            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    async def _profile(self, request):
+        from aiohttp import web
+
+        # cProfile работает в потоке, который его включил, — здесь это поток цикла событий с обработчиками
+        if self._profiler is not None or self._profiling.locked():
+            return web.Response(status=409, text="профилирование уже идет\n")
+        sort = request.query.get("sort", "cumulative")
+        try:
+            seconds = float(request.query.get("seconds", "10"))
+            limit = int(request.query.get("limit", "40"))
+        except ValueError:
+            return web.Response(status=400, text="seconds и limit должны быть числами\n")
+        if not math.isfinite(seconds) or sort not in pstats.Stats.sort_arg_dict_default:
+            return web.Response(status=400, text="некорректные seconds или sort\n")
+        seconds = min(max(seconds, 0.0), PROFILE_MAX_SECONDS)
+        async with self._profiling:
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                profile.disable()
+        text = format_stats(profile, sort, max(limit, 1))
+        return web.Response(text=text)
+
+    async def start(self):
+        self.lag.start()
+        if self.profile:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+            logger.info("Профилирование запущено, результат будет записан при остановке")
+        if not self.port:
+            return
+        # aiohttp (~0,2 с импорта) загружается только вместе с эндпоинтом, а не при импорте модуля
+        from aiohttp import web
+
+        app = web.Application()
+        app.router.add_get("/metrics", self._metrics)
+        app.router.add_get("/debug/profile", self._profile)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        try:
+            await web.TCPSite(self._runner, self.host, self.port).start()
+        except OSError as e:
+            logger.error(f"Не удалось открыть эндпоинт метрик {self.host}:{self.port}: {e}")
+            await self._runner.cleanup()
+            self._runner = None
+            return
+        logger.info(f"Метрики доступны на http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        await self.lag.stop()
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        if self._profiler is not None:
+            self._profiler.disable()
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            path = os.path.join(PROFILE_DIR, f"profile-{os.getpid()}-{int(time.time())}.prof")
+            self._profiler.dump_stats(path)
+            self._profiler = None
+            logger.info(f"Профиль записан в {path}")
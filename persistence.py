@@ -0,0 +1,200 @@
+# persistence.py
+import asyncio
+import json
+import logging
+import os
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from storage import get_database
+
+logger = logging.getLogger(__name__)
+
+STATE_DB_PATH = os.path.join(os.getcwd(), 'database', 'state.db')
+PERSISTENCE_UPDATE_INTERVAL = float(os.getenv("PERSISTENCE_UPDATE_INTERVAL", "15"))
+
+# Ключи user_data, описывающие текущую викторину
+QUIZ_KEYS = ('quiz_questions', 'quiz_index', 'quiz_score', 'quiz_answers')
+
+
+def _create_tables(c):
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS user_data (
+      user_id INTEGER PRIMARY KEY,
+      data TEXT NOT NULL
+    )
+    ''')
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS conversations (
+      name TEXT NOT NULL,
+      key TEXT NOT NULL,
+      state INTEGER,
+      PRIMARY KEY (name, key)
+    ) WITHOUT ROWID
+    ''')
+
+
+def _write_batch(c, users, conversations):
+    upserts = [(user_id, data) for user_id, data in users.items() if data is not None]
+    deletes = [(user_id,) for user_id, data in users.items() if data is None]
+    if upserts:
+        c.executemany('INSERT INTO user_data (user_id, data) VALUES (?,?) '
+                      'ON CONFLICT(user_id) DO UPDATE SET data=excluded.data', upserts)
+    if deletes:
+        c.executemany('DELETE FROM user_data WHERE user_id=?', deletes)
+    ends = [(name, key) for (name, key), state in conversations.items() if state is None]
+    states = [(name, key, state) for (name, key), state in conversations.items() if state is not None]
+    if states:
+        c.executemany('INSERT INTO conversations (name, key, state) VALUES (?,?,?) '
+                      'ON CONFLICT(name, key) DO UPDATE SET state=excluded.state', states)
+    if ends:
+        c.executemany('DELETE FROM conversations WHERE name=? AND key=?', ends)
+
+
+class SQLitePersistence(BasePersistence):
+    """Хранение user_data и состояний ConversationHandler в SQLite.
+
+    Application передает изменения раз в ``update_interval`` секунд; здесь они
+    только сериализуются в память и затем записываются одной транзакцией,
+    так что ответы на вопросы викторины не порождают отдельных записей на диск.
+    Вопросы текущей викторины сохраняются как список их id, а не копии
+    вопросов; при загрузке id сопоставляются с каталогом через ``resolve_question``.
+
+    ``shard`` — пара (номер, всего) для процессов режима webhook: процесс
+    загружает только своих пользователей (id % всего == номер) и пишет
+    только тех, чьи обновления обрабатывал, поэтому несколько процессов
+    делят одну базу без конфликтов по строкам.
+    """
+
+    def __init__(self, resolve_question, path=STATE_DB_PATH, update_interval=PERSISTENCE_UPDATE_INTERVAL,
+                 shard=None):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.resolve_question = resolve_question
+        self.shard = shard
+        self.db = get_database(path)
+        self.db.transaction_sync(_create_tables)
+        self._pending_users = {}
+        self._pending_conversations = {}
+        self._write_task = None
+
+    def _owns(self, chat_id):
+        return self.shard is None or chat_id % self.shard[1] == self.shard[0]
+
+    # Сериализация user_data
+
+    @staticmethod
+    def encode_user_data(data):
+        data = dict(data)
+        questions = data.pop('quiz_questions', None)
+        if questions is not None:
+            data['quiz_question_ids'] = [q.qid for q in questions]
+        return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+
+    def decode_user_data(self, raw):
+        data = json.loads(raw)
+        qids = data.pop('quiz_question_ids', None)
+        if qids is not None:
+            questions = tuple(self.resolve_question(qid) for qid in qids)
+            if all(questions):
+                data['quiz_questions'] = questions
+            else:
+                # Вопросы удалены из content.json — незавершенную викторину не восстанавливаем
+                for key in QUIZ_KEYS:
+                    data.pop(key, None)
+        return data
+
+    # Чтение при старте
+
+    async def get_user_data(self):
+        rows = await self.db.fetchall('SELECT user_id, data FROM user_data')
+        user_data = {}
+        for user_id, raw in rows:
+            if not self._owns(user_id):
+                continue
+            try:
+                user_data[user_id] = self.decode_user_data(raw)
+            except ValueError as e:
+                logger.error(f"Поврежденные данные пользователя {user_id} в хранилище состояний: {e}")
+        logger.info(f"Восстановлены данные {len(user_data)} пользователей")
+        return user_data
+
+    async def get_conversations(self, name):
+        rows = await self.db.fetchall('SELECT key, state FROM conversations WHERE name=?', (name,))
+        conversations = {}
+        for key, state in rows:
+            key = tuple(json.loads(key))
+            # Ключ диалога начинается с id чата — по нему процессы и делят обновления
+            if not key or self._owns(key[0]):
+                conversations[key] = state
+        return conversations
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    # Изменения копятся в памяти и пишутся одной транзакцией
+
+    def _schedule_write(self):
+        if self._write_task is None or self._write_task.done():
+            self._write_task = asyncio.get_running_loop().create_task(self._write_pending())
+
+    async def _write_pending(self):
+        # Даем Application передать все изменения текущего прохода, затем пишем их разом
+        await asyncio.sleep(0)
+        while self._pending_users or self._pending_conversations:
+            users, self._pending_users = self._pending_users, {}
+            conversations, self._pending_conversations = self._pending_conversations, {}
+            try:
+                await self.db.transaction(_write_batch, users, conversations)
+            except Exception as e:
+                logger.error(f"Ошибка при сохранении состояний пользователей: {e}")
+                # Не теряем изменения: более свежие значения важнее возвращаемых
+                self._pending_users = {**users, **self._pending_users}
+                self._pending_conversations = {**conversations, **self._pending_conversations}
+                return
+
+    async def update_user_data(self, user_id, data):
+        self._pending_users[user_id] = self.encode_user_data(data)
+        self._schedule_write()
+
+    async def drop_user_data(self, user_id):
+        self._pending_users[user_id] = None
+        self._schedule_write()
+
+    async def update_conversation(self, name, key, new_state):
+        self._pending_conversations[(name, json.dumps(key))] = new_state
+        self._schedule_write()
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        if self._write_task is not None:
+            await self._write_task
+        await self._write_pending()
@@ -1,14 +1,17 @@
 # progress_db_setup.py
-import sqlite3
 import os
 
+from migrations import migrate, rebuild_table
+from storage import get_database
+
 PROGRESS_DB_PATH = os.path.join(os.getcwd(), 'database', 'progress.db')
 
-def setup_progress_db():
-    os.makedirs(os.path.dirname(PROGRESS_DB_PATH), exist_ok=True)
-    conn = sqlite3.connect(PROGRESS_DB_PATH)
-    c = conn.cursor()
+# Общий пул соединений к progress.db
+progress_db = get_database(PROGRESS_DB_PATH)
 
+
+def _create_tables(c):
+    """Пользователи, прогресс и награды"""
     c.execute('''
     CREATE TABLE IF NOT EXISTS users (
       user_id INTEGER PRIMARY KEY,
@@ -37,5 +40,101 @@ def setup_progress_db():
     )
     ''')
 
-    conn.commit()
-    conn.close()
+
+def _add_quiz_analytics(c):
+    """Ответы на вопросы викторин и агрегаты по ним"""
+    # Агрегаты обновляются в finish_quiz (см. analytics.py)
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS quiz_answers (
+      user_id INTEGER NOT NULL,
+      question_id TEXT NOT NULL,
+      answer INTEGER NOT NULL,
+      correct INTEGER NOT NULL,
+      answered_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_quiz_answers_user ON quiz_answers (user_id, answered_at)')
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS question_stats (
+      question_id TEXT PRIMARY KEY,
+      module_id TEXT NOT NULL,
+      lesson_id TEXT NOT NULL,
+      attempts INTEGER NOT NULL DEFAULT 0,
+      wrong INTEGER NOT NULL DEFAULT 0,
+      error_rate REAL NOT NULL DEFAULT 0
+    ) WITHOUT ROWID
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_question_stats_error_rate ON question_stats (error_rate DESC, attempts)')
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS module_stats (
+      module_id TEXT PRIMARY KEY,
+      quizzes INTEGER NOT NULL DEFAULT 0,
+      passed INTEGER NOT NULL DEFAULT 0,
+      score INTEGER NOT NULL DEFAULT 0,
+      questions INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_users_points ON users (points DESC)')
+
+
+def _add_keys(c):
+    """Первичные ключи progress и rewards, покрывающие индексы рейтинга и трудных вопросов"""
+    # Одна строка на урок пользователя: из дублей остается лучший результат
+    rebuild_table(c, 'progress', '''
+    CREATE TABLE progress_new (
+      user_id INTEGER NOT NULL,
+      module_id TEXT NOT NULL,
+      lesson_id TEXT NOT NULL,
+      completed INTEGER NOT NULL DEFAULT 0,
+      PRIMARY KEY (user_id, module_id, lesson_id),
+      FOREIGN KEY (user_id) REFERENCES users(user_id)
+    ) WITHOUT ROWID
+    ''', '''
+    SELECT user_id, module_id, lesson_id, MAX(COALESCE(completed, 0)) FROM progress
+    WHERE user_id IS NOT NULL AND module_id IS NOT NULL AND lesson_id IS NOT NULL
+    GROUP BY user_id, module_id, lesson_id
+    ''')
+    rebuild_table(c, 'rewards', '''
+    CREATE TABLE rewards_new (
+      user_id INTEGER NOT NULL,
+      badge TEXT NOT NULL,
+      PRIMARY KEY (user_id, badge),
+      FOREIGN KEY (user_id) REFERENCES users(user_id)
+    ) WITHOUT ROWID
+    ''', 'SELECT DISTINCT user_id, badge FROM rewards WHERE user_id IS NOT NULL AND badge IS NOT NULL')
+    # Рейтинг (user_id, name, points) и список трудных вопросов читаются из индекса, без обращения к таблице
+    c.execute('DROP INDEX IF EXISTS idx_users_points')
+    c.execute('CREATE INDEX idx_users_points ON users (points DESC, name)')
+    c.execute('DROP INDEX IF EXISTS idx_question_stats_error_rate')
+    c.execute('CREATE INDEX idx_question_stats_error_rate ON question_stats (error_rate DESC, attempts, wrong)')
+
+
+def _add_question_state(c):
+    """Состояние интервального повторения по каждому вопросу пользователя"""
+    # box — ступень повторения, due — срок следующего повторения (unix-время), см. spaced_repetition.py
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS question_state (
+      user_id INTEGER NOT NULL,
+      question_id TEXT NOT NULL,
+      box INTEGER NOT NULL,
+      due INTEGER NOT NULL,
+      lapses INTEGER NOT NULL,
+      attempts INTEGER NOT NULL,
+      PRIMARY KEY (user_id, question_id)
+    ) WITHOUT ROWID
+    ''')
+    # Из уже записанных ответов: верные минус неверные дают ступень, все вопросы сразу ждут повторения
+    c.execute('''
+    INSERT OR IGNORE INTO question_state (user_id, question_id, box, due, lapses, attempts)
+    SELECT user_id, question_id, MAX(0, MIN(6, SUM(correct) - SUM(1 - correct))),
+           CAST(strftime('%s', MAX(answered_at)) AS INTEGER), SUM(1 - correct), COUNT(*)
+    FROM quiz_answers GROUP BY user_id, question_id
+    ''')
+
+
+# Схема progress.db по версиям (см. migrations.py); новые миграции — только в конец списка
+MIGRATIONS = [_create_tables, _add_quiz_analytics, _add_keys, _add_question_state]
+
+
+def setup_progress_db():
+    migrate(progress_db, MIGRATIONS)
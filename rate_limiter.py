@@ -0,0 +1,157 @@
+# rate_limiter.py
+import asyncio
+import logging
+import os
+import random
+import time
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+TG_RATE_LIMIT = os.getenv("TG_RATE_LIMIT", "1") == "1"
+# Telegram допускает около 30 сообщений в секунду на бота, около 1 в секунду в личном чате и 20 в минуту в группе.
+# За любую секунду корзина пропускает не больше burst + rate запросов, поэтому их сумма держится ниже лимита
+TG_GLOBAL_RATE = float(os.getenv("TG_GLOBAL_RATE", "25"))
+TG_GLOBAL_BURST = int(os.getenv("TG_GLOBAL_BURST", "5"))
+TG_CHAT_RATE = float(os.getenv("TG_CHAT_RATE", "1"))
+TG_CHAT_BURST = int(os.getenv("TG_CHAT_BURST", "2"))
+TG_GROUP_RATE = float(os.getenv("TG_GROUP_RATE", str(20 / 60)))
+TG_GROUP_BURST = int(os.getenv("TG_GROUP_BURST", "5"))
+TG_MAX_RETRIES = int(os.getenv("TG_MAX_RETRIES", "3"))
+# Верхняя граница случайной добавки к паузе RetryAfter, с; удваивается с каждой попыткой
+TG_RETRY_JITTER = float(os.getenv("TG_RETRY_JITTER", "0.5"))
+# Корзины чатов, которые давно полны, удаляются, когда их больше этого числа
+MAX_CHAT_BUCKETS = 4096
+
+wait_seconds = metrics.histogram(
+    "telegram_send_wait_seconds", "Ожидание отправки запроса к Bot API в ограничителе частоты, с",
+    labelnames=("bucket",), buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0))
+requests_total = metrics.counter(
+    "telegram_requests_total", "Запросы к Bot API", labelnames=("method", "result"))
+retry_after_total = metrics.counter(
+    "telegram_retry_after_total", "Ответы 429 (RetryAfter) от Bot API", labelnames=("method",))
+
+
+class TokenBucket:
+    """Корзина токенов: ``rate`` запросов в секунду, до ``burst`` подряд.
+
+    ``reserve`` сразу списывает токен и возвращает, сколько ждать до его
+    появления; баланс может уйти в минус, поэтому ожидающие получают токены
+    в порядке очереди без повторных проверок.
+    """
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self):
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens -= 1
+        return max(0.0, -self.tokens / self.rate)
+
+    def pause(self, seconds):
+        """Следующий токен появится не раньше чем через ``seconds`` секунд."""
+        self._refill(time.monotonic())
+        self.tokens = min(self.tokens, 1 - seconds * self.rate)
+
+    def idle(self):
+        self._refill(time.monotonic())
+        return self.tokens >= self.burst
+
+
+class TelegramRateLimiter(BaseRateLimiter):
+    """Ограничение частоты исходящих запросов к Bot API.
+
+    Запрос с ``chat_id`` ждет токен сначала в корзине своего чата (для групп —
+    со своими лимитами), затем в общей корзине бота. Ответ 429 (RetryAfter)
+    приостанавливает корзину чата, а для запросов без чата — общую, и запрос
+    повторяется после указанной паузы со случайной добавкой, чтобы повторы
+    разных чатов не приходили одновременно.
+    """
+
+    def __init__(self, global_rate=TG_GLOBAL_RATE, global_burst=TG_GLOBAL_BURST, chat_rate=TG_CHAT_RATE,
+                 chat_burst=TG_CHAT_BURST, group_rate=TG_GROUP_RATE, group_burst=TG_GROUP_BURST,
+                 max_retries=TG_MAX_RETRIES, jitter=TG_RETRY_JITTER):
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.chat_limits = (chat_rate, chat_burst)
+        self.group_limits = (group_rate, group_burst)
+        self.max_retries = max_retries
+        self.jitter = jitter
+        self._chats = {}
+        self.waiting = 0
+        self.stats = {"requests": 0, "retries": 0, "wait_seconds": 0.0, "wait_max": 0.0}
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= MAX_CHAT_BUCKETS:
+                self._chats = {key: b for key, b in self._chats.items() if not b.idle()}
+            rate, burst = self.group_limits if chat_id < 0 else self.chat_limits
+            bucket = self._chats[chat_id] = TokenBucket(rate, burst)
+        return bucket
+
+    async def _acquire(self, bucket, name):
+        delay = bucket.reserve()
+        wait_seconds.observe(delay, bucket=name)
+        if delay:
+            await asyncio.sleep(delay)
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        max_retries = self.max_retries if rate_limit_args is None else rate_limit_args
+        chat_id = data.get("chat_id")
+        if isinstance(chat_id, str) and chat_id.lstrip("-").isdigit():
+            chat_id = int(chat_id)
+        # У @username канала нет своей корзины, у запросов без чата (answerCallbackQuery, getMe) — никакой
+        chat = self._chat_bucket(chat_id) if isinstance(chat_id, int) else None
+
+        for attempt in range(max_retries + 1):
+            t0 = time.perf_counter()
+            self.waiting += 1
+            try:
+                if chat is not None:
+                    await self._acquire(chat, "chat")
+                if chat_id is not None:
+                    await self._acquire(self.global_bucket, "global")
+            finally:
+                self.waiting -= 1
+            waited = time.perf_counter() - t0
+            self.stats["requests"] += 1
+            self.stats["wait_seconds"] += waited
+            self.stats["wait_max"] = max(self.stats["wait_max"], waited)
+            try:
+                result = await callback(*args, **kwargs)
+            except RetryAfter as e:
+                retry_after_total.inc(method=endpoint)
+                if attempt == max_retries:
+                    requests_total.inc(method=endpoint, result="retry_after")
+                    logger.warning(f"Bot API {endpoint}: лимит частоты, повторы исчерпаны ({max_retries})")
+                    raise
+                self.stats["retries"] += 1
+                pause = e.retry_after + random.uniform(0, self.jitter * 2 ** attempt)
+                (chat or self.global_bucket).pause(pause)
+                logger.info(f"Bot API {endpoint}: лимит частоты, повтор через {pause:.1f} с")
+                continue
+            except Exception:
+                requests_total.inc(method=endpoint, result="error")
+                raise
+            requests_total.inc(method=endpoint, result="ok")
+            return result
@@ -0,0 +1,253 @@
+# response_cache.py
+import asyncio
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "1") == "1"
+RESPONSE_CACHE_THRESHOLD = float(os.getenv("RESPONSE_CACHE_THRESHOLD", "0.92"))
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "5000"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", str(7 * 24 * 3600)))
+RESPONSE_CACHE_SAVE_INTERVAL = float(os.getenv("RESPONSE_CACHE_SAVE_INTERVAL", "300"))
+RESPONSE_CACHE_PATH = os.path.join(os.getcwd(), 'database', 'response_cache')
+# После ошибки модели эмбеддингов (например, ее не удалось скачать) кэш столько секунд ищет только точные совпадения
+EMBED_RETRY_DELAY = 300
+
+lookups_total = metrics.counter("llm_cache_lookups_total", "Обращения к кэшу ответов", labelnames=("result",))
+
+_PUNCT_RE = re.compile(r"[^\w\s]+", re.UNICODE)
+_SPACE_RE = re.compile(r"\s+")
+
+
+def normalize_question(text):
+    """Приводит вопрос к виду для точного сравнения: регистр, ё, пунктуация, пробелы."""
+    text = text.lower().replace('ё', 'е')
+    text = _PUNCT_RE.sub(' ', text)
+    return _SPACE_RE.sub(' ', text).strip()
+
+
+class _Entry:
+    __slots__ = ("id", "key", "answer", "created")
+
+    def __init__(self, entry_id, key, answer, created):
+        self.id = entry_id
+        self.key = key
+        self.answer = answer
+        self.created = created
+
+
+class ResponseCache:
+    """Кэш ответов OpenAI на повторяющиеся вопросы.
+
+    Сначала ищется точное совпадение нормализованного текста, затем — если
+    задана модель эмбеддингов — ближайший сохраненный вопрос в индексе FAISS
+    (скалярное произведение нормированных векторов) с порогом ``threshold``.
+    Записи вытесняются по LRU сверх ``max_entries`` и по истечении ``ttl``.
+    Вычисление эмбеддингов и поиск выполняются в пуле потоков (``aget``/``aput``).
+    До окончания ``start`` (загрузки с диска) кэш не отвечает и не запоминает ответы,
+    иначе записи с диска перезаписали бы более свежие.
+    """
+
+    def __init__(self, embedder=None, threshold=RESPONSE_CACHE_THRESHOLD, max_entries=RESPONSE_CACHE_SIZE,
+                 ttl=RESPONSE_CACHE_TTL, path=RESPONSE_CACHE_PATH, save_interval=RESPONSE_CACHE_SAVE_INTERVAL):
+        self.embedder = embedder
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.save_interval = save_interval
+        self._entries = OrderedDict()  # нормализованный вопрос -> _Entry, в порядке использования
+        self._by_id = {}
+        self._vectors = {}  # id -> вектор вопроса (для сохранения на диск)
+        self._next_id = 0
+        self._index = None
+        self._embed_retry_at = 0.0
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._task = None
+        self.loaded = False
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _ensure_index(self, dim):
+        if self._index is None:
+            import faiss
+
+            self._index = faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
+        return self._index
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        del self._by_id[entry.id]
+        if self._vectors.pop(entry.id, None) is not None:
+            import numpy as np
+
+            self._index.remove_ids(np.array([entry.id], dtype='int64'))
+        self._dirty = True
+
+    def _expired(self, entry, now):
+        return self.ttl and now - entry.created > self.ttl
+
+    def _embed(self, key):
+        """Вектор вопроса или None, если модели нет или она сейчас недоступна."""
+        if self.embedder is None or time.monotonic() < self._embed_retry_at:
+            return None
+        try:
+            return self.embedder.embed([key])
+        except Exception as e:
+            self._embed_retry_at = time.monotonic() + EMBED_RETRY_DELAY
+            logger.warning(f"Модель эмбеддингов недоступна, кэш ответов ищет только точные совпадения: {e}")
+            return None
+
+    def _attach(self, entry, vector):
+        import numpy as np
+
+        self._ensure_index(vector.shape[1]).add_with_ids(vector, np.array([entry.id], dtype='int64'))
+        self._vectors[entry.id] = vector[0]
+
+    def get(self, text):
+        if not self.loaded:
+            lookups_total.inc(result="loading")
+            return None
+        key = normalize_question(text)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if self._expired(entry, now):
+                    self._remove(key)
+                else:
+                    self._entries.move_to_end(key)
+                    lookups_total.inc(result="exact")
+                    return entry.answer
+        vector = self._embed(key) if key else None
+        with self._lock:
+            if vector is not None and self._index is not None and self._index.ntotal:
+                scores, ids = self._index.search(vector, 1)
+                if ids[0][0] >= 0 and scores[0][0] >= self.threshold:
+                    entry = self._by_id.get(int(ids[0][0]))
+                    if entry is not None and not self._expired(entry, now):
+                        self._entries.move_to_end(entry.key)
+                        lookups_total.inc(result="semantic")
+                        return entry.answer
+        lookups_total.inc(result="miss")
+        return None
+
+    def put(self, text, answer):
+        key = normalize_question(text)
+        if not key or not self.loaded:
+            return
+        # Точное совпадение сохраняется в любом случае, вектор для поиска похожих — если модель доступна
+        entry = self._insert(key, answer, time.time(), None)
+        vector = self._embed(key)
+        if vector is not None:
+            with self._lock:
+                # Пока считался вектор, запись могли заменить или вытеснить
+                if self._by_id.get(entry.id) is entry:
+                    self._attach(entry, vector)
+
+    def _insert(self, key, answer, created, vector):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            entry = _Entry(self._next_id, key, answer, created)
+            self._next_id += 1
+            self._entries[key] = entry
+            self._by_id[entry.id] = entry
+            if vector is not None:
+                self._attach(entry, vector)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+            self._dirty = True
+            return entry
+
+    async def aget(self, text):
+        return await asyncio.get_running_loop().run_in_executor(None, self.get, text)
+
+    async def aput(self, text, answer):
+        await asyncio.get_running_loop().run_in_executor(None, self.put, text, answer)
+
+    # Сохранение на диск: <path>.json — вопросы и ответы, <path>.npy — векторы в том же порядке
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            items = [(key, e.answer, e.created, self._vectors.get(e.id)) for key, e in self._entries.items()]
+            self._dirty = False
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        has_vectors = bool(items) and all(v is not None for *_, v in items)
+        with open(self.path + '.json.tmp', 'w', encoding='utf-8') as f:
+            json.dump({"vectors": has_vectors,
+                       "entries": [[key, answer, created] for key, answer, created, _ in items]},
+                      f, ensure_ascii=False)
+        if has_vectors:
+            import numpy as np
+
+            with open(self.path + '.npy.tmp', 'wb') as f:
+                np.save(f, np.stack([v for *_, v in items]))
+            os.replace(self.path + '.npy.tmp', self.path + '.npy')
+        os.replace(self.path + '.json.tmp', self.path + '.json')
+        logger.info(f"Кэш ответов сохранен: {len(items)} записей")
+
+    def load(self):
+        try:
+            with open(self.path + '.json', 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        vectors = None
+        if data.get("vectors") and self.embedder is not None:
+            import numpy as np
+
+            vectors = np.load(self.path + '.npy')
+            if len(vectors) != len(data["entries"]):
+                logger.warning("Векторы кэша ответов не совпадают с записями, пересчитываем")
+                vectors = None
+        now = time.time()
+        for i, (key, answer, created) in enumerate(data["entries"]):
+            if self.ttl and now - created > self.ttl:
+                continue
+            vector = vectors[i:i + 1] if vectors is not None else self._embed(key)
+            self._insert(key, answer, created, vector)
+        self._dirty = False
+        logger.info(f"Кэш ответов загружен: {len(self._entries)} записей")
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.save_interval)
+            try:
+                await loop.run_in_executor(None, self.save)
+            except Exception as e:
+                logger.error(f"Ошибка при сохранении кэша ответов: {e}")
+
+    async def start(self):
+        """Загружает кэш с диска и запускает периодическое сохранение."""
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self.load)
+        except Exception as e:
+            logger.error(f"Ошибка при загрузке кэша ответов: {e}")
+        self.loaded = True
+        if self.save_interval > 0 and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await asyncio.get_running_loop().run_in_executor(None, self.save)
+
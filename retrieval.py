@@ -0,0 +1,222 @@
+# retrieval.py
+#
+# Поиск фрагментов курса для ответов OpenAI (RAG).
+#
+# Индекс строится заранее и пересобирается инкрементально — эмбеддинги
+# считаются только для уроков и документов, текст которых изменился:
+#
+#   python retrieval.py build
+#
+# При старте бот только открывает готовый индекс FAISS через mmap.
+import argparse
+import asyncio
+import glob
+import hashlib
+import json
+import logging
+import os
+
+from embeddings import EMBEDDER, get_embedder
+
+logger = logging.getLogger(__name__)
+
+RAG_ENABLED = os.getenv("RAG_ENABLED", "1") == "1"
+RAG_TOP_K = int(os.getenv("RAG_TOP_K", "3"))
+RAG_MIN_SCORE = float(os.getenv("RAG_MIN_SCORE", "0.3"))
+RAG_INDEX_PATH = os.path.join(os.getcwd(), 'database', 'rag_index')
+COURSE_MATERIALS_DIR = os.getenv("COURSE_MATERIALS_DIR", os.path.join(os.getcwd(), 'materials'))
+DOCX_CHUNK_SIZE = 800
+
+
+def _passage_id(key):
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little') & (2 ** 63 - 1)
+
+
+def _hash_texts(texts):
+    h = hashlib.sha256()
+    for text in texts:
+        h.update(text.encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+def _chunks(text, size=DOCX_CHUNK_SIZE):
+    """Режет текст по абзацам на фрагменты не длиннее ``size`` символов."""
+    chunk = []
+    length = 0
+    for paragraph in (p.strip() for p in text.split('\n')):
+        if not paragraph:
+            continue
+        if chunk and length + len(paragraph) > size:
+            yield '\n'.join(chunk)
+            chunk, length = [], 0
+        chunk.append(paragraph)
+        length += len(paragraph)
+    if chunk:
+        yield '\n'.join(chunk)
+
+
+def collect_passages(catalog, materials_dir=COURSE_MATERIALS_DIR):
+    """Группы фрагментов для индекса: {группа: [(ключ, текст), ...]}.
+
+    Группа — единица переиндексации: урок (текст урока и пары вопрос/ответ)
+    или один .docx файл из ``materials_dir``.
+    """
+    groups = {}
+    for module in catalog.modules:
+        for lesson in module.lessons:
+            group = f"lesson:{module.id}/{lesson.id}"
+            passages = [(group, f"{module.title}. {lesson.title}\n{lesson.content}")]
+            for q in lesson.questions:
+                passages.append((f"q:{q.qid}", f"Вопрос: {q.text}\nОтвет: {q.correct_answer}"))
+            groups[group] = passages
+    for path in sorted(glob.glob(os.path.join(materials_dir, '*.docx'))):
+        import docx2txt
+
+        name = os.path.basename(path)
+        text = docx2txt.process(path)
+        groups[f"docx:{name}"] = [(f"docx:{name}#{i}", chunk) for i, chunk in enumerate(_chunks(text))]
+    return groups
+
+
+class RetrievalIndex:
+    """Индекс FAISS по фрагментам курса: ``<path>.faiss`` и метаданные ``<path>.json``."""
+
+    def __init__(self, embedder, path=RAG_INDEX_PATH, embedder_name=EMBEDDER):
+        self.embedder = embedder
+        self.embedder_name = embedder_name
+        self.path = path
+        self.index = None
+        self.passages = {}
+        self.groups = {}
+
+    def _read_meta(self):
+        try:
+            with open(self.path + '.json', 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            return None
+        if meta.get("embedder") != self.embedder_name:
+            logger.info(f"Индекс построен моделью {meta.get('embedder')}, нужна полная пересборка")
+            return None
+        return meta
+
+    def load(self, mmap=True):
+        """Открывает сохраненный индекс; False, если его нет или он от другой модели эмбеддингов."""
+        import faiss
+
+        meta = self._read_meta()
+        if meta is None or not os.path.exists(self.path + '.faiss'):
+            return False
+        flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY if mmap else 0
+        index = faiss.read_index(self.path + '.faiss', flags)
+        self.passages = {int(k): v for k, v in meta["passages"].items()}
+        self.groups = meta["groups"]
+        # Индекс подставляется последним: при фоновой загрузке (LAZY_STARTUP) поиск уже может идти
+        self.index = index
+        return True
+
+    def build(self, catalog, materials_dir=COURSE_MATERIALS_DIR):
+        """Обновляет индекс; эмбеддинги считаются только для новых и измененных групп."""
+        import faiss
+        import numpy as np
+
+        groups = collect_passages(catalog, materials_dir)
+        if not self.load(mmap=False):
+            self.index, self.passages, self.groups = None, {}, {}
+
+        stale_ids = []
+        for group in set(self.groups) - set(groups):
+            stale_ids.extend(self.groups.pop(group)["ids"])
+        to_embed = []
+        for group, passages in groups.items():
+            digest = _hash_texts(text for _, text in passages)
+            old = self.groups.get(group)
+            if old is not None and old["hash"] == digest:
+                continue
+            if old is not None:
+                stale_ids.extend(old["ids"])
+            ids = [_passage_id(key) for key, _ in passages]
+            self.groups[group] = {"hash": digest, "ids": ids}
+            to_embed.extend(zip(ids, (text for _, text in passages)))
+
+        if self.index is not None and stale_ids:
+            self.index.remove_ids(np.array(stale_ids, dtype='int64'))
+        for pid in stale_ids:
+            self.passages.pop(pid, None)
+        if to_embed:
+            vectors = self.embedder.embed([text for _, text in to_embed])
+            if self.index is None:
+                self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(vectors.shape[1]))
+            self.index.add_with_ids(vectors, np.array([pid for pid, _ in to_embed], dtype='int64'))
+            self.passages.update(to_embed)
+
+        self.save()
+        logger.info(f"Индекс RAG: групп {len(self.groups)}, фрагментов {len(self.passages)}, "
+                    f"заново посчитано {len(to_embed)}, удалено {len(stale_ids)}")
+        return len(to_embed), len(stale_ids)
+
+    def save(self):
+        import faiss
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        if self.index is not None:
+            faiss.write_index(self.index, self.path + '.faiss.tmp')
+            os.replace(self.path + '.faiss.tmp', self.path + '.faiss')
+        with open(self.path + '.json.tmp', 'w', encoding='utf-8') as f:
+            json.dump({"embedder": self.embedder_name, "groups": self.groups,
+                       "passages": {str(k): v for k, v in self.passages.items()}}, f, ensure_ascii=False)
+        os.replace(self.path + '.json.tmp', self.path + '.json')
+
+    def search(self, query, k=RAG_TOP_K, min_score=RAG_MIN_SCORE):
+        """Возвращает до ``k`` фрагментов [(текст, близость)] в порядке убывания близости."""
+        if self.index is None or not self.index.ntotal:
+            return []
+        # Вопросы СД1 и СД2 часто совпадают дословно: берем с запасом и убираем повторы
+        scores, ids = self.index.search(self.embedder.embed([query]), k * 2)
+        found = []
+        seen = set()
+        for score, pid in zip(scores[0], ids[0]):
+            text = self.passages.get(int(pid)) if pid >= 0 else None
+            if text is None or score < min_score or text in seen:
+                continue
+            seen.add(text)
+            found.append((text, float(score)))
+            if len(found) == k:
+                break
+        return found
+
+    async def asearch(self, query, k=RAG_TOP_K, min_score=RAG_MIN_SCORE):
+        return await asyncio.get_running_loop().run_in_executor(None, self.search, query, k, min_score)
+
+
+def format_context(passages):
+    """Системное сообщение с найденными фрагментами курса для запроса к OpenAI."""
+    numbered = "\n\n".join(f"[{i + 1}] {text}" for i, (text, _) in enumerate(passages))
+    return ("Материалы курса школы диабета, относящиеся к вопросу. "
+            "Опирайся на них в ответе; если их недостаточно, отвечай по своим знаниям.\n\n" + numbered)
+
+
+def main():
+    from content_catalog import build_catalog
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Индекс фрагментов курса для RAG")
+    parser.add_argument("command", choices=["build", "search"])
+    parser.add_argument("query", nargs="?", default="")
+    parser.add_argument("--content", default="content.json")
+    parser.add_argument("--materials", default=COURSE_MATERIALS_DIR, help="папка с .docx материалами курса")
+    args = parser.parse_args()
+
+    index = RetrievalIndex(get_embedder())
+    if args.command == "build":
+        index.build(build_catalog(args.content), args.materials)
+    else:
+        if not index.load():
+            parser.error("индекс не найден, сначала выполните: python retrieval.py build")
+        for text, score in index.search(args.query):
+            print(f"{score:.3f}  {text[:200]}\n")
+
+
+if __name__ == "__main__":
+    main()
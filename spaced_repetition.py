@@ -0,0 +1,176 @@
+# spaced_repetition.py
+import heapq
+import logging
+import os
+import time
+
+import metrics
+from user_cache import UserCache
+
+logger = logging.getLogger(__name__)
+
+SR_ENABLED = os.getenv("SR_ENABLED", "1") == "1"
+# Вопросов в одной викторине (вопросы урока плюс повторение пройденного)
+SR_QUIZ_SIZE = int(os.getenv("SR_QUIZ_SIZE", "5"))
+SR_MAX_USERS = int(os.getenv("SR_MAX_USERS", "10000"))
+# Через сколько секунд вернуть вопрос, на который ответили неверно
+SR_RELEARN_DELAY = float(os.getenv("SR_RELEARN_DELAY", str(10 * 60)))
+# Интервалы повторения по ступеням (ступень растет с каждым верным ответом подряд), дни
+INTERVAL_DAYS = (0, 1, 3, 7, 16, 35, 90)
+MAX_BOX = len(INTERVAL_DAYS) - 1
+DAY = 86400
+
+questions_served = metrics.counter(
+    "quiz_questions_served_total", "Вопросов, выданных в викторинах", labelnames=("kind",))
+
+
+def review_slots(knowledge_level, size=SR_QUIZ_SIZE):
+    """Сколько мест в викторине отдать повторению: чем ниже самооценка знаний, тем больше."""
+    return max(1, (size * (6 - knowledge_level) + 5) // 10)
+
+
+def interval_factor(knowledge_level):
+    """Множитель интервалов: уровень 3 — как есть, 1 — вдвое чаще, 5 — в полтора раза реже."""
+    return 1 + (knowledge_level - 3) * 0.25
+
+
+def next_state(state, correct, knowledge_level, now):
+    """Новое состояние (ступень, срок, ошибок, попыток) вопроса после ответа."""
+    box, _, lapses, attempts = state or (0, 0, 0, 0)
+    if not correct:
+        return 0, int(now + SR_RELEARN_DELAY), lapses + 1, attempts + 1
+    box = min(box + 1, MAX_BOX)
+    # Каждая прошлая ошибка сокращает интервал: такие вопросы возвращаются раньше
+    interval = INTERVAL_DAYS[box] * DAY * interval_factor(knowledge_level) / (1 + 0.5 * min(lapses, 6))
+    return box, int(now + interval), lapses, attempts + 1
+
+
+class _Deck:
+    """Состояния вопросов одного пользователя и куча (срок, -ошибок, id) по ним.
+
+    Запись в куче устаревает, когда состояние вопроса меняется; такие записи
+    пропускаются при извлечении и удаляются при перестройке кучи.
+    """
+
+    __slots__ = ("states", "heap")
+
+    def __init__(self, states):
+        self.states = states
+        self.heap = [(due, -lapses, qid) for qid, (_, due, lapses, _) in states.items()]
+        heapq.heapify(self.heap)
+
+    def update(self, qid, state):
+        self.states[qid] = state
+        heapq.heappush(self.heap, (state[1], -state[2], qid))
+        if len(self.heap) > 2 * len(self.states) + 16:
+            self.heap = [(due, -lapses, q) for q, (_, due, lapses, _) in self.states.items()]
+            heapq.heapify(self.heap)
+
+    def due(self, now, limit, skip):
+        """До ``limit`` вопросов, срок которых наступил, в порядке срочности (без ``skip``)."""
+        taken, popped = [], []
+        heap = self.heap
+        while heap and len(taken) < limit and heap[0][0] <= now:
+            entry = heapq.heappop(heap)
+            state = self.states.get(entry[2])
+            if state is None or (state[1], -state[2]) != entry[:2]:
+                continue
+            popped.append(entry)
+            if entry[2] not in skip:
+                taken.append(entry[2])
+        # Вопросы остаются в колоде до ответа: возвращаем записи в кучу
+        for entry in popped:
+            heapq.heappush(heap, entry)
+        return taken
+
+
+class QuizScheduler:
+    """Подбор вопросов викторины по интервальному повторению.
+
+    Для каждого вопроса, на который пользователь отвечал, в ``question_state``
+    (progress.db) хранится ступень, срок следующего повторения, число ошибок и
+    попыток. Колода активного пользователя загружается одним запросом по
+    первичному ключу и держится в памяти как куча по сроку, поэтому выбор
+    вопроса и перепланирование после ответа — O(log n) без чтения истории.
+    Колод в памяти не больше ``max_users``, давно не использованные вытесняются.
+    """
+
+    def __init__(self, db, resolve_question, size=SR_QUIZ_SIZE, max_users=SR_MAX_USERS):
+        self.db = db
+        self.resolve_question = resolve_question
+        self.size = size
+        self._decks = UserCache(self._load, max_users)  # user_id -> _Deck
+
+    def __len__(self):
+        return len(self._decks)
+
+    @staticmethod
+    def _load_states(c, user_id):
+        rows = c.execute('SELECT question_id, box, due, lapses, attempts FROM question_state WHERE user_id=?',
+                         (user_id,)).fetchall()
+        return {qid: (box, due, lapses, attempts) for qid, box, due, lapses, attempts in rows}
+
+    async def _load(self, user_id):
+        return _Deck(await self.db.read(self._load_states, user_id))
+
+    async def select(self, user_id, lesson, knowledge_level=3):
+        """Вопросы викторины по уроку ``lesson``: сначала урок, затем повторение пройденного.
+
+        Из урока берутся вопросы, срок которых наступил (с ошибками — раньше),
+        затем новые в порядке файла, затем ближайшие к сроку; места для повторения
+        других уроков зависят от ``knowledge_level``.
+        """
+        deck = await self._decks.get(user_id)
+        now = time.time()
+        lesson_ids = {q.qid for q in lesson.questions}
+        review = []
+        for qid in deck.due(now, review_slots(knowledge_level, self.size), lesson_ids):
+            question = self.resolve_question(qid)
+            if question is not None:
+                review.append(question)
+
+        def rank(item):
+            index, q = item
+            state = deck.states.get(q.qid)
+            if state is None:
+                return 1, index, 0
+            return (0 if state[1] <= now else 2), state[1], -state[2]
+
+        ordered = [q for _, q in sorted(enumerate(lesson.questions), key=rank)]
+        own = ordered[:max(self.size - len(review), 1)]
+        for q in own:
+            state = deck.states.get(q.qid)
+            questions_served.inc(kind="new" if state is None else "due" if state[1] <= now else "early")
+        if review:
+            questions_served.inc(len(review), kind="review")
+        return own + review
+
+    async def record(self, user_id, results, knowledge_level=3):
+        """Новые состояния вопросов после викторины; ``results`` — [(id вопроса, ответ, верно ли), ...].
+
+        Возвращает строки для ``save_states`` в той же транзакции, что и итог викторины.
+        Колода в памяти не меняется: после фиксации транзакции строки передаются в ``apply``.
+        """
+        deck = await self._decks.get(user_id)
+        now = time.time()
+        states = {}
+        for qid, _, correct in results:
+            states[qid] = next_state(states.get(qid) or deck.states.get(qid), correct, knowledge_level, now)
+        return [(user_id, qid, *state) for qid, state in states.items()]
+
+    def apply(self, user_id, rows):
+        """Переносит в колоду строки ``record``, уже записанные в ``question_state``."""
+        deck = self._decks.peek(user_id)
+        # Вытесненная колода при следующем обращении загрузится из базы уже с этими строками
+        if deck is None:
+            return
+        for _, qid, *state in rows:
+            deck.update(qid, tuple(state))
+
+
+def save_states(c, rows):
+    c.executemany('''
+        INSERT INTO question_state (user_id, question_id, box, due, lapses, attempts) VALUES (?,?,?,?,?,?)
+        ON CONFLICT(user_id, question_id) DO UPDATE SET
+          box = excluded.box, due = excluded.due, lapses = excluded.lapses, attempts = excluded.attempts
+    ''', rows)
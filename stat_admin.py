@@ -1,13 +1,28 @@
 # stat_admin.py
-import sqlite3
+import asyncio
+import logging
 import os
+import time
+
+import metrics
+from migrations import migrate
+from storage import get_database
+
+logger = logging.getLogger(__name__)
 
 DB_PATH = os.path.join(os.getcwd(), 'database', 'users.db')
 
-def initialize_db():
-    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
+# Параметры отложенной записи диалогов
+DIALOGUE_FLUSH_SIZE = int(os.getenv("DIALOGUE_FLUSH_SIZE", "200"))
+DIALOGUE_FLUSH_INTERVAL = float(os.getenv("DIALOGUE_FLUSH_INTERVAL", "1.0"))
+DIALOGUE_MAX_QUEUE = int(os.getenv("DIALOGUE_MAX_QUEUE", "50000"))
+
+# Общий пул соединений к users.db
+users_db = get_database(DB_PATH)
+
+
+def _create_tables(c):
+    """Журнал диалогов"""
     c.execute('''
     CREATE TABLE IF NOT EXISTS dialogues (
       id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -17,12 +32,231 @@ def initialize_db():
       timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
     )
     ''')
-    conn.commit()
-    conn.close()
+
+
+def _add_dialogue_memory(c):
+    """Индекс реплик пользователя и сводки диалогов"""
+    # Последние реплики пользователя для памяти диалога (conversation_memory.py); на большой таблице
+    # строится один раз при обновлении — ORDER BY timestamp DESC, id DESC читается прямо из индекса
+    c.execute('CREATE INDEX IF NOT EXISTS idx_dialogues_user_time ON dialogues (user_id, timestamp)')
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS dialogue_summaries (
+      user_id INTEGER PRIMARY KEY,
+      summary TEXT NOT NULL,
+      upto DATETIME,
+      updated DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+
+
+# Схема users.db по версиям (см. migrations.py); новые миграции — только в конец списка
+MIGRATIONS = [_create_tables, _add_dialogue_memory]
+
+
+def initialize_db():
+    migrate(users_db, MIGRATIONS)
+
+
+class DialogueLogger:
+    """Буферизованная запись диалогов в users.db.
+
+    ``log`` только кладет строку в память; фоновая задача сбрасывает буфер
+    одной транзакцией (executemany), когда набирается ``flush_size`` строк или
+    проходит ``flush_interval`` секунд. Если буфер достиг ``max_queue``, новые
+    строки отбрасываются и учитываются в счетчике ``dropped``.
+    """
+
+    INSERT_SQL = 'INSERT INTO dialogues (user_id, role, message, timestamp) VALUES (?,?,?,?)'
+
+    def __init__(self, db, flush_size=DIALOGUE_FLUSH_SIZE, flush_interval=DIALOGUE_FLUSH_INTERVAL,
+                 max_queue=DIALOGUE_MAX_QUEUE):
+        self.db = db
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self._buffer = []
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._stopping = False
+        self.dropped = 0
+        self.flushed = 0
+        self.flushes = 0
+
+    @property
+    def queue_depth(self):
+        return len(self._buffer)
+
+    def log(self, user_id, role, message):
+        if len(self._buffer) >= self.max_queue:
+            self.dropped += 1
+            return
+        # Время фиксируем в момент сообщения, а не в момент сброса (формат как у CURRENT_TIMESTAMP)
+        self._buffer.append((user_id, role, message, time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())))
+        if len(self._buffer) >= self.flush_size:
+            self._wakeup.set()
+
+    async def flush(self):
+        """Дописывает буфер в базу; если сброс уже идет, сначала дожидается его окончания."""
+        async with self._flush_lock:
+            if not self._buffer:
+                return 0
+            rows, self._buffer = self._buffer, []
+            try:
+                await self.db.executemany(self.INSERT_SQL, rows)
+            except Exception:
+                # Возвращаем строки в начало буфера, лишнее сверх лимита считаем потерянным
+                free = max(0, self.max_queue - len(self._buffer))
+                self.dropped += max(0, len(rows) - free)
+                self._buffer[:0] = rows[:free]
+                raise
+            self.flushed += len(rows)
+            self.flushes += 1
+            return len(rows)
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка при записи диалогов в базу данных: {e}")
+
+    def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self, attempts=3):
+        """Останавливает фоновую задачу и дописывает все, что осталось в буфере."""
+        self._stopping = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        for _ in range(attempts):
+            try:
+                await self.flush()
+                break
+            except Exception as e:
+                logger.error(f"Ошибка при финальной записи диалогов: {e}")
+        if self._buffer:
+            logger.error(f"Не удалось записать {len(self._buffer)} строк диалогов при остановке")
+            self.dropped += len(self._buffer)
+            self._buffer = []
+
+
+dialogue_logger = DialogueLogger(users_db)
+
+metrics.gauge("dialogue_log_queue_depth", "Строк диалогов в буфере записи",
+              fn=lambda: dialogue_logger.queue_depth)
+metrics.counter("dialogue_log_dropped_total", "Отброшено строк диалогов",
+                fn=lambda: dialogue_logger.dropped)
+metrics.counter("dialogue_log_flushed_total", "Записано строк диалогов",
+                fn=lambda: dialogue_logger.flushed)
+
 
 def log_dialogue(user_id, role, message):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('INSERT INTO dialogues (user_id, role, message) VALUES (?,?,?)', (user_id, role, message))
-    conn.commit()
-    conn.close()
+    dialogue_logger.log(user_id, role, message)
+
+
+# Выгрузки и отчеты для администраторов:
+#
+#   python stat_admin.py top -n 20
+#   python stat_admin.py hardest -n 20
+#   python stat_admin.py modules
+#   python stat_admin.py export answers -o answers.csv
+
+EXPORTS = {
+    "leaderboard": ("progress", 'SELECT user_id, name, diabetes_type, knowledge_level, points '
+                                'FROM users ORDER BY points DESC'),
+    "questions": ("progress", 'SELECT question_id, module_id, lesson_id, attempts, wrong, error_rate '
+                              'FROM question_stats ORDER BY error_rate DESC'),
+    "modules": ("progress", 'SELECT module_id, quizzes, passed, CAST(passed AS REAL) / quizzes AS pass_rate, '
+                            'CAST(score AS REAL) / MAX(questions, 1) AS correct_rate FROM module_stats'),
+    "progress": ("progress", 'SELECT user_id, module_id, lesson_id, completed FROM progress'),
+    "answers": ("progress", 'SELECT user_id, question_id, answer, correct, answered_at FROM quiz_answers'),
+    "dialogues": ("users", 'SELECT id, user_id, role, message, timestamp FROM dialogues ORDER BY id'),
+}
+EXPORT_CHUNK_SIZE = 100000
+
+
+def _question_texts():
+    from content_catalog import build_catalog
+
+    try:
+        return {qid: q.text for qid, q in build_catalog('content.json').questions_by_id.items()}
+    except Exception as e:
+        logger.warning(f"Тексты вопросов недоступны, content.json не загружен: {e}")
+        return {}
+
+
+def export_csv(name, path, chunksize=EXPORT_CHUNK_SIZE):
+    """Выгружает таблицу ``name`` из EXPORTS в CSV по частям, не загружая ее в память целиком."""
+    import pandas as pd
+    from progress_db_setup import progress_db
+
+    source, sql = EXPORTS[name]
+    db = progress_db if source == "progress" else users_db
+    texts = _question_texts() if name == "questions" else None
+
+    def run(conn):
+        rows = 0
+        for i, chunk in enumerate(pd.read_sql_query(sql, conn, chunksize=chunksize)):
+            if texts is not None:
+                chunk["question"] = chunk["question_id"].map(texts)
+            # utf-8-sig — чтобы Excel правильно открыл кириллицу
+            chunk.to_csv(path, mode="w" if i == 0 else "a", header=i == 0, index=False,
+                         encoding="utf-8-sig" if i == 0 else "utf-8")
+            rows += len(chunk)
+        return rows
+
+    return db.read_sync(run)
+
+
+def main():
+    import argparse
+
+    import analytics
+    from progress_db_setup import progress_db, setup_progress_db
+
+    parser = argparse.ArgumentParser(description="Статистика школы диабета для администраторов")
+    sub = parser.add_subparsers(dest="command", required=True)
+    top = sub.add_parser("top", help="рейтинг пользователей по очкам")
+    top.add_argument("-n", type=int, default=10)
+    hardest = sub.add_parser("hardest", help="вопросы с наибольшей долей ошибок")
+    hardest.add_argument("-n", type=int, default=10)
+    hardest.add_argument("--min-attempts", type=int, default=analytics.HARDEST_MIN_ATTEMPTS)
+    sub.add_parser("modules", help="проходимость модулей")
+    export = sub.add_parser("export", help="выгрузка таблицы в CSV")
+    export.add_argument("table", choices=sorted(EXPORTS))
+    export.add_argument("-o", "--output", help="файл CSV (по умолчанию <таблица>.csv)")
+    export.add_argument("--chunksize", type=int, default=EXPORT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.WARNING)
+    initialize_db()
+    setup_progress_db()
+    if args.command == "top":
+        for place, (user_id, name, points) in enumerate(progress_db.read_sync(analytics.leaderboard, args.n), 1):
+            print(f"{place:4d}. {points:6d}  {name or ''} ({user_id})")
+    elif args.command == "hardest":
+        texts = _question_texts()
+        for qid, attempts, wrong, error_rate in progress_db.read_sync(analytics.hardest_questions, args.n,
+                                                                       args.min_attempts):
+            print(f"{error_rate:6.1%} {wrong:6d}/{attempts:<6d} {qid}  {texts.get(qid, '')[:100]}")
+    elif args.command == "modules":
+        for module_id, quizzes, passed, pass_rate, correct_rate in progress_db.read_sync(analytics.module_pass_rates):
+            print(f"{module_id:20s} сдано {passed}/{quizzes} ({pass_rate:.0%}), верных ответов {correct_rate:.0%}")
+    else:
+        path = args.output or f"{args.table}.csv"
+        rows = export_csv(args.table, path, args.chunksize)
+        print(f"{args.table}: {rows} строк записано в {path}")
+
+
+if __name__ == "__main__":
+    main()
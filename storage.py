@@ -0,0 +1,156 @@
+# storage.py
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+SQLITE_POOL_SIZE = int(os.getenv("SQLITE_POOL_SIZE", "4"))
+SQLITE_BUSY_TIMEOUT = float(os.getenv("SQLITE_BUSY_TIMEOUT", "30"))
+
+query_seconds = metrics.histogram(
+    "sqlite_query_seconds", "Выполнение запроса или транзакции SQLite на потоке пула, с",
+    labelnames=("db", "kind"), buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0, 5.0))
+pool_wait_seconds = metrics.histogram(
+    "sqlite_pool_wait_seconds", "Ожидание свободного потока пула соединений SQLite, с",
+    labelnames=("db",), buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0, 5.0))
+lock_wait_seconds = metrics.histogram(
+    "sqlite_lock_wait_seconds", "Ожидание блокировки записи SQLite (BEGIN IMMEDIATE), с",
+    labelnames=("db",), buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0, 5.0))
+
+
+class Database:
+    """Пул долгоживущих соединений SQLite, работающий вне цикла событий.
+
+    Каждый поток выделенного пула держит свое соединение (WAL,
+    synchronous=NORMAL), поэтому обработчики бота не открывают файл
+    и не ждут диска на потоке цикла событий. Записи выполняются в
+    транзакции BEGIN IMMEDIATE; время ожидания блокировки записи
+    накапливается в ``stats``.
+    """
+
+    def __init__(self, path, pool_size=SQLITE_POOL_SIZE, busy_timeout=SQLITE_BUSY_TIMEOUT):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=pool_size,
+            thread_name_prefix=f"sqlite-{os.path.basename(path)}",
+        )
+        self.stats = {"queries": 0, "lock_wait_seconds": 0.0, "lock_wait_max": 0.0}
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            # isolation_level=None: транзакциями управляем сами (BEGIN IMMEDIATE / COMMIT)
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout,
+                                   isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _read(self, fn, args, submitted):
+        t0 = time.perf_counter()
+        pool_wait_seconds.observe(t0 - submitted, db=self.name)
+        conn = self._connection()
+        with self._lock:
+            self.stats["queries"] += 1
+        try:
+            return fn(conn, *args)
+        finally:
+            query_seconds.observe(time.perf_counter() - t0, db=self.name, kind="read")
+
+    def _write(self, fn, args, submitted):
+        t0 = time.perf_counter()
+        pool_wait_seconds.observe(t0 - submitted, db=self.name)
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        waited = time.perf_counter() - t0
+        lock_wait_seconds.observe(waited, db=self.name)
+        with self._lock:
+            self.stats["queries"] += 1
+            self.stats["lock_wait_seconds"] += waited
+            self.stats["lock_wait_max"] = max(self.stats["lock_wait_max"], waited)
+        try:
+            try:
+                result = fn(conn, *args)
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        finally:
+            query_seconds.observe(time.perf_counter() - t0, db=self.name, kind="write")
+        return result
+
+    # Асинхронный интерфейс для обработчиков бота
+
+    async def read(self, fn, *args):
+        """Выполняет ``fn(conn, *args)`` на потоке пула без транзакции записи."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._read, fn, args, time.perf_counter())
+
+    async def transaction(self, fn, *args):
+        """Выполняет ``fn(conn, *args)`` в одной транзакции записи на потоке пула."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._write, fn, args, time.perf_counter())
+
+    async def execute(self, sql, params=()):
+        return await self.transaction(lambda conn: conn.execute(sql, params).rowcount)
+
+    async def executemany(self, sql, seq_of_params):
+        return await self.transaction(lambda conn: conn.executemany(sql, seq_of_params).rowcount)
+
+    async def fetchone(self, sql, params=()):
+        return await self.read(lambda conn: conn.execute(sql, params).fetchone())
+
+    async def fetchall(self, sql, params=()):
+        return await self.read(lambda conn: conn.execute(sql, params).fetchall())
+
+    # Синхронный интерфейс для инициализации и утилит командной строки
+
+    def transaction_sync(self, fn, *args):
+        return self._executor.submit(self._write, fn, args, time.perf_counter()).result()
+
+    def read_sync(self, fn, *args):
+        return self._executor.submit(self._read, fn, args, time.perf_counter()).result()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+
+
+_databases = {}
+_databases_lock = threading.Lock()
+
+
+def get_database(path):
+    """Возвращает общий для процесса пул соединений к файлу ``path``."""
+    with _databases_lock:
+        db = _databases.get(path)
+        if db is None:
+            db = _databases[path] = Database(path)
+        return db
+
+
+def close_all():
+    with _databases_lock:
+        for path, db in list(_databases.items()):
+            logger.info(f"Закрытие соединений с базой данных: {path}")
+            db.close()
+        _databases.clear()
@@ -0,0 +1,127 @@
+# streaming.py
+import asyncio
+import logging
+import os
+import time
+
+from telegram.constants import ChatAction, MessageLimit
+from telegram.error import BadRequest, RetryAfter
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+LLM_STREAMING = os.getenv("LLM_STREAMING", "1") == "1"
+# Не чаще одного редактирования сообщения в STREAM_EDIT_INTERVAL секунд (ограничения Telegram на флуд)
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.5"))
+# Telegram показывает "печатает..." около 5 секунд, обновляем чуть чаще
+TYPING_INTERVAL = 4.0
+EMPTY_REPLY_TEXT = "Не удалось получить ответ. Пожалуйста, переформулируйте вопрос."
+INTERRUPTED_NOTICE = "\n\n(Ответ прерван. Пожалуйста, повторите вопрос.)"
+
+first_chunk_seconds = metrics.histogram(
+    "llm_reply_first_chunk_seconds", "Время от получения вопроса до первого фрагмента ответа в чате, с")
+reply_seconds = metrics.histogram(
+    "llm_reply_seconds", "Время от получения вопроса до полного ответа в чате, с")
+stream_edits_total = metrics.counter("llm_stream_edits_total", "Редактирования сообщений при потоковом ответе")
+
+
+class StreamingReply:
+    """Показывает ответ OpenAI по мере генерации.
+
+    Пока нет первого фрагмента, в чате висит индикатор "печатает...".
+    Первый фрагмент отправляется новым сообщением сразу, дальше текст
+    дописывается через edit_message_text не чаще раза в ``edit_interval``
+    секунд: все фрагменты, пришедшие между правками, объединяются в одну.
+    Если поток оборвался после первого фрагмента, сообщение помечается как
+    прерванное (``interrupted``); пустой ответ заменяется сообщением об этом.
+    """
+
+    def __init__(self, bot, chat_id, started=None, edit_interval=STREAM_EDIT_INTERVAL):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.started = started if started is not None else time.perf_counter()
+        self.edit_interval = edit_interval
+        self.text = ""
+        self.message = None
+        self.interrupted = False
+        self._sent_text = ""
+        self._first_sent = asyncio.Event()
+        self._done = asyncio.Event()
+
+    async def _typing(self):
+        while not self._first_sent.is_set():
+            try:
+                await self.bot.send_chat_action(self.chat_id, ChatAction.TYPING)
+            except Exception as e:
+                logger.debug(f"Не удалось отправить индикатор набора в чат {self.chat_id}: {e}")
+            try:
+                await asyncio.wait_for(self._first_sent.wait(), TYPING_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _edit(self):
+        text = self.text[:MessageLimit.MAX_TEXT_LENGTH]
+        if text == self._sent_text:
+            return
+        while True:
+            try:
+                await self.message.edit_text(text)
+            except RetryAfter as e:
+                logger.warning(f"Telegram просит подождать {e.retry_after} с перед правкой сообщения в чате {self.chat_id}")
+                await asyncio.sleep(e.retry_after)
+                continue
+            except BadRequest as e:
+                # "Message is not modified" и подобные — не повод прерывать ответ
+                logger.debug(f"Правка сообщения в чате {self.chat_id} не выполнена: {e}")
+            break
+        self._sent_text = text
+        stream_edits_total.inc()
+
+    async def _editor(self):
+        await self._first_sent.wait()
+        while not self._done.is_set():
+            try:
+                await asyncio.wait_for(self._done.wait(), self.edit_interval)
+            except asyncio.TimeoutError:
+                await self._edit()
+
+    async def _mark_interrupted(self):
+        # Часть ответа уже в чате: дописываем, что он оборван, чтобы его не приняли за полный
+        self.text = self.text.strip()[:MessageLimit.MAX_TEXT_LENGTH - len(INTERRUPTED_NOTICE)] + INTERRUPTED_NOTICE
+        try:
+            await self._edit()
+        except Exception as e:
+            logger.warning(f"Не удалось пометить прерванный ответ в чате {self.chat_id}: {e}")
+            return
+        self.interrupted = True
+
+    async def run(self, chunks):
+        """Читает фрагменты ``chunks`` и ведет сообщение в чате; возвращает полный текст ответа."""
+        typing = asyncio.create_task(self._typing())
+        editor = asyncio.create_task(self._editor())
+        try:
+            try:
+                async for piece in chunks:
+                    self.text += piece
+                    if self.message is None and self.text.strip():
+                        self._sent_text = self.text[:MessageLimit.MAX_TEXT_LENGTH]
+                        self.message = await self.bot.send_message(self.chat_id, self._sent_text)
+                        self._first_sent.set()
+                        first_chunk_seconds.observe(time.perf_counter() - self.started)
+            finally:
+                self._first_sent.set()
+                self._done.set()
+                await asyncio.gather(typing, editor, return_exceptions=True)
+        except Exception:
+            if self.message is not None:
+                await self._mark_interrupted()
+            raise
+        self.text = self.text.strip()
+        if self.message is None:
+            # Пустой ответ или одни пробелы: пользователь не должен остаться совсем без ответа
+            self.message = await self.bot.send_message(self.chat_id, self.text or EMPTY_REPLY_TEXT)
+        else:
+            await self._edit()
+        reply_seconds.observe(time.perf_counter() - self.started)
+        return self.text
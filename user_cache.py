@@ -0,0 +1,48 @@
+# user_cache.py
+import asyncio
+from collections import OrderedDict
+
+
+class UserCache:
+    """Данные активных пользователей в памяти с вытеснением давно не использованных.
+
+    ``load(user_id)`` — корутина, которая строит данные пользователя (обычно
+    одним запросом к базе); она вызывается при первом обращении после
+    перезапуска или вытеснения. В памяти не больше ``max_users`` записей.
+    """
+
+    def __init__(self, load, max_users):
+        self.load = load
+        self.max_users = max_users
+        self._items = OrderedDict()  # user_id -> данные, в порядке обращения
+        self._loading = {}
+
+    def __len__(self):
+        return len(self._items)
+
+    def peek(self, user_id):
+        """Данные пользователя, если они уже в памяти, иначе None; без загрузки и без смены порядка."""
+        return self._items.get(user_id)
+
+    def values(self):
+        return list(self._items.values())
+
+    async def get(self, user_id):
+        item = self._items.get(user_id)
+        if item is not None:
+            self._items.move_to_end(user_id)
+            return item
+        # Одновременные обращения одного пользователя ждут одной загрузки
+        loading = self._loading.get(user_id)
+        if loading is None:
+            loading = self._loading[user_id] = asyncio.ensure_future(self.load(user_id))
+        try:
+            loaded = await loading
+        finally:
+            self._loading.pop(user_id, None)
+        item = self._items.get(user_id)
+        if item is None:
+            item = self._items[user_id] = loaded
+            while len(self._items) > self.max_users:
+                self._items.popitem(last=False)
+        return item
@@ -0,0 +1,264 @@
+# webhook.py
+#
+# Режим webhook: Telegram присылает обновления POST-запросами на WEBHOOK_URL.
+#
+# Фронтальный процесс — HTTP-сервер aiohttp — только проверяет секрет,
+# определяет чат обновления и кладет JSON в очередь одного из WEBHOOK_WORKERS
+# процессов-обработчиков (номер = chat_id % WEBHOOK_WORKERS). Все обновления
+# одного чата всегда попадают в один процесс и обрабатываются по порядку,
+# поэтому состояние ConversationHandler и user_data пользователя живут в
+# одном месте. Процессы делят базы SQLite (WAL, BEGIN IMMEDIATE, busy_timeout),
+# а хранилище состояний каждый из них читает и пишет только для своих чатов.
+#
+#   WEBHOOK_URL=https://bot.example.com/telegram WEBHOOK_SECRET=... python webhook.py
+#
+# Запускать только этот файл: процессы-обработчики стартуют через spawn и заново
+# выполняют главный модуль, а bot.py импортируют уже внутри обработчика.
+#
+# Локальная проверка без Telegram (см. benchmarks/fake_bot_api.py и benchmarks/replay_updates.py):
+#
+#   python benchmarks/fake_bot_api.py --port 8081 &
+#   TELEGRAM_BASE_URL=http://127.0.0.1:8081/bot WEBHOOK_URL=http://127.0.0.1:8443/telegram python webhook.py
+#   python benchmarks/replay_updates.py benchmarks/sample_updates.jsonl --url http://127.0.0.1:8443/telegram
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+from urllib.parse import urlsplit
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import metrics  # noqa: E402
+from monitoring import Monitoring, setup_logging  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+# Путь, на который Telegram шлет обновления; по умолчанию — путь из WEBHOOK_URL
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH") or (urlsplit(WEBHOOK_URL).path if WEBHOOK_URL else "") or "/telegram"
+# Секрет из заголовка X-Telegram-Bot-Api-Secret-Token (передается Telegram в setWebhook)
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+# Каждый процесс держит свою модель эмбеддингов и кэш ответов, поэтому по умолчанию не больше 4
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Необработанных обновлений в очереди одного процесса; сверх этого отвечаем 503 и Telegram повторит позже
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+# Вызывать ли setWebhook при старте (выключают, если webhook регистрируется отдельно)
+WEBHOOK_SET = os.getenv("WEBHOOK_SET", "1") == "1"
+WORKER_CHECK_INTERVAL = 5.0
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def update_chat_id(update):
+    """Id чата, к которому относится обновление (dict из JSON Bot API).
+
+    Для обновлений без чата (inline-запросы и т.п.) — id пользователя,
+    в крайнем случае update_id, чтобы обновление все равно куда-то попало.
+    """
+    for key in ("message", "edited_message", "channel_post", "edited_channel_post"):
+        if key in update:
+            return update[key]["chat"]["id"]
+    callback = update.get("callback_query")
+    if callback is not None and callback.get("message"):
+        return callback["message"]["chat"]["id"]
+    for value in update.values():
+        if isinstance(value, dict) and isinstance(value.get("from"), dict):
+            return value["from"]["id"]
+    return update.get("update_id", 0)
+
+
+# Процесс-обработчик
+
+async def _run_worker(index, count, updates):
+    import bot
+    from telegram import Update
+
+    application = bot.build_application(with_updater=False, shard=(index, count))
+    loop = asyncio.get_running_loop()
+    # post_init/post_shutdown вызывает только run_polling/run_webhook, здесь запускаем их сами
+    async with application:
+        await bot.on_startup(application)
+        await application.start()
+        logger.info(f"Обработчик {index + 1}/{count} запущен")
+        try:
+            while True:
+                raw = await loop.run_in_executor(None, updates.get)
+                if raw is None:
+                    break
+                try:
+                    update = Update.de_json(json.loads(raw), application.bot)
+                except Exception as e:
+                    logger.error(f"Обработчик {index + 1}: некорректное обновление пропущено: {e}")
+                    continue
+                await application.update_queue.put(update)
+        finally:
+            # stop() дожидается обновлений, уже лежащих в update_queue; выход из async with сохраняет состояния
+            await application.stop()
+    await bot.on_shutdown(application)
+    logger.info(f"Обработчик {index + 1}/{count} остановлен")
+
+
+def _worker_main(index, count, updates):
+    # Останавливает обработчик фронтальный процесс (через очередь), а не сигнал, пришедший всей группе процессов
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    setup_logging()
+    asyncio.run(_run_worker(index, count, updates))
+
+
+# Фронтальный HTTP-сервер
+
+class WebhookServer:
+    """Принимает обновления от Telegram и раздает их процессам по chat_id."""
+
+    def __init__(self, workers=WEBHOOK_WORKERS, queue_size=WEBHOOK_QUEUE_SIZE, secret=WEBHOOK_SECRET,
+                 path=WEBHOOK_PATH):
+        self.count = workers
+        self.secret = secret
+        self.path = path
+        self._context = multiprocessing.get_context("spawn")
+        self.queues = [self._context.Queue(queue_size) for _ in range(workers)]
+        self.processes = [None] * workers
+        self.stats = {"received": 0, "rejected": 0, "restarts": 0}
+        metrics.counter("webhook_updates_received_total", "Обновлений принято и передано обработчикам",
+                        fn=lambda: self.stats["received"])
+        metrics.counter("webhook_updates_rejected_total", "Обновлений отклонено из-за переполненной очереди",
+                        fn=lambda: self.stats["rejected"])
+        metrics.counter("webhook_worker_restarts_total", "Перезапусков упавших обработчиков",
+                        fn=lambda: self.stats["restarts"])
+
+    def _start_worker(self, index):
+        process = self._context.Process(target=_worker_main, args=(index, self.count, self.queues[index]),
+                                        name=f"bot-worker-{index}", daemon=False)
+        process.start()
+        self.processes[index] = process
+
+    def start_workers(self):
+        for index in range(self.count):
+            self._start_worker(index)
+
+    async def _watch_workers(self):
+        while True:
+            await asyncio.sleep(WORKER_CHECK_INTERVAL)
+            for index, process in enumerate(self.processes):
+                if not process.is_alive():
+                    logger.error(f"Обработчик {index + 1} завершился с кодом {process.exitcode}, перезапуск")
+                    self.stats["restarts"] += 1
+                    self._start_worker(index)
+
+    async def stop_workers(self, timeout=60):
+        loop = asyncio.get_running_loop()
+        for q in self.queues:
+            await loop.run_in_executor(None, q.put, None)
+        for index, process in enumerate(self.processes):
+            await loop.run_in_executor(None, process.join, timeout)
+            if process.is_alive():
+                logger.error(f"Обработчик {index + 1} не остановился за {timeout} с, завершаем принудительно")
+                process.terminate()
+
+    # aiohttp нужен только фронтальному процессу; процессы-обработчики заново импортируют этот модуль
+    # (multiprocessing spawn), поэтому он импортируется внутри функций фронтального сервера
+
+    async def handle_update(self, request):
+        from aiohttp import web
+
+        if self.secret and request.headers.get(SECRET_HEADER) != self.secret:
+            return web.Response(status=403)
+        raw = await request.text()
+        try:
+            chat_id = update_chat_id(json.loads(raw))
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return web.Response(status=400)
+        try:
+            self.queues[chat_id % self.count].put_nowait(raw)
+        except queue.Full:
+            self.stats["rejected"] += 1
+            logger.warning(f"Очередь обработчика {chat_id % self.count + 1} заполнена, обновление отклонено")
+            return web.Response(status=503)
+        self.stats["received"] += 1
+        return web.Response()
+
+    async def health(self, request):
+        from aiohttp import web
+
+        alive = [p is not None and p.is_alive() for p in self.processes]
+        return web.json_response({"workers": alive, **self.stats}, status=200 if all(alive) else 503)
+
+    def make_app(self):
+        from aiohttp import web
+
+        app = web.Application()
+        app.router.add_post(self.path, self.handle_update)
+        app.router.add_get("/healthz", self.health)
+        return app
+
+
+def _prepare_databases():
+    # Таблицы создаем один раз до запуска обработчиков, чтобы процессы не спорили за блокировку схемы
+    import stat_admin
+    import storage
+    from persistence import STATE_DB_PATH, _create_tables
+    from progress_db_setup import setup_progress_db
+
+    stat_admin.initialize_db()
+    setup_progress_db()
+    storage.get_database(STATE_DB_PATH).transaction_sync(_create_tables)
+    storage.close_all()
+
+
+async def _set_webhook():
+    from telegram import Bot, Update
+
+    token = os.getenv("TELEGRAM_BOT_TOKEN")
+    base_url = os.getenv("TELEGRAM_BASE_URL") or "https://api.telegram.org/bot"
+    async with Bot(token, base_url=base_url) as tg:
+        await tg.set_webhook(WEBHOOK_URL, secret_token=WEBHOOK_SECRET, allowed_updates=Update.ALL_TYPES,
+                             max_connections=100)
+    logger.info(f"Webhook установлен: {WEBHOOK_URL}")
+
+
+async def _serve(server, host, port):
+    from aiohttp import web
+
+    monitoring = Monitoring()
+    await monitoring.start()
+    # Журнал доступа aiohttp писал бы строку на каждое обновление
+    runner = web.AppRunner(server.make_app(), access_log=None)
+    await runner.setup()
+    server.start_workers()
+    watcher = asyncio.create_task(server._watch_workers())
+    stopped = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stopped.set)
+    try:
+        if WEBHOOK_SET and WEBHOOK_URL:
+            await _set_webhook()
+        await web.TCPSite(runner, host, port).start()
+        logger.info(f"Webhook слушает {host}:{port}{server.path}, обработчиков: {server.count}")
+        await stopped.wait()
+    finally:
+        watcher.cancel()
+        # Сначала перестаем принимать обновления, затем даем обработчикам дописать очереди
+        await runner.cleanup()
+        await server.stop_workers()
+        await monitoring.stop()
+        logger.info(f"Webhook остановлен: принято {server.stats['received']}, отклонено {server.stats['rejected']}")
+
+
+def serve(host=WEBHOOK_LISTEN, port=WEBHOOK_PORT, workers=WEBHOOK_WORKERS):
+    """Запускает фронтальный сервер и процессы-обработчики; работает до Ctrl+C/SIGTERM."""
+    setup_logging()
+    _prepare_databases()
+    asyncio.run(_serve(WebhookServer(workers), host, port))
+
+
+if __name__ == "__main__":
+    serve()